@@ -1,11 +1,14 @@
+import argparse
 import os
-import json
 import gzip
 from datetime import datetime
 from elasticsearch_dsl import connections, Document, Integer, Keyword, Text, Nested, Object, Float
 from elasticsearch.helpers import parallel_bulk
 from elasticsearch import Elasticsearch
 from path import data_path
+import staging
+from project import setup_django
+from fastjson import loads
 
 connections.create_connection(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
 client = Elasticsearch(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
@@ -97,64 +100,103 @@ class ScholarDocument(Document):
         }
 
 
+# 用户维护的字段, OpenAlex中没有, 导入时置空, 增量同步时不能覆盖
+MANUAL_FIELDS = ["user_id", "education_background", "personal_summary", "work_experience",
+                 "avatar", "chinese_name", "title", "phone", "fax", "email", "address",
+                 "personal_website", "official_website", "google", "twitter", "facebook",
+                 "youtube", "gender", "language"]
+MANUAL_DEFAULTS = dict.fromkeys(MANUAL_FIELDS)
+
+
+def transform(data):
+    x_concepts = [
+        {
+            "id": x_concept["id"],
+            "wikidata": x_concept["wikidata"],
+            "display_name": x_concept["display_name"],
+            "level": x_concept["level"],
+            "score": x_concept["score"],
+        }
+        for x_concept in data['x_concepts'][0:10]
+    ]
+    author = {
+        "id": data["id"],
+        "cited_by_count": data["cited_by_count"],
+        "counts_by_year": data["counts_by_year"],
+        "display_name": data["display_name"],
+        "works_count": data["works_count"],
+        "summary_stats": data["summary_stats"],
+        "last_known_institution": data["last_known_institution"],
+        "x_concepts": x_concepts,
+    }
+    author.update(MANUAL_DEFAULTS)
+    # 设置默认头像
+    # data['avatar'] = "http://nobc.buaa-q9k.xyz/default_author.png?e=1703243365&token=yMU1x7iZW8SmH14FmEP0sjoG1yflO_NJKtsoOGwk:yxy22yLr7nhjKf6hJCUf77hmFB8="
+    return author
+
+
 def generate_actions(file_name):
-    with gzip.open(file_name, 'rt', encoding='utf-8') as file:
-        lines = file.readlines()
-        for line in lines:
-            data = json.loads(line)
-            properties_to_extract = ["id", "cited_by_count", "counts_by_year", "display_name",
-                                     "works_count", "summary_stats", "last_known_institution", "x_concepts"]
-            data = {key: data[key] for key in properties_to_extract}
-
-            x_concepts = []
-            for x_concept in data['x_concepts'][0:10]:
-                properties_to_extract = ["id", "wikidata", "display_name", "level", "score"]
-                x_concept = {key: x_concept[key] for key in properties_to_extract}
-                x_concepts.append(x_concept)
-            data['x_concepts'] = x_concepts
-
-            properties_to_manual_set = ["user_id", "education_background", "personal_summary", "work_experience",
-                                        "avatar", "chinese_name", "title", "phone", "fax", "email", "address",
-                                        "personal_website", "official_website", "google", "twitter", "facebook",
-                                        "youtube", "gender", "language"]
-
-            for key in properties_to_manual_set:
-                data[key] = None
-
-            # 设置默认头像
-            # data['avatar'] = "http://nobc.buaa-q9k.xyz/default_author.png?e=1703243365&token=yMU1x7iZW8SmH14FmEP0sjoG1yflO_NJKtsoOGwk:yxy22yLr7nhjKf6hJCUf77hmFB8="
-
-            document = {
+    with gzip.open(file_name, 'rb') as file:
+        for line in file:
+            data = transform(loads(line))
+            yield {
                 '_index': 'author',
                 '_op_type': 'index',
+                '_id': data['id'],
                 '_source': data
             }
-            yield document
 
 
-def run(file_name):
-    actions = generate_actions(file_name)
+def bulk(actions):
     for success, info in parallel_bulk(client=client, actions=actions, thread_count=8, queue_size=8, chunk_size=5000):
         if not success:
             print(f'Failed to index document: {info}')
 
 
-def process_files(folder):
+def run(file_name, stage_root=None):
+    """
+    :param stage_root: 不为空时把转换后的记录同时写入暂存
+    """
+    with staging.staged(generate_actions(file_name), stage_root, 'authors', file_name) as actions:
+        bulk(actions)
+
+
+def run_staged(shard):
+    """
+    从暂存分片导入, 不再解析原始json
+    """
+    bulk(staging.read_shard(shard, 'author'))
+
+
+def process_files(folder, stage_root=None):
     files = [f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
     for file in files:
-        run(os.path.join(folder, file))
+        run(os.path.join(folder, file), stage_root)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage', help='同时把转换后的记录写入该暂存目录')
+    parser.add_argument('--from-stage', help='从该暂存目录导入, 不读原始快照')
+    args = parser.parse_args()
+
     ScholarDocument.init()
     start_time = datetime.now()
     print("Start insert to ElasticSearch at {}".format(datetime.now()))
-    root_path = data_path + 'authors'
-    # 获取所有子文件夹
-    sub_folders = [f for f in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, f))]
-    for sub_folder in sub_folders:
-        folder_path = os.path.join(root_path, sub_folder)
-        process_files(folder_path)
+    if args.from_stage:
+        for shard in staging.list_shards(args.from_stage, 'authors'):
+            run_staged(shard)
+    else:
+        root_path = data_path + 'authors'
+        # 获取所有子文件夹
+        sub_folders = [f for f in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, f))]
+        for sub_folder in sub_folders:
+            folder_path = os.path.join(root_path, sub_folder)
+            process_files(folder_path, args.stage)
+    # 覆盖导入的文档version都变了, 清除缓存的学者主页
+    setup_django()
+    from author.profile import invalidate_all_profiles
+    invalidate_all_profiles()
     end_time = datetime.now()
     print("Finished insert to Elasticsearch at{}".format(end_time))
     print("cost time {}".format(end_time - start_time))
@@ -0,0 +1,44 @@
+import time
+from datetime import datetime
+from AuthorImport import ScholarDocument
+from project import get_batch_client, setup_django
+
+client = get_batch_client()
+# 旧的author索引没有设置_id, 重建到新索引并把_id设为id字段, 之后用别名author指向新索引
+OLD_INDEX = 'author'
+NEW_INDEX = 'author_v2'
+
+
+def wait_for_task(task_id):
+    while True:
+        task = client.tasks.get(task_id=task_id)
+        status = task['task']['status']
+        print('{} / {} documents'.format(status['created'] + status['updated'], status['total']))
+        if task['completed']:
+            return task
+        time.sleep(30)
+
+
+if __name__ == "__main__":
+    start_time = datetime.now()
+    print("Start reindex at {}".format(start_time))
+    ScholarDocument._index.clone(name=NEW_INDEX, using=client).create()
+    ret = client.reindex(body={
+        'source': {'index': OLD_INDEX, 'size': 5000},
+        'dest': {'index': NEW_INDEX, 'op_type': 'index'},
+        'script': {'source': 'ctx._id = ctx._source.id', 'lang': 'painless'}
+    }, wait_for_completion=False, slices='auto')
+    task = wait_for_task(ret['task'])
+    if task['response']['failures']:
+        print(task['response']['failures'])
+    else:
+        # 原索引和别名不能同名, 删除后再加别名
+        client.indices.delete(index=OLD_INDEX)
+        client.indices.put_alias(index=NEW_INDEX, name=OLD_INDEX)
+        # 新索引中文档的version都变了, 清除缓存的学者主页
+        setup_django()
+        from author.profile import invalidate_all_profiles
+        invalidate_all_profiles()
+    end_time = datetime.now()
+    print("Finished reindex at {}".format(end_time))
+    print("cost time {}".format(end_time - start_time))
@@ -1,5 +1,4 @@
 import os
-import json
 import time
 import gzip
 from tqdm import tqdm
@@ -8,9 +7,14 @@ from elasticsearch_dsl import connections, Document, Integer, Keyword, Text, Nes
 from elasticsearch.helpers import parallel_bulk
 from elasticsearch import Elasticsearch
 from path import data_path
+from fastjson import loads
 
 connections.create_connection(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
 client = Elasticsearch(hosts=['localhost'], timeout=60,http_auth=('elastic', 'buaaNOBC2121'))
+PROPERTIES = ["id", "cited_by_count", "counts_by_year", "summary_stats", "level", "display_name",
+              "works_count", "image_url", "ancestors",
+              "related_concepts", "works_api_url", "chinese_display_name",
+              "description", "chinese_description"]
 
 
 class ConceptDocument(Document):
@@ -80,14 +84,10 @@ class ConceptDocument(Document):
         }
 
 
-def run(file_name):
-    with gzip.open(file_name, 'rt', encoding='utf-8') as file:
-        i = 0
-        data_list = []
-        print("start indexing file {}".format(file_name))
-        start_time = time.perf_counter()
+def generate_actions(file_name):
+    with gzip.open(file_name, 'rb') as file:
         for line in file:
-            data = json.loads(line)
+            data = loads(line)
             for ancestor in data.get('ancestors', []):
                 ancestor['chinese_display_name'] = ''
 
@@ -111,40 +111,45 @@ def run(file_name):
                         data['chinese_description'] = description.get('zh')
                         if not data['chinese_description']:
                             data['chinese_description'] = description.get('zh-hans', '')
-            properties_to_extract = ["id", "cited_by_count", "counts_by_year", "summary_stats", "level", "display_name",
-                                     "works_count", "image_url", "ancestors",
-                                     "related_concepts", "counts_by_year", "works_api_url", "chinese_display_name",
-                                     "description", "chinese_description"]
-            data = {key: data.get(key) for key in properties_to_extract}
+            data = {key: data.get(key) for key in PROPERTIES}
 
             if data.get('id'):
-                i += 1
-                data_list.append({
+                yield {
                     "_op_type": "index",
                     "_index": "concept",
                     "_id": data.get('id'),
                     "_source": data
-                })
-            if i % 5000 == 0:
-                start_time1 = time.time()
-                for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
-                    if not ok:
-                        print(response)
-                data_list = []
-                end_time1 = time.time()
-                print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
-        if data_list:
+                }
+
+
+def run(file_name):
+    i = 0
+    data_list = []
+    print("start indexing file {}".format(file_name))
+    start_time = time.perf_counter()
+    for action in generate_actions(file_name):
+        i += 1
+        data_list.append(action)
+        if i % 5000 == 0:
             start_time1 = time.time()
-            i += 1
             for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
                 if not ok:
                     print(response)
+            data_list = []
             end_time1 = time.time()
             print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
-        end_time = time.perf_counter()
-        print(
-            "finished indexing file {} process time= {} min, end at {}".format(file_name, (end_time - start_time) / 60,
-                                                                               datetime.now()))
+    if data_list:
+        start_time1 = time.time()
+        i += 1
+        for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
+            if not ok:
+                print(response)
+        end_time1 = time.time()
+        print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
+    end_time = time.perf_counter()
+    print(
+        "finished indexing file {} process time= {} min, end at {}".format(file_name, (end_time - start_time) / 60,
+                                                                           datetime.now()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+"""
+按OpenAlex快照的manifest增量同步:
+
+    python DeltaSync.py                      # 同步所有实体
+    python DeltaSync.py --entities works authors --dry-run
+
+- 读取<data_path>/<实体>/manifest, 只导入新增或变化(大小/记录数不同)的分片, 已同步的分片记录在synced_manifest.json
+- 按_id upsert: 已存在的文档只更新OpenAlex字段, 不覆盖用户维护的字段(作者头像、简介等, 论文访问量)
+- 读取<data_path>/merged_ids/<实体>/*.csv.gz, 删除被合并的实体; 被合并作者上用户维护的字段先合并到目标作者,
+  数据库中的认证和关注转到目标作者(author/merge.py), 转不过去的(两个作者都已认证)暂不删除, 记在pending_rebind中下次重试
+- 同步作者后清除对应的学者主页缓存; 作者相关的步骤需要加载项目的django配置
+快照同步命令: aws s3 sync "s3://openalex" "/data/openalex-snapshot" --no-sign-request
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+
+from elasticsearch.helpers import parallel_bulk
+
+import AuthorImport
+import ConceptImport
+import InstitutionImport
+import SourceImport
+import WorkImport
+from path import data_path
+from project import setup_django
+
+STATE_FILE = 'synced_manifest.json'
+# 状态文件中记录待重新绑定的被合并作者[(被合并的id, 合并到的id)]
+PENDING_REBIND = 'pending_rebind'
+OPENALEX = 'https://openalex.org/'
+# 已认领(有user_id)的作者, 这些字段也由用户维护
+CLAIMED_FIELDS = ['last_known_institution']
+
+# 作者: 已存在的文档只写入OpenAlex字段, 已认领的作者跳过CLAIMED_FIELDS
+AUTHOR_UPSERT_SCRIPT = """
+boolean claimed = ctx._source.user_id != null;
+for (entry in params.doc.entrySet()) {
+    if (claimed && params.claimed.contains(entry.getKey())) {
+        continue;
+    }
+    ctx._source[entry.getKey()] = entry.getValue();
+}
+"""
+# 被合并作者上用户维护的字段, 目标作者没有时才写入
+AUTHOR_MERGE_SCRIPT = """
+for (entry in params.doc.entrySet()) {
+    if (ctx._source[entry.getKey()] == null) {
+        ctx._source[entry.getKey()] = entry.getValue();
+    }
+}
+"""
+
+
+class Entity:
+    def __init__(self, name, module, index, protected_fields=(), full_url_id=True):
+        """
+        :param name: 快照中的目录名
+        :param module: 导入脚本, 提供generate_actions和client
+        :param index: 索引名
+        :param protected_fields: 用户或系统维护的字段, 更新已存在文档时不覆盖
+        :param full_url_id: _id是否为完整url, work的_id去掉了前缀
+        """
+        self.name = name
+        self.module = module
+        self.index = index
+        self.protected_fields = protected_fields
+        self.full_url_id = full_url_id
+
+    def doc_id(self, openalex_id):
+        bare_id = openalex_id[len(OPENALEX):] if openalex_id.startswith(OPENALEX) else openalex_id
+        return OPENALEX + bare_id if self.full_url_id else bare_id
+
+    def upsert(self, action):
+        """
+        把导入脚本的index操作改成upsert, 新文档整体写入, 已存在的文档不动protected_fields
+        """
+        source = action['_source']
+        doc = {key: value for key, value in source.items() if key not in self.protected_fields}
+        update = {'_op_type': 'update', '_index': self.index, '_id': action['_id'], 'upsert': source}
+        if self.index == 'author':
+            update['script'] = {'source': AUTHOR_UPSERT_SCRIPT, 'lang': 'painless',
+                                'params': {'doc': doc, 'claimed': CLAIMED_FIELDS}}
+        else:
+            update['doc'] = doc
+        return update
+
+
+ENTITIES = {entity.name: entity for entity in [
+    Entity('works', WorkImport, 'work', protected_fields=('visit_count',), full_url_id=False),
+    Entity('authors', AuthorImport, 'author', protected_fields=tuple(AuthorImport.MANUAL_FIELDS)),
+    Entity('concepts', ConceptImport, 'concept'),
+    Entity('sources', SourceImport, 'source'),
+    Entity('institutions', InstitutionImport, 'institution'),
+]}
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, 'r') as file:
+        return json.load(file)
+
+
+def save_state(state):
+    tmp_file = STATE_FILE + '.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(tmp_file, STATE_FILE)
+
+
+def local_path(url):
+    """
+    s3://openalex/data/works/updated_date=2023-12-01/part_000.gz -> <data_path>works/updated_date=2023-12-01/part_000.gz
+    """
+    return data_path + url.split('/data/', 1)[1]
+
+
+def changed_partitions(entity, synced):
+    """
+    :param synced: {文件路径: meta} 已同步的分片
+    :return: [(文件路径, meta)] manifest中新增或变化的分片, 按updated_date先后排序
+    """
+    with open(os.path.join(data_path, entity.name, 'manifest'), 'r') as file:
+        manifest = json.load(file)
+    changed = []
+    for entry in manifest['entries']:
+        path = local_path(entry['url'])
+        meta = entry.get('meta', {})
+        if synced.get(path) != meta:
+            changed.append((path, meta))
+    changed.sort(key=lambda item: item[0])
+    return changed
+
+
+def bulk(client, actions):
+    """
+    :return: 失败数, 删除不存在的文档不算失败
+    """
+    failed = 0
+    for ok, info in parallel_bulk(client=client, actions=actions, chunk_size=2000, raise_on_error=False,
+                                  request_timeout=60):
+        if not ok:
+            op_type, result = next(iter(info.items()))
+            if op_type == 'delete' and result.get('status') == 404:
+                continue
+            failed += 1
+            if failed <= 10:
+                print(info)
+    return failed
+
+
+def sync_partition(entity, file_name):
+    if entity.index != 'author':
+        actions = (entity.upsert(action) for action in entity.module.generate_actions(file_name))
+        return bulk(entity.module.client, actions)
+    # 写入完成后再清除主页缓存, 避免清除后又被旧数据填上
+    author_ids = []
+    actions = (entity.upsert(action) for action in collect_ids(entity.module.generate_actions(file_name), author_ids))
+    failed = bulk(entity.module.client, actions)
+    invalidate_profiles(author_ids)
+    return failed
+
+
+def collect_ids(actions, ids):
+    for action in actions:
+        ids.append(action['_id'])
+        yield action
+
+
+def invalidate_profiles(author_ids):
+    from django.core.cache import cache
+    from author.profile import get_profile_key
+    for start in range(0, len(author_ids), 2000):
+        cache.delete_many([get_profile_key(author_id) for author_id in author_ids[start:start + 2000]])
+
+
+def merged_files(entity, synced):
+    folder = os.path.join(data_path, 'merged_ids', entity.name)
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+            if f.endswith('.csv.gz') and os.path.join(folder, f) not in synced]
+
+
+def read_merged_ids(file_name):
+    """
+    :return: [(被合并的id, 合并到的id)]
+    """
+    with gzip.open(file_name, 'rt', encoding='utf-8') as file:
+        return [(row['id'], row['merge_into_id']) for row in csv.DictReader(file)]
+
+
+def merge_authors(client, pairs):
+    """
+    被合并作者上用户维护的字段合并到目标作者, 目标作者已有的字段不覆盖, 可以重复执行
+    """
+    entity = ENTITIES['authors']
+    pairs = [(entity.doc_id(old_id), entity.doc_id(new_id)) for old_id, new_id in pairs]
+    actions = []
+    for start in range(0, len(pairs), 1000):
+        chunk = pairs[start:start + 1000]
+        docs = client.mget(index=entity.index, body={'ids': [old_id for old_id, _ in chunk]},
+                           _source_includes=AuthorImport.MANUAL_FIELDS)['docs']
+        for (old_id, new_id), doc in zip(chunk, docs):
+            manual = {key: value for key, value in doc.get('_source', {}).items() if value is not None}
+            if not manual:
+                continue
+            actions.append({'_op_type': 'update', '_index': entity.index, '_id': new_id,
+                            'script': {'source': AUTHOR_MERGE_SCRIPT, 'lang': 'painless', 'params': {'doc': manual}}})
+    return bulk(client, actions)
+
+
+def sync_merged(entity, pairs):
+    """
+    :param pairs: [(被合并的id, 合并到的id)]
+    :return: (失败数, 认证或关注还没转到目标作者、暂不删除的[(被合并的id, 合并到的id)])
+    """
+    client = entity.module.client
+    failed = 0
+    pending = []
+    if entity.index == 'author':
+        from author.merge import rebind_merged_authors
+        failed += merge_authors(client, pairs)
+        pending = rebind_merged_authors(pairs)
+        kept = {old_id for old_id, _ in pending}
+        pairs = [(old_id, new_id) for old_id, new_id in pairs if old_id not in kept]
+    actions = ({'_op_type': 'delete', '_index': entity.index, '_id': entity.doc_id(old_id)} for old_id, _ in pairs)
+    return failed + bulk(client, actions), pending
+
+
+def sync(entity, state, dry_run=False):
+    synced = state.setdefault(entity.name, {})
+    partitions = changed_partitions(entity, synced)
+    merged = merged_files(entity, synced)
+    print('{}: {} changed partitions, {} merged id files'.format(entity.name, len(partitions), len(merged)))
+    if dry_run:
+        for path, meta in partitions:
+            print('  {} {}'.format(path, meta))
+        for path in merged:
+            print('  {}'.format(path))
+        return
+    if entity.index == 'author':
+        setup_django()
+        # 先重试上次没能转移认证的被合并作者
+        retry = [tuple(pair) for pair in state.get(PENDING_REBIND, [])]
+        if retry:
+            failed, pending = sync_merged(entity, retry)
+            print('  {} pending rebind, {} still pending, {} failed'.format(len(retry), len(pending), failed))
+            if not failed:
+                state[PENDING_REBIND] = [list(pair) for pair in pending]
+                save_state(state)
+    for path, meta in partitions:
+        start_time = datetime.now()
+        failed = sync_partition(entity, path)
+        print('  {} {} records, {} failed, cost {}'.format(path, meta.get('record_count'), failed,
+                                                           datetime.now() - start_time))
+        # 有失败的分片不记录, 下次重试
+        if not failed:
+            synced[path] = meta
+            save_state(state)
+    # 合并在分片之后处理, 避免目标实体还没导入
+    for path in merged:
+        failed, pending = sync_merged(entity, read_merged_ids(path))
+        print('  {} {} failed, {} pending rebind'.format(path, failed, len(pending)))
+        if not failed:
+            synced[path] = {}
+            state.setdefault(PENDING_REBIND, []).extend(list(pair) for pair in pending)
+            save_state(state)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entities', nargs='*', default=list(ENTITIES), choices=list(ENTITIES))
+    parser.add_argument('--dry-run', action='store_true', help='只列出需要同步的分片')
+    args = parser.parse_args()
+
+    start_time = datetime.now()
+    print("Start delta sync at {}".format(start_time))
+    state = load_state()
+    for name in args.entities:
+        sync(ENTITIES[name], state, args.dry_run)
+    end_time = datetime.now()
+    print("Finished delta sync at {}".format(end_time))
+    print("cost time {}".format(end_time - start_time))
@@ -0,0 +1,200 @@
+"""
+导入脚本吞吐量基准测试, 配合SnapshotGenerator.py生成的数据使用:
+
+    python ImportBenchmark.py --data /tmp/openalex                  # 所有实体, 写入空sink
+    python ImportBenchmark.py --data /tmp/openalex --entities works --sink es   # 写入本机es
+    python ImportBenchmark.py --data /tmp/openalex --micro          # 对比各json后端的解码和转换速度
+
+每种实体在独立进程中运行, 输出:
+- transform: 只解析和转换(generate_actions), 不序列化不写入; json后端由IMPORT_JSON环境变量指定, 默认自动选择
+- end-to-end: 调用导入脚本自己的run, bulk请求发到sink, 包括解析、转换、序列化和parallel_bulk调度
+- bulk: 请求数、每批文档数和字节数
+- 峰值RSS
+"""
+import argparse
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+from elasticsearch import Elasticsearch, Transport
+
+import fastjson
+
+# 目录名: 导入模块
+IMPORTERS = {
+    'works': 'WorkImport',
+    'authors': 'AuthorImport',
+    'concepts': 'ConceptImport',
+    'sources': 'SourceImport',
+    'institutions': 'InstitutionImport',
+}
+
+
+class SinkTransport(Transport):
+    """
+    丢弃所有请求, 只统计bulk的批次大小
+    """
+    lock = threading.Lock()
+    bulks = []
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        if not url.endswith('/_bulk'):
+            return {}
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        # 导入脚本只有index操作, 每个文档两行
+        docs = body.rstrip('\n').count('\n') // 2 + 1
+        with self.lock:
+            self.bulks.append((docs, len(body.encode('utf-8'))))
+        return {'took': 0, 'errors': False, 'items': [{'index': {'status': 201}} for _ in range(docs)]}
+
+
+def list_files(folder):
+    files = []
+    for sub_folder in sorted(os.listdir(folder)):
+        path = os.path.join(folder, sub_folder)
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)))
+    return files
+
+
+def count_lines(files):
+    total = 0
+    for file_name in files:
+        with gzip.open(file_name, 'rt', encoding='utf-8') as file:
+            total += sum(1 for _ in file)
+    return total
+
+
+def run_importer(module, file_name, client):
+    # 各导入脚本的run签名不统一
+    if module.__name__ in ('SourceImport', 'InstitutionImport'):
+        module.run(client, file_name)
+    else:
+        module.client = client
+        module.run(file_name)
+
+
+def benchmark(name, data, sink):
+    """
+    在当前进程中测一种实体, 结果以json打印到最后一行
+    """
+    module = __import__(IMPORTERS[name])
+    # 基准测试不记录已导入文件
+    if hasattr(module, 'save_imported_files'):
+        module.save_imported_files = lambda file_name: None
+    files = list_files(os.path.join(data, name))
+    records = count_lines(files)
+    result = {'entity': name, 'files': len(files), 'records': records}
+
+    if hasattr(module, 'generate_actions'):
+        start_time = time.perf_counter()
+        for file_name in files:
+            for _ in module.generate_actions(file_name):
+                pass
+        result['transform_per_s'] = records / (time.perf_counter() - start_time)
+
+    client = module.client if sink == 'es' else Elasticsearch(hosts=['localhost'], transport_class=SinkTransport)
+    start_time = time.perf_counter()
+    for file_name in files:
+        run_importer(module, file_name, client)
+    result['end_to_end_per_s'] = records / (time.perf_counter() - start_time)
+
+    bulks = SinkTransport.bulks
+    if bulks:
+        result['bulk_requests'] = len(bulks)
+        result['docs_per_bulk'] = sum(docs for docs, _ in bulks) / len(bulks)
+        result['max_docs_per_bulk'] = max(docs for docs, _ in bulks)
+        result['mb_per_bulk'] = sum(size for _, size in bulks) / len(bulks) / 2 ** 20
+        result['max_mb_per_bulk'] = max(size for _, size in bulks) / 2 ** 20
+    # linux下单位为KB
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(result))
+
+
+def timed_rate(records, func):
+    start_time = time.perf_counter()
+    func()
+    return records / (time.perf_counter() - start_time)
+
+
+def sorted_abstract(inverted_index):
+    # 原来的摘要还原方式: 生成(词, 位置)元组后排序, 作为对照
+    positions = [(word, pos) for word, pos_list in inverted_index.items() for pos in pos_list]
+    positions.sort(key=lambda x: x[1])
+    return ' '.join([word for word, _ in positions])
+
+
+def micro_benchmark(name, data):
+    """
+    每个可用的json后端: 只解码的速度, 以及解码+转换(generate_actions)的速度; work另外对比摘要还原
+    """
+    module = __import__(IMPORTERS[name])
+    files = list_files(os.path.join(data, name))
+    lines = []
+    for file_name in files:
+        with gzip.open(file_name, 'rb') as file:
+            lines.extend(file)
+    print('{}: {} records'.format(name, len(lines)))
+    for backend in fastjson.BACKENDS:
+        try:
+            _, loads = fastjson.load_backend(backend)
+        except ImportError:
+            print('  {:<9} not installed'.format(backend))
+            continue
+        # 不保留结果, 避免大量存活对象触发gc影响计时
+        decode = timed_rate(len(lines), lambda: deque(map(loads, lines), maxlen=0))
+        module.loads = loads
+        transform = timed_rate(len(lines), lambda: [deque(module.generate_actions(file_name), maxlen=0)
+                                                    for file_name in files])
+        print('  {:<9} decode {:>9.0f} records/s   decode+transform {:>9.0f} records/s'.format(
+            backend, decode, transform))
+    if name == 'works':
+        abstracts = [data['abstract_inverted_index'] for data in map(json.loads, lines)
+                     if data.get('abstract_inverted_index')]
+        print('  abstract  sort {:>9.0f} /s   position array {:>9.0f} /s'.format(
+            timed_rate(len(abstracts), lambda: [sorted_abstract(abstract) for abstract in abstracts]),
+            timed_rate(len(abstracts), lambda: [module.build_abstract(abstract) for abstract in abstracts])))
+
+
+def report(result):
+    print('{entity}: {records} records in {files} files'.format(**result))
+    if 'transform_per_s' in result:
+        print('  transform   {:>10.0f} records/s'.format(result['transform_per_s']))
+    print('  end-to-end  {:>10.0f} records/s'.format(result['end_to_end_per_s']))
+    if 'bulk_requests' in result:
+        print('  bulk        {} requests, {:.0f} docs/{:.1f}MB avg, {} docs/{:.1f}MB max'.format(
+            result['bulk_requests'], result['docs_per_bulk'], result['mb_per_bulk'],
+            result['max_docs_per_bulk'], result['max_mb_per_bulk']))
+    print('  peak RSS    {:>10.0f} MB'.format(result['peak_rss_mb']))
+
+
+parser = argparse.ArgumentParser(description='导入脚本吞吐量基准测试')
+parser.add_argument('--data', required=True, help='SnapshotGenerator.py的输出目录')
+parser.add_argument('--entities', nargs='*', default=list(IMPORTERS), choices=list(IMPORTERS))
+parser.add_argument('--sink', default='noop', choices=['noop', 'es'], help='noop丢弃bulk请求, es写入导入脚本配置的es')
+parser.add_argument('--micro', action='store_true', help='只测解码和转换, 对比各json后端')
+parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.micro:
+        for name in args.entities:
+            micro_benchmark(name, args.data)
+        sys.exit()
+    if args.worker:
+        benchmark(args.entities[0], args.data, args.sink)
+        sys.exit()
+    for name in args.entities:
+        # 每种实体一个进程, 峰值RSS互不影响
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', '--data', args.data,
+                                 '--sink', args.sink, '--entities', name],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, text=True, check=True).stdout
+        report(json.loads(output.strip().splitlines()[-1]))
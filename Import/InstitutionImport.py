@@ -1,5 +1,4 @@
 import os
-import json
 import time
 import gzip
 
@@ -9,9 +8,14 @@ from datetime import datetime
 from elasticsearch_dsl import connections, Document, Integer, Keyword, Text, Nested, Double
 from elasticsearch.helpers import parallel_bulk
 from path import data_path
+from fastjson import loads
 
 connections.create_connection(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
 client = Elasticsearch(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
+PROPERTIES = ["id", "cited_by_count", "display_name", "homepage_url", "lineage",
+              "ror", "type",
+              "works_api_url", "works_count", "associated_institutions", "counts_by_year", "geo",
+              "summary_stats", 'image_url']
 
 
 class InstitutionDocument(Document):
@@ -91,19 +95,11 @@ class InstitutionDocument(Document):
         }
 
 
-def run(client, file_name):
-    with gzip.open(file_name, 'rt', encoding='utf-8') as file:
-        i = 0
-        data_list = []
-        print("start indexing file {}".format(file_name))
-        start_time = time.perf_counter()
+def generate_actions(file_name):
+    with gzip.open(file_name, 'rb') as file:
         for line in file:
-            origin_data = json.loads(line)
-            properties_to_extract = ["id", "cited_by_count", "display_name", "homepage_url", "lineage",
-                                     "ror", "type",
-                                     "works_api_url", "works_count", "associated_institutions", "counts_by_year", "geo",
-                                     "summary_stats", 'image_url']
-            data = {key: origin_data.get(key) for key in properties_to_extract}
+            origin_data = loads(line)
+            data = {key: origin_data.get(key) for key in PROPERTIES}
             international = origin_data.get('international', None)
             data['chinese_display_name'] = ''
             if international:
@@ -116,40 +112,45 @@ def run(client, file_name):
                             data['chinese_display_name'] = display_name.get('zh_hans', '')
             # 截取repositories
             repositories = origin_data.get('repositories', None)
-            data['repositories'] = []
-            repositories_list = []
-            if repositories:
-                for repository in repositories:
-                    repositories_list.append({'id': repository['id'], 'display_name': repository['display_name']})
-                data['repositories'] = repositories_list
+            data['repositories'] = [{'id': repository['id'], 'display_name': repository['display_name']}
+                                    for repository in repositories] if repositories else []
             if data.get('id'):
-                i += 1
-                data_list.append({
+                yield {
                     "_op_type": "index",
                     "_index": "institution",
                     "_id": data.get('id'),
                     "_source": data
-                })
-            if i % 5000 == 0:
-                start_time1 = time.time()
-                for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
-                    if not ok:
-                        print(response)
-                data_list = []
-                end_time1 = time.time()
-                print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
-        if data_list:
+                }
+
+
+def run(client, file_name):
+    i = 0
+    data_list = []
+    print("start indexing file {}".format(file_name))
+    start_time = time.perf_counter()
+    for action in generate_actions(file_name):
+        i += 1
+        data_list.append(action)
+        if i % 5000 == 0:
             start_time1 = time.time()
-            i += 1
             for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
                 if not ok:
                     print(response)
+            data_list = []
             end_time1 = time.time()
             print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
-        end_time = time.perf_counter()
-        print(
-            "finished indexing file {} process time= {} min, end at {}".format(file_name, (end_time - start_time) / 60,
-                                                                               datetime.now()))
+    if data_list:
+        start_time1 = time.time()
+        i += 1
+        for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
+            if not ok:
+                print(response)
+        end_time1 = time.time()
+        print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
+    end_time = time.perf_counter()
+    print(
+        "finished indexing file {} process time= {} min, end at {}".format(file_name, (end_time - start_time) / 60,
+                                                                           datetime.now()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,351 @@
+"""
+生成合成的OpenAlex快照, 目录结构和字段与真实快照一致, 供导入脚本调优使用:
+
+    <out>/works/updated_date=2023-12-01/part_000.gz
+    <out>/works/manifest
+    <out>/authors/...  <out>/concepts/...  <out>/sources/...  <out>/institutions/...
+    <out>/merged_ids/works/2023-12-01.csv.gz
+
+列表长度服从帕累托分布, --skew越小尾部越重(少量论文有上千作者、超长摘要、大量location)
+
+    python SnapshotGenerator.py --out /tmp/openalex --works 200000 --shards 8
+    python SnapshotGenerator.py --out /tmp/openalex --works 20000 --skew 0.8 --max-authorships 3000
+    # 模拟一次每日更新: 新分区里重写前1000条记录, 并合并100个实体, manifest包含所有分区
+    python SnapshotGenerator.py --out /tmp/openalex --updated-date 2023-12-02 --works 1000 --authors 1000 --merged 100
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import string
+from datetime import date, datetime, timedelta
+
+OPENALEX = 'https://openalex.org/'
+YEARS = list(range(2012, 2024))
+LANGUAGES = ['en', 'en', 'en', 'en', 'zh', 'de', 'fr', 'ja', 'es', None]
+WORK_TYPES = ['article', 'article', 'article', 'book-chapter', 'dataset', 'preprint', 'dissertation']
+SOURCE_TYPES = ['journal', 'journal', 'repository', 'conference', 'ebook platform']
+INSTITUTION_TYPES = ['education', 'education', 'healthcare', 'company', 'government', 'facility', 'nonprofit']
+COUNTRIES = ['US', 'CN', 'GB', 'DE', 'JP', 'FR', 'CA', 'IN', 'KR', 'AU']
+
+
+class Generator:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        # 词表: 摘要、标题用, 常用词出现概率更高
+        self.vocabulary = [self.word() for _ in range(args.vocabulary)]
+
+    # ---------- 基础随机值 ----------
+
+    def word(self):
+        return ''.join(self.random.choices(string.ascii_lowercase, k=self.random.randint(2, 12)))
+
+    def text(self, n):
+        return ' '.join(self.zipf_choice(self.vocabulary) for _ in range(n))
+
+    def zipf_choice(self, items):
+        # 近似zipf: 下标取帕累托分布, 前面的元素被选中的概率高
+        index = int(self.random.paretovariate(self.args.skew)) - 1
+        return items[index % len(items)]
+
+    def length(self, mean, maximum):
+        """
+        帕累托分布的列表长度, 均值约为mean, 截断到maximum
+        """
+        alpha = self.args.skew
+        scale = mean * (alpha - 1) / alpha if alpha > 1 else mean / 4
+        return max(0, min(maximum, int(scale * self.random.paretovariate(alpha))))
+
+    def entity_id(self, prefix, count):
+        return '{}{}{}'.format(OPENALEX, prefix, self.zipf_choice(range(1, count + 1)) + 1000000)
+
+    def counts_by_year(self):
+        return [{'year': year, 'works_count': self.random.randint(0, 50), 'cited_by_count': self.random.randint(0, 500)}
+                for year in YEARS[-self.random.randint(1, len(YEARS)):]]
+
+    def summary_stats(self):
+        return {
+            '2yr_mean_citedness': round(self.random.random() * 10, 4),
+            'h_index': self.random.randint(0, 150),
+            'i10_index': self.random.randint(0, 500),
+        }
+
+    def dehydrated_concept(self, score=True):
+        args = self.args
+        concept = {
+            'id': self.entity_id('C', args.concepts),
+            'wikidata': 'https://www.wikidata.org/wiki/Q{}'.format(self.random.randint(1, 10 ** 7)),
+            'display_name': self.text(2).title(),
+            'level': self.random.randint(0, 5),
+        }
+        if score:
+            concept['score'] = round(self.random.random(), 6)
+        return concept
+
+    def dehydrated_institution(self):
+        return {
+            'id': self.entity_id('I', self.args.institutions),
+            'display_name': self.text(3).title() + ' University',
+            'ror': 'https://ror.org/0{}'.format(self.random.randint(10 ** 7, 10 ** 8)),
+            'country_code': self.random.choice(COUNTRIES),
+            'type': self.random.choice(INSTITUTION_TYPES),
+        }
+
+    def dehydrated_source(self):
+        return {
+            'id': self.entity_id('S', self.args.sources),
+            'display_name': 'Journal of ' + self.text(2).title(),
+            'issn_l': None,
+            'is_oa': self.random.random() < 0.3,
+            'host_organization': self.entity_id('P', 1000),
+            'host_organization_name': self.text(2).title() + ' Press',
+            'type': self.random.choice(SOURCE_TYPES),
+        }
+
+    # ---------- 实体 ----------
+
+    def work(self, i):
+        args = self.args
+        work_id = '{}W{}'.format(OPENALEX, i + 1000000)
+        authorships = []
+        for position in range(max(1, self.length(args.authorships, args.max_authorships))):
+            authorships.append({
+                'author_position': 'first' if position == 0 else 'middle',
+                'author': {
+                    'id': self.entity_id('A', args.authors),
+                    'display_name': self.text(2).title(),
+                    'orcid': None,
+                },
+                'institutions': [self.dehydrated_institution() for _ in range(self.random.randint(0, 3))],
+                'countries': self.random.sample(COUNTRIES, self.random.randint(0, 2)),
+                'is_corresponding': position == 0,
+                'raw_author_name': self.text(2).title(),
+            })
+        locations = []
+        for _ in range(self.length(args.locations, args.max_locations)):
+            has_pdf = self.random.random() < 0.3
+            locations.append({
+                'is_oa': has_pdf,
+                'landing_page_url': 'https://doi.org/10.{}/{}'.format(self.random.randint(1000, 9999), self.word()),
+                'pdf_url': 'https://example.org/{}.pdf'.format(self.word()) if has_pdf else None,
+                'source': self.dehydrated_source() if self.random.random() < 0.9 else None,
+                'license': None,
+                'version': 'publishedVersion',
+            })
+        abstract_inverted_index = None
+        abstract_length = self.length(args.abstract_words, args.max_abstract_words)
+        if abstract_length:
+            abstract_inverted_index = {}
+            for position in range(abstract_length):
+                abstract_inverted_index.setdefault(self.zipf_choice(self.vocabulary), []).append(position)
+        publication_date = date(2000, 1, 1) + timedelta(days=self.random.randint(0, 365 * 24))
+        return {
+            'id': work_id,
+            'doi': None,
+            'title': self.text(self.random.randint(4, 20)).capitalize(),
+            'display_name': None,
+            'publication_year': publication_date.year,
+            'publication_date': publication_date.isoformat(),
+            'language': self.random.choice(LANGUAGES),
+            'type': self.random.choice(WORK_TYPES),
+            'authorships': authorships,
+            'corresponding_institution_ids': [institution['id'] for institution in authorships[0]['institutions']],
+            'cited_by_count': int(self.random.paretovariate(args.skew)) - 1,
+            'concepts': [self.dehydrated_concept() for _ in range(self.length(args.concepts_per_work, 50))],
+            'locations': locations,
+            'primary_location': locations[0] if locations else None,
+            'referenced_works': [self.entity_id('W', args.works) for _ in range(self.length(args.references, 2000))],
+            'related_works': [self.entity_id('W', args.works) for _ in range(self.random.randint(0, 20))],
+            'abstract_inverted_index': abstract_inverted_index,
+            'counts_by_year': self.counts_by_year(),
+            'updated_date': self.args.updated_date + 'T00:00:00.000000',
+            'created_date': publication_date.isoformat(),
+        }
+
+    def author(self, i):
+        return {
+            'id': '{}A{}'.format(OPENALEX, i + 1000000),
+            'orcid': None,
+            'display_name': self.text(2).title(),
+            'display_name_alternatives': [self.text(2).title() for _ in range(self.random.randint(0, 5))],
+            'works_count': self.random.randint(1, 1000),
+            'cited_by_count': int(self.random.paretovariate(self.args.skew)) - 1,
+            'summary_stats': dict(self.summary_stats(), oa_percent=round(self.random.random() * 100, 2),
+                                  works_count=self.random.randint(1, 1000),
+                                  cited_by_count=self.random.randint(0, 10 ** 5)),
+            'last_known_institution': self.dehydrated_institution() if self.random.random() < 0.8 else None,
+            'x_concepts': [self.dehydrated_concept() for _ in range(self.length(8, 50))],
+            'counts_by_year': self.counts_by_year(),
+            'updated_date': self.args.updated_date + 'T00:00:00.000000',
+            'created_date': '2016-06-24',
+        }
+
+    def concept(self, i):
+        has_description = self.random.random() < 0.7
+        return {
+            'id': '{}C{}'.format(OPENALEX, i + 1000000),
+            'wikidata': 'https://www.wikidata.org/wiki/Q{}'.format(self.random.randint(1, 10 ** 7)),
+            'display_name': self.text(2).title(),
+            'level': self.random.randint(0, 5),
+            'description': self.text(10) if has_description else None,
+            'works_count': self.random.randint(1, 10 ** 6),
+            'cited_by_count': self.random.randint(1, 10 ** 7),
+            'summary_stats': self.summary_stats(),
+            'image_url': None,
+            'international': {
+                'display_name': {'en': self.text(2), 'zh-cn': self.text(2)},
+                'description': {'en': self.text(10), 'zh-cn': self.text(10)} if has_description else {},
+            },
+            'ancestors': [self.dehydrated_concept(score=False) for _ in range(self.random.randint(0, 6))],
+            'related_concepts': [self.dehydrated_concept() for _ in range(self.length(10, 100))],
+            'counts_by_year': self.counts_by_year(),
+            'works_api_url': 'https://api.openalex.org/works?filter=concepts.id:C{}'.format(i + 1000000),
+            'updated_date': self.args.updated_date + 'T00:00:00.000000',
+        }
+
+    def source(self, i):
+        source = self.dehydrated_source()
+        source.update({
+            'id': '{}S{}'.format(OPENALEX, i + 1000000),
+            'homepage_url': 'https://example.org/' + self.word(),
+            'host_organization_lineage': [source['host_organization']],
+            'summary_stats': self.summary_stats(),
+            'societies': [],
+            'works_count': self.random.randint(1, 10 ** 5),
+            'cited_by_count': self.random.randint(1, 10 ** 6),
+            'x_concepts': [self.dehydrated_concept() for _ in range(self.length(10, 100))],
+            'counts_by_year': self.counts_by_year(),
+            'created_date': '2016-06-24',
+            'updated_date': self.args.updated_date + 'T00:00:00.000000',
+        })
+        return source
+
+    def institution(self, i):
+        institution = self.dehydrated_institution()
+        institution.update({
+            'id': '{}I{}'.format(OPENALEX, i + 1000000),
+            'homepage_url': 'https://example.org/' + self.word(),
+            'image_url': None,
+            'lineage': ['{}I{}'.format(OPENALEX, i + 1000000)],
+            'works_api_url': 'https://api.openalex.org/works?filter=institutions.id:I{}'.format(i + 1000000),
+            'works_count': self.random.randint(1, 10 ** 5),
+            'cited_by_count': self.random.randint(1, 10 ** 6),
+            'summary_stats': self.summary_stats(),
+            'geo': {
+                'city': self.word().title(), 'geonames_city_id': str(self.random.randint(1, 10 ** 7)),
+                'region': None, 'country_code': institution['country_code'], 'country': institution['country_code'],
+                'latitude': self.random.uniform(-90, 90), 'longitude': self.random.uniform(-180, 180),
+            },
+            'international': {'display_name': {'en': institution['display_name'], 'zh-cn': self.text(2)}},
+            'associated_institutions': [dict(self.dehydrated_institution(), relationship='related')
+                                        for _ in range(self.random.randint(0, 5))],
+            'repositories': [self.dehydrated_source() for _ in range(self.random.randint(0, 3))],
+            'counts_by_year': self.counts_by_year(),
+            'updated_date': self.args.updated_date + 'T00:00:00.000000',
+        })
+        return institution
+
+
+# 目录名: (生成方法, 数量参数, id前缀)
+ENTITIES = {
+    'works': ('work', 'works', 'W'),
+    'authors': ('author', 'authors', 'A'),
+    'concepts': ('concept', 'concepts', 'C'),
+    'sources': ('source', 'sources', 'S'),
+    'institutions': ('institution', 'institutions', 'I'),
+}
+
+
+def write_entity(generator, out, name, shards):
+    method, count_name, _ = ENTITIES[name]
+    count = getattr(generator.args, count_name)
+    folder = os.path.join(out, name, 'updated_date=' + generator.args.updated_date)
+    os.makedirs(folder, exist_ok=True)
+    build = getattr(generator, method)
+    per_shard = (count + shards - 1) // shards
+    for shard in range(shards):
+        file_name = os.path.join(folder, 'part_{:03d}.gz'.format(shard))
+        with gzip.open(file_name, 'wt', encoding='utf-8') as file:
+            for i in range(shard * per_shard, min(count, (shard + 1) * per_shard)):
+                file.write(json.dumps(build(i)) + '\n')
+    write_manifest(out, name)
+    print('{}: {} records in {} shards'.format(name, count, shards))
+
+
+def write_manifest(out, name):
+    """
+    按目录下所有分区重写manifest, 格式同快照
+    """
+    entries = []
+    folder = os.path.join(out, name)
+    for sub_folder in sorted(f for f in os.listdir(folder) if f.startswith('updated_date=')):
+        for file_name in sorted(os.listdir(os.path.join(folder, sub_folder))):
+            path = os.path.join(folder, sub_folder, file_name)
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                record_count = sum(1 for _ in file)
+            entries.append({
+                'url': 's3://openalex/data/{}/{}/{}'.format(name, sub_folder, file_name),
+                'meta': {'content_length': os.path.getsize(path), 'record_count': record_count},
+            })
+    manifest = {
+        'entries': entries,
+        'meta': {
+            'content_length': sum(entry['meta']['content_length'] for entry in entries),
+            'record_count': sum(entry['meta']['record_count'] for entry in entries),
+        },
+    }
+    with open(os.path.join(folder, 'manifest'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+def write_merged_ids(generator, out, name, merged):
+    """
+    合并记录: 把merged个实体合并到其他实体, 格式同快照的merged_ids
+    """
+    _, count_name, prefix = ENTITIES[name]
+    count = getattr(generator.args, count_name)
+    folder = os.path.join(out, 'merged_ids', name)
+    os.makedirs(folder, exist_ok=True)
+    with gzip.open(os.path.join(folder, generator.args.updated_date + '.csv.gz'), 'wt', encoding='utf-8') as file:
+        file.write('merge_date,id,merge_into_id\n')
+        for i in generator.random.sample(range(count), min(merged, count)):
+            target = generator.random.randrange(count)
+            if target != i:
+                file.write('{},{}{},{}{}\n'.format(generator.args.updated_date, prefix, i + 1000000,
+                                                   prefix, target + 1000000))
+
+
+parser = argparse.ArgumentParser(description='生成合成的OpenAlex快照')
+parser.add_argument('--out', required=True, help='输出目录, 导入时把path.py的data_path指向这里')
+parser.add_argument('--entities', nargs='*', default=list(ENTITIES), choices=list(ENTITIES))
+parser.add_argument('--shards', type=int, default=4, help='每种实体的gz分片数')
+parser.add_argument('--seed', type=int, default=2023)
+parser.add_argument('--updated-date', default='2023-12-01', help='写入的分区, 模拟每日更新时用新的日期')
+parser.add_argument('--merged', type=int, default=0, help='每种实体生成的合并记录数')
+parser.add_argument('--works', type=int, default=100000)
+parser.add_argument('--authors', type=int, default=50000)
+parser.add_argument('--concepts', type=int, default=5000)
+parser.add_argument('--sources', type=int, default=5000)
+parser.add_argument('--institutions', type=int, default=5000)
+parser.add_argument('--skew', type=float, default=1.5, help='帕累托分布的alpha, 越小长尾越重')
+parser.add_argument('--vocabulary', type=int, default=20000)
+parser.add_argument('--authorships', type=float, default=5, help='每篇论文平均作者数')
+parser.add_argument('--max-authorships', type=int, default=1000)
+parser.add_argument('--abstract-words', type=float, default=180, help='摘要平均词数')
+parser.add_argument('--max-abstract-words', type=int, default=5000)
+parser.add_argument('--locations', type=float, default=2, help='每篇论文平均location数')
+parser.add_argument('--max-locations', type=int, default=200)
+parser.add_argument('--references', type=float, default=30, help='每篇论文平均参考文献数')
+parser.add_argument('--concepts-per-work', type=float, default=8)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    generator = Generator(args)
+    start_time = datetime.now()
+    for name in args.entities:
+        write_entity(generator, args.out, name, args.shards)
+        if args.merged:
+            write_merged_ids(generator, args.out, name, args.merged)
+    print("cost time {}".format(datetime.now() - start_time))
@@ -1,5 +1,4 @@
 import os
-import json
 import time
 import gzip
 from tqdm import tqdm
@@ -8,10 +7,15 @@ from elasticsearch_dsl import connections, Document, Integer, Keyword, Text, Nes
 from elasticsearch.helpers import parallel_bulk
 from elasticsearch import Elasticsearch
 from path import data_path
+from fastjson import loads
 
 connections.create_connection(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
 client = Elasticsearch(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
 INDEX_NAME = 'source'
+PROPERTIES = ["id", "cited_by_count", "counts_by_year", "display_name", "homepage_url",
+              "host_organization", "host_organization_lineage", "host_organization_name",
+              "summary_stats", "type", "societies", "created_date", "updated_date",
+              "works_count", "x_concepts", "img_url"]
 
 
 class SourceDocument(Document):
@@ -83,47 +87,48 @@ class SourceDocument(Document):
         }
 
 
-def run(client, file_name):
-    with gzip.open(file_name, 'rt', encoding='utf-8') as file:
-        i = 0
-        data_list = []
-        print("start indexing file {}".format(file_name))
-        start_time = time.perf_counter()
+def generate_actions(file_name):
+    with gzip.open(file_name, 'rb') as file:
         for line in file:
-            data = json.loads(line)
-            properties_to_extract = ["id", "cited_by_count", "counts_by_year", "display_name", "homepage_url",
-                                     "host_organization", "host_organization_lineage", "host_organization_name",
-                                     "summary_stats", "type", "societies", "created_date", "updated_date",
-                                     "works_count", "x_concepts", "img_url"]
-            data = {key: data.get(key) for key in properties_to_extract}
+            data = loads(line)
+            data = {key: data.get(key) for key in PROPERTIES}
             if data.get('id'):
-                i += 1
-                data_list.append({
+                yield {
                     "_op_type": "index",
                     "_index": "source",
                     "_id": data.get('id'),
                     "_source": data
-                })
-            if i % 5000 == 0:
-                start_time1 = time.time()
-                for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
-                    if not ok:
-                        print(response)
-                data_list = []
-                end_time1 = time.time()
-                print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
-        if data_list:
+                }
+
+
+def run(client, file_name):
+    i = 0
+    data_list = []
+    print("start indexing file {}".format(file_name))
+    start_time = time.perf_counter()
+    for action in generate_actions(file_name):
+        i += 1
+        data_list.append(action)
+        if i % 5000 == 0:
             start_time1 = time.time()
-            i += 1
             for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
                 if not ok:
                     print(response)
+            data_list = []
             end_time1 = time.time()
             print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
-        end_time = time.perf_counter()
-        print(
-            "finished indexing file {} process time= {} min, end at {}".format(file_name, (end_time - start_time) / 60,
-                                                                               datetime.now()))
+    if data_list:
+        start_time1 = time.time()
+        i += 1
+        for ok, response in parallel_bulk(client=client, actions=data_list, chunk_size=5000):
+            if not ok:
+                print(response)
+        end_time1 = time.time()
+        print("circle {} process time = {}s".format(int(i / 5000), end_time1 - start_time1))
+    end_time = time.perf_counter()
+    print(
+        "finished indexing file {} process time= {} min, end at {}".format(file_name, (end_time - start_time) / 60,
+                                                                           datetime.now()))
 
 
 if __name__ == "__main__":
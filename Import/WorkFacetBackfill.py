@@ -0,0 +1,75 @@
+import time
+from datetime import datetime
+from project import get_batch_client
+
+client = get_batch_client()
+# 已有的work索引补上搜索分面用的扁平id数组, 新导入的文档由WorkImport.transform直接生成
+INDEX_NAME = 'work'
+FACET_FIELDS = ['author_ids', 'institution_ids', 'concept_ids', 'source_ids']
+SCRIPT = """
+List authorIds = new ArrayList();
+List institutionIds = new ArrayList();
+List conceptIds = new ArrayList();
+List sourceIds = new ArrayList();
+if (ctx._source.authorships != null) {
+    for (authorship in ctx._source.authorships) {
+        if (authorship.author != null && authorship.author.id != null && !authorIds.contains(authorship.author.id)) {
+            authorIds.add(authorship.author.id);
+        }
+        if (authorship.institutions != null) {
+            for (institution in authorship.institutions) {
+                if (institution.id != null && !institutionIds.contains(institution.id)) {
+                    institutionIds.add(institution.id);
+                }
+            }
+        }
+    }
+}
+if (ctx._source.concepts != null) {
+    for (concept in ctx._source.concepts) {
+        if (concept.id != null && !conceptIds.contains(concept.id)) {
+            conceptIds.add(concept.id);
+        }
+    }
+}
+if (ctx._source.locations != null) {
+    for (location in ctx._source.locations) {
+        if (location.source != null && location.source.id != null && !sourceIds.contains(location.source.id)) {
+            sourceIds.add(location.source.id);
+        }
+    }
+}
+ctx._source.author_ids = authorIds;
+ctx._source.institution_ids = institutionIds;
+ctx._source.concept_ids = conceptIds;
+ctx._source.source_ids = sourceIds;
+"""
+
+
+def wait_for_task(task_id):
+    while True:
+        task = client.tasks.get(task_id=task_id)
+        status = task['task']['status']
+        print('{} / {} documents'.format(status['updated'], status['total']))
+        if task['completed']:
+            return task
+        time.sleep(30)
+
+
+if __name__ == "__main__":
+    start_time = datetime.now()
+    print("Start backfill at {}".format(start_time))
+    client.indices.put_mapping(index=INDEX_NAME, body={
+        'properties': {field: {'type': 'keyword', 'eager_global_ordinals': True} for field in FACET_FIELDS}
+    })
+    # 中断后重跑只处理还没有补上的文档
+    ret = client.update_by_query(index=INDEX_NAME, body={
+        'query': {'bool': {'must_not': {'exists': {'field': 'author_ids'}}}},
+        'script': {'source': SCRIPT, 'lang': 'painless'},
+    }, wait_for_completion=False, slices='auto', conflicts='proceed', scroll_size=5000)
+    task = wait_for_task(ret['task'])
+    if task['response']['failures']:
+        print(task['response']['failures'])
+    end_time = datetime.now()
+    print("Finished backfill at {}".format(end_time))
+    print("cost time {}".format(end_time - start_time))
@@ -1,4 +1,4 @@
-import json
+import argparse
 import logging
 import os
 import gzip
@@ -9,10 +9,13 @@ from elasticsearch.helpers import parallel_bulk
 from elasticsearch import Elasticsearch
 from path import data_path
 from collections import deque
+import staging
+from fastjson import loads
 
 connections.create_connection(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
 client = Elasticsearch(hosts=['localhost'], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
 INDEX_NAME = 'work'
+PREFIX_LENGTH = len('https://openalex.org/')
 
 
 class WorkDocument(Document):
@@ -91,6 +94,11 @@ class WorkDocument(Document):
     )
     corresponding_institution_ids = Keyword()
     visit_count = Integer()
+    # 搜索分面用的扁平id数组, 代替nested+top_hits聚合; 名称由实体索引查询
+    author_ids = Keyword(eager_global_ordinals=True)
+    institution_ids = Keyword(eager_global_ordinals=True)
+    concept_ids = Keyword(eager_global_ordinals=True)
+    source_ids = Keyword(eager_global_ordinals=True)
 
     class Index:
         name = INDEX_NAME
@@ -109,132 +117,160 @@ class WorkDocument(Document):
         }
 
 
+def strip_prefix(openalex_id):
+    return openalex_id[PREFIX_LENGTH:] if openalex_id else None
+
+
+def build_abstract(inverted_index):
+    """
+    由倒排索引还原摘要: 按位置把词放进预分配的数组, 不生成(词, 位置)元组再排序
+    位置不连续或有重复时退回排序, 结果与排序一致
+    """
+    positions_list = inverted_index.values()
+    try:
+        size = max(map(max, positions_list)) + 1
+    except ValueError:
+        # 有空的位置列表
+        size = 0
+    if size == sum(map(len, positions_list)):
+        words = [None] * size
+        for word, positions in inverted_index.items():
+            for position in positions:
+                words[position] = word
+        if None not in words:
+            return ' '.join(words)
+    positions = [(word, pos) for word, pos_list in inverted_index.items() for pos in pos_list]
+    positions.sort(key=lambda x: x[1])
+    return ' '.join([word for word, _ in positions])
+
+
+def transform_authorship(authorship):
+    author = authorship["author"]
+    countries = authorship.get("countries")
+    return {
+        "author": {
+            "id": strip_prefix(author.get('id')),
+            "display_name": author["display_name"],
+        },
+        "institutions": [
+            {
+                "id": institution["id"][PREFIX_LENGTH:],
+                "display_name": institution["display_name"],
+                "type": institution["type"],
+            }
+            for institution in authorship["institutions"]
+        ],
+        "country": countries[0] if countries else None,
+    }
+
+
+def transform_location(location):
+    source = location["source"]
+    if source:
+        source = {
+            "id": strip_prefix(source.get('id')),
+            "display_name": source["display_name"],
+            "host_organization": strip_prefix(source.get('host_organization')),
+            "host_organization_name": source["host_organization_name"],
+            "type": source["type"],
+        }
+    return {
+        "source": source,
+        "landing_page_url": location["landing_page_url"],
+    }
+
+
+def unique_ids(ids):
+    return list(dict.fromkeys(entity_id for entity_id in ids if entity_id))
+
+
+def transform(data):
+    """
+    单次遍历把快照中的一条work转换成索引文档, 列表字段最多保留10个
+    """
+    locations = data["locations"]
+    authorships = [transform_authorship(authorship) for authorship in data["authorships"][0:10]]
+    concepts = [
+        {
+            "id": strip_prefix(concept.get('id')),
+            "wikidata": concept["wikidata"],
+            "display_name": concept["display_name"],
+            "level": concept["level"],
+        }
+        for concept in data["concepts"][0:10]
+    ]
+    top_locations = [transform_location(location) for location in locations[0:10]]
+    # 设置pdf_url: 第一个有pdf的location
+    pdf_url = None
+    for location in locations:
+        pdf_url = location.get("pdf_url")
+        if pdf_url:
+            break
+    abstract = data.get('abstract_inverted_index')
+    return {
+        "id": data["id"][PREFIX_LENGTH:],
+        "title": data.get("title"),
+        "authorships": authorships,
+        "cited_by_count": data.get("cited_by_count"),
+        "concepts": concepts,
+        "counts_by_year": data.get("counts_by_year"),
+        "language": data.get("language"),
+        "type": data.get("type"),
+        "publication_date": data.get("publication_date"),
+        "referenced_works": [work_id[PREFIX_LENGTH:] for work_id in data["referenced_works"][0:10]],
+        "related_works": [work_id[PREFIX_LENGTH:] for work_id in data["related_works"][0:10]],
+        "locations": top_locations,
+        "corresponding_institution_ids": [institution_id[PREFIX_LENGTH:]
+                                          for institution_id in data["corresponding_institution_ids"][0:10]],
+        "pdf_url": pdf_url or None,
+        # 设置vist_count
+        "visit_count": random.randint(50, 10000),
+        "abstract": build_abstract(abstract) if abstract else None,
+        # 与保留的authorships/concepts/locations一致
+        "author_ids": unique_ids(authorship["author"]["id"] for authorship in authorships),
+        "institution_ids": unique_ids(institution["id"] for authorship in authorships
+                                      for institution in authorship["institutions"]),
+        "concept_ids": unique_ids(concept["id"] for concept in concepts),
+        "source_ids": unique_ids(location["source"]["id"] for location in top_locations if location["source"]),
+    }
+
+
 def generate_actions(file_name):
-    with gzip.open(file_name, 'rt', encoding='utf-8') as file:
-        lines = file.readlines()
-        for line in lines:
-            data = json.loads(line)
-            properties_to_extract = ["id",
-                                     "title",
-                                     "authorships",
-                                     "cited_by_count",
-                                     "concepts",
-                                     "counts_by_year",
-                                     "language",
-                                     "type",
-                                     "publication_date",
-                                     "referenced_works",
-                                     "related_works",
-                                     "locations",
-                                     "corresponding_institution_ids",
-                                     ]
-            abstract = data.get('abstract_inverted_index')
-            data = {key: data.get(key) for key in properties_to_extract}
-            # 提取id
-            data['id'] = data['id'][len('https://openalex.org/'):]
-            # 提取authorships
-            authorships = []
-            for authorship in data['authorships'][0:10]:
-                properties_to_extract = ["author", "institutions", "countries"]
-                authorship = {key: authorship.get(key) for key in properties_to_extract}
-                authorship["author"] = {
-                    "id": authorship["author"]["id"][len('https://openalex.org/'):] if authorship["author"].get(
-                        'id') else None,
-                    "display_name": authorship["author"]["display_name"],
-                }
-                institutions = []
-                for institution in authorship["institutions"]:
-                    institution = {
-                        "id": institution["id"][len('https://openalex.org/'):],
-                        "display_name": institution["display_name"],
-                        "type": institution["type"],
-                    }
-                    institutions.append(institution)
-                authorship["institutions"] = institutions
-                authorship["country"] = authorship["countries"][0] if authorship.get("countries") else None
-                authorship.pop("countries")
-                authorships.append(authorship)
-            data["authorships"] = authorships
-            # 处理concepts
-            concepts = []
-            for concept in data["concepts"][0:10]:
-                concept = {
-                    "id": concept["id"][len('https://openalex.org/'):] if concept.get('id') else None,
-                    "wikidata": concept["wikidata"],
-                    "display_name": concept["display_name"],
-                    "level": concept["level"],
-                }
-                concepts.append(concept)
-            data["concepts"] = concepts
-            # 设置pdf_url
-            pdf_url = None
-            for location in data["locations"]:
-                if location.get("pdf_url"):
-                    pdf_url = location.get("pdf_url")
-                    break
-            data["pdf_url"] = pdf_url
-            # 处理locations
-            locations = []
-            for location in data["locations"][0:10]:
-                location = {
-                    "source": location["source"],
-                    "landing_page_url": location["landing_page_url"],
-                }
-                source = location["source"]
-                if source:
-                    source = {
-                        "id": source["id"][len('https://openalex.org/'):] if source.get('id') else None,
-                        "display_name": source["display_name"],
-                        "host_organization": source["host_organization"][len('https://openalex.org/'):]
-                        if source.get('host_organization') else None,
-                        "host_organization_name": source["host_organization_name"],
-                        "type": source["type"],
-                    }
-                    location["source"] = source
-                locations.append(location)
-            data['locations'] = locations
-            # 设置vist_count
-            data['visit_count'] = random.randint(50, 10000)
-            data['abstract'] = None
-            if abstract:
-                positions = [(word, pos) for word, pos_list in abstract.items() for pos in pos_list]
-                positions.sort(key=lambda x: x[1])
-                data['abstract'] = ' '.join([word for word, _ in positions])
-
-            # 处理related_works和referenced_works
-            related_works = []
-            for related_work in data['related_works'][0:10]:
-                related_works.append(related_work[len('https://openalex.org/'):])
-            data['related_works'] = related_works
-            referenced_works = []
-            for referenced_work in data['referenced_works'][0:10]:
-                referenced_works.append(referenced_work[len('https://openalex.org/'):])
-            data['referenced_works'] = referenced_works
-            corresponding_institution_ids = []
-            for corresponding_institution_id in data["corresponding_institution_ids"][0:10]:
-                corresponding_institution_id = corresponding_institution_id[len('https://openalex.org/'):]
-                corresponding_institution_ids.append(corresponding_institution_id)
-            data['corresponding_institution_ids'] = corresponding_institution_ids
-            document = {
+    # 二进制读取, json后端直接解析bytes; 逐行读取, 不一次读入整个文件
+    with gzip.open(file_name, 'rb') as file:
+        for line in file:
+            data = transform(loads(line))
+            yield {
                 '_index': INDEX_NAME,
                 '_source': data,
                 '_id': data['id'],
             }
-            yield document
 
 
-def run(file_name):
-    actions = generate_actions(file_name)
-    deque(parallel_bulk(client=client, actions=actions, request_timeout=60), maxlen=0)
+def run(file_name, stage_root=None):
+    """
+    :param stage_root: 不为空时把转换后的记录同时写入暂存
+    """
+    with staging.staged(generate_actions(file_name), stage_root, 'works', file_name) as actions:
+        deque(parallel_bulk(client=client, actions=actions, request_timeout=60), maxlen=0)
     save_imported_files(file_name)
 
 
-def process_files(folder):
+def run_staged(shard):
+    """
+    从暂存分片导入, 不再解析原始json
+    """
+    actions = staging.read_shard(shard, INDEX_NAME)
+    deque(parallel_bulk(client=client, actions=actions, request_timeout=60), maxlen=0)
+    save_imported_files(shard)
+
+
+def process_files(folder, stage_root=None):
     imported_files = get_imported_files()
     files = [f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
     for file in files:
         if os.path.join(folder, file) not in imported_files:
-            run(os.path.join(folder, file))
+            run(os.path.join(folder, file), stage_root)
         else:
             print(os.path.join(folder, file) + ' has been imported!')
 
@@ -253,18 +289,28 @@ def get_imported_files():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage', help='同时把转换后的记录写入该暂存目录')
+    parser.add_argument('--from-stage', help='从该暂存目录导入, 不读原始快照')
+    args = parser.parse_args()
 
     WorkDocument.init()
 
     start_time = datetime.now()
     print("Start insert to ElasticSearch at {}".format(start_time))
-    root_path = data_path + 'works'
-    # 获取所有子文件夹
-    sub_folders = [f for f in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, f))]
+    if args.from_stage:
+        imported_files = get_imported_files()
+        for shard in staging.list_shards(args.from_stage, 'works'):
+            if shard not in imported_files:
+                run_staged(shard)
+    else:
+        root_path = data_path + 'works'
+        # 获取所有子文件夹
+        sub_folders = [f for f in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, f))]
 
-    for sub_folder in sub_folders:
-        folder_path = os.path.join(root_path, sub_folder)
-        process_files(folder_path)
+        for sub_folder in sub_folders:
+            folder_path = os.path.join(root_path, sub_folder)
+            process_files(folder_path, args.stage)
     end_time = datetime.now()
     print("Finished insert to Elasticsearch at{}".format(end_time))
     print("cost time {}".format(end_time - start_time))
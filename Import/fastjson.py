@@ -0,0 +1,52 @@
+"""
+导入脚本用的json解码: 优先orjson, 其次simdjson, 都没有时用标准库
+可以用环境变量IMPORT_JSON=orjson/simdjson/stdlib指定, 便于对比
+所有后端都直接接受bytes, 读gz文件时用'rb'模式, 省去逐行解码成str
+"""
+import json
+import os
+
+
+def _orjson():
+    import orjson
+    return orjson.loads
+
+
+def _simdjson():
+    import simdjson
+    parser = simdjson.Parser()
+
+    def loads(line):
+        # parse返回的是懒加载的代理对象, 转成普通dict/list; 同一个parser不能同时持有两个文档
+        return parser.parse(line).as_dict()
+
+    return loads
+
+
+def _stdlib():
+    return json.loads
+
+
+BACKENDS = {
+    'orjson': _orjson,
+    'simdjson': _simdjson,
+    'stdlib': _stdlib,
+}
+
+
+def load_backend(name=None):
+    """
+    :return: (后端名, loads函数)
+    """
+    name = name or os.environ.get('IMPORT_JSON')
+    if name:
+        return name, BACKENDS[name]()
+    for name in ['orjson', 'simdjson']:
+        try:
+            return name, BACKENDS[name]()
+        except ImportError:
+            continue
+    return 'stdlib', json.loads
+
+
+backend, loads = load_backend()
@@ -0,0 +1,32 @@
+"""
+独立运行的导入脚本访问项目代码(es客户端配置、django的缓存和数据库)时使用
+"""
+import os
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_project_path():
+    if PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, PROJECT_ROOT)
+
+
+def get_batch_client():
+    """
+    项目统一配置的es客户端(utils/es_client.py)的长超时连接, 不在脚本里重复写地址和密码
+    """
+    add_project_path()
+    from utils import es_client
+    es_client.configure()
+    return es_client.get_client(es_client.BATCH)
+
+
+def setup_django():
+    """
+    加载项目的django配置, 之后才能导入项目中的模型、缓存
+    """
+    import django
+    add_project_path()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'NoBC.settings')
+    django.setup()
@@ -0,0 +1,171 @@
+"""
+转换后记录的列式暂存(Parquet), 按实体和分片存放:
+
+    <root>/works/updated_date=2023-12-01/part_000.parquet
+
+首次导入时顺便写入暂存, 之后重建索引、调整mapping或离线分析直接内存映射读取暂存,
+不用再解压和解析原始gzip json, 也不用重复做前缀截取、摘要还原、作者截断等转换
+需要pyarrow: pip install pyarrow
+"""
+import os
+from contextlib import contextmanager
+
+# 每个row group的行数, 读取时按row group分批
+ROW_GROUP_SIZE = 5000
+# 保存在暂存中的bulk元数据列
+ID_COLUMN = '_id'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('暂存需要pyarrow, 请先 pip install pyarrow')
+    return pyarrow
+
+
+def shard_path(root, entity, raw_file):
+    """
+    原始文件对应的暂存文件: .../updated_date=xxx/part_000.gz -> <root>/<entity>/updated_date=xxx/part_000.parquet
+    """
+    sub_folder = os.path.basename(os.path.dirname(raw_file))
+    name = os.path.basename(raw_file).split('.')[0] + '.parquet'
+    return os.path.join(root, entity, sub_folder, name)
+
+
+class ShardWriter:
+    """
+    流式写入一个分片的暂存, 内存中只保留一个row group的记录
+    schema由第一批推断, 之后的批次按它转换; 出现新字段或类型变化时合并schema另起一个文件
+    <分片名>.<n>.parquet, 读取时由read_table统一
+    """
+
+    def __init__(self, path):
+        self.pa = _pyarrow()
+        self.path = path
+        self.rows = []
+        self.schema = None
+        self.writer = None
+        # [(临时文件, 目标文件)], 全部写完才替换, 中断时不会留下不完整的分片
+        self.parts = []
+
+    def part_path(self, n):
+        return self.path if n == 0 else '{}.{}.parquet'.format(self.path[:-len('.parquet')], n)
+
+    def open(self, schema):
+        if self.writer is not None:
+            self.writer.close()
+        path = self.part_path(len(self.parts))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.parts.append((path + '.tmp', path))
+        self.writer = self.pa.parquet.ParquetWriter(path + '.tmp', schema, compression='zstd')
+        self.schema = schema
+
+    def tee(self, actions):
+        """
+        透传bulk action, 同时按row group写入暂存
+        """
+        for action in actions:
+            self.rows.append(dict(action['_source'], **{ID_COLUMN: action['_id']}))
+            if len(self.rows) >= ROW_GROUP_SIZE:
+                self.flush()
+            yield action
+
+    def flush(self):
+        if not self.rows:
+            return
+        pa = self.pa
+        table = pa.Table.from_pylist(self.rows)
+        if self.writer is None:
+            self.open(table.schema)
+        elif not table.schema.equals(self.schema):
+            try:
+                schema = pa.unify_schemas([self.schema, table.schema], promote_options='permissive')
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                schema = table.schema
+            if not schema.equals(self.schema):
+                self.open(schema)
+            # 这一批缺少的字段补null, 全为null的字段按schema的类型
+            table = pa.Table.from_pylist(self.rows, schema=schema)
+        self.writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is None:
+            return
+        self.writer.close()
+        for tmp_path, path in self.parts:
+            os.replace(tmp_path, path)
+        # 上次写入多出来的文件
+        written = {path for _, path in self.parts}
+        prefix = os.path.basename(self.path)[:-len('.parquet')] + '.'
+        folder = os.path.dirname(self.path)
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name.startswith(prefix) and name.endswith('.parquet') and path not in written:
+                os.remove(path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        for tmp_path, _ in self.parts:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+@contextmanager
+def staged(actions, root, entity, raw_file):
+    """
+    root为空时原样返回actions; 否则返回同时写入暂存的actions, 正常结束时提交暂存分片, 出错时丢弃
+    """
+    if not root:
+        yield actions
+        return
+    writer = ShardWriter(shard_path(root, entity, raw_file))
+    try:
+        yield writer.tee(actions)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def read_shard(path, index, columns=None):
+    """
+    内存映射读取一个暂存分片, 逐个row group生成bulk action
+    :param index: 写入的索引名
+    :param columns: 只读取这些字段, None为全部
+    """
+    pa = _pyarrow()
+    if columns is not None and ID_COLUMN not in columns:
+        columns = list(columns) + [ID_COLUMN]
+    parquet_file = pa.parquet.ParquetFile(path, memory_map=True)
+    for batch in parquet_file.iter_batches(batch_size=ROW_GROUP_SIZE, columns=columns):
+        for row in batch.to_pylist():
+            doc_id = row.pop(ID_COLUMN)
+            yield {
+                '_index': index,
+                '_id': doc_id,
+                '_source': row,
+            }
+
+
+def list_shards(root, entity):
+    folder = os.path.join(root, entity)
+    shards = []
+    for sub_folder in sorted(os.listdir(folder)):
+        path = os.path.join(folder, sub_folder)
+        if os.path.isdir(path):
+            shards.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith('.parquet'))
+    return shards
+
+
+def read_table(root, entity, columns=None):
+    """
+    离线分析用: 把一个实体的所有暂存分片读成一个pyarrow.Table
+    """
+    pa = _pyarrow()
+    return pa.concat_tables([pa.parquet.read_table(path, columns=columns, memory_map=True)
+                             for path in list_shards(root, entity)], promote_options='permissive')
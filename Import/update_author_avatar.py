@@ -1,12 +1,10 @@
-from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search, Q
-from elasticsearch_dsl.connections import connections
 
-from config import ELAS_HOST
+from utils import es_client
 from utils.get_scholar_avatar import get_scholar_avatar
 
-connections.create_connection(hosts=[ELAS_HOST], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
-client = Elasticsearch(hosts=[ELAS_HOST], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
+es_client.configure()
+client = es_client.get_client(es_client.BATCH)
 def get_authors_with_high_h_index(index_name, client, h_index_threshold=4):
     # 创建一个查询对象
     search = Search(using=client, index=index_name)
@@ -13,7 +13,6 @@ from datetime import timedelta
 from pathlib import Path
 
 from celery.schedules import crontab
-from elasticsearch_dsl import connections
 
 try:
     from config import *
@@ -21,6 +20,8 @@ except ModuleNotFoundError:
     print('To handle the problem, you need to create a config python file at root path and write your settings.')
     exit(1)
 
+from utils import es_client
+
 JWT_KEY = 'nobc_backend'
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -75,6 +76,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # 记录各后端耗时, 放在最后只统计视图本身
+    "utils.timing.TimingMiddleware",
 ]
 
 ROOT_URLCONF = "NoBC.urls"
@@ -185,6 +188,8 @@ CACHES = {
         "KEY_PREFIX": "nobc",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # 缓存的大多是es结果, 压缩后redis内存和网络传输都小得多; 读取时未压缩的旧值照常解析
+            "COMPRESSOR": "django_redis.compressors.zlib.ZlibCompressor",
         }
     }
 }
@@ -197,20 +202,32 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_ANNOTATIONS = {'tasks.add': {'rate_limit': '10/s'}}
 CELERY_TASK_TIME_LIMIT = 20
 CELERY_WORKER_MAX_TASKS_PER_CHILD = 200
+# 不属于任何app的任务模块
+CELERY_IMPORTS = ['utils.cache']
 # CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
-connections.configure(
-    default={
-        'host': ELAS_HOST,
-        'http_auth': (ELAS_USER, ELAS_PASSWORD),
-        'scheme': 'http',
-        'verify_certs': False,
-        'timeout': 60,
-    }
-)
+# 论文问答: 每篇论文的向量库持久化目录, 最多保留的数量, 以及嵌入模型('openai' / 'hash' / 点分路径)
+PAPER_QA_STORE_DIR = BASE_DIR / 'paper_qa'
+PAPER_QA_MAX_STORES = 200
+PAPER_QA_EMBEDDINGS = 'openai'
+
+# es连接(default / batch)统一在utils.es_client中配置
+es_client.configure()
 CELERY_BEAT_SCHEDULE = {
     'update_visit_count': {
         'task': 'work.tasks.update_es',
         'schedule': timedelta(hours=1),
     },
+    'refresh_popular_works': {
+        'task': 'work.tasks.refresh_popular_works',
+        'schedule': timedelta(hours=6),
+    },
+    'precompute_popular_queries': {
+        'task': 'work.tasks.precompute_popular_queries',
+        'schedule': timedelta(minutes=15),
+    },
+    'update_recommend_authors': {
+        'task': 'author.tasks.update_recommend_authors',
+        'schedule': crontab(hour=4, minute=0),
+    },
 }
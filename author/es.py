@@ -1,6 +1,7 @@
-from elasticsearch_dsl.connections import connections
+from utils.entity import get_entity
+from utils.es_client import get_client
 
-elasticsearch_connection = connections.get_connection()
+elasticsearch_connection = get_client()
 
 # 索引名映射
 AUTHOR = 'author'
@@ -37,14 +38,6 @@ def es_get_works(author_id, page_num=-1, page_size=-1):
     return res
 
 
-# 根据id获取作者信息
-def es_get_author_by_id(author_id):
-    query_body = {
-        "query": {
-            "term": {
-                "id": author_id
-            }
-        }
-    }
-    res = elasticsearch_connection.search(index=AUTHOR, body=query_body)
-    return res
+# 根据id获取作者信息, 不存在时返回None
+def es_get_author_by_id(author_id, source=None):
+    return get_entity(AUTHOR, author_id, source)
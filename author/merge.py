@@ -0,0 +1,63 @@
+"""
+OpenAlex合并作者后, 把数据库中指向被合并作者的认证(scholar_identity)和关注(follows)转到目标作者
+由Import/DeltaSync.py在删除被合并作者的文档之前调用
+"""
+from django.db import transaction
+
+from author.models import Author
+from author.profile import invalidate_profile
+from user.models import User
+from utils.entity import bare_id, full_id
+
+
+def id_variants(author_id: str) -> list:
+    # 数据库中的作者id来自前端, 带前缀和不带前缀的都有
+    return [full_id(author_id), bare_id(author_id)]
+
+
+def rebind_author(old: Author, new_id: str) -> bool:
+    """
+    :param old: 被合并的作者
+    :param new_id: 合并到的作者id
+    :return: 是否完成; 被合并作者已认证而目标作者已被其他用户认证时返回False, 需要人工处理
+    """
+    with transaction.atomic():
+        target = Author.objects.filter(id__in=id_variants(new_id)).first()
+        if target is None:
+            # 沿用被合并作者的id格式
+            target = Author.objects.create(id=full_id(new_id) if old.id.startswith('http') else bare_id(new_id))
+        claimed_by = list(User.objects.filter(scholar_identity=old))
+        if claimed_by and User.objects.filter(scholar_identity=target).exists():
+            return False
+        for user in claimed_by:
+            user.scholar_identity = target
+            user.save()
+        for user in old.fans.all():
+            user.follows.add(target)
+            user.follows.remove(old)
+    return True
+
+
+def rebind_merged_authors(pairs: list) -> list:
+    """
+    :param pairs: [(被合并的id, 合并到的id)]
+    :return: 还不能删除文档的[(被合并的id, 合并到的id)]
+    """
+    pending = []
+    for start in range(0, len(pairs), 1000):
+        chunk = pairs[start:start + 1000]
+        # 绝大多数被合并的作者没有被认证或关注过, 先一次查出数据库中存在的
+        existing = {}
+        for author in Author.objects.filter(id__in=[i for old_id, _ in chunk for i in id_variants(old_id)]):
+            existing.setdefault(bare_id(author.id), []).append(author)
+        for old_id, new_id in chunk:
+            done = True
+            for old in existing.get(bare_id(old_id), []):
+                done = rebind_author(old, new_id) and done
+            if done:
+                invalidate_profile(new_id)
+            else:
+                print('author {} merged into {}: both are claimed, keep {} until rebound manually'.format(
+                    old_id, new_id, old_id))
+                pending.append((old_id, new_id))
+    return pending
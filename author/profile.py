@@ -0,0 +1,63 @@
+from django.core.cache import cache
+
+from author.es import AUTHOR
+from utils.entity import get_entity_with_version, update_entity
+
+# 学者主页各个接口用到的字段, 只缓存这些
+PROFILE_FIELDS = [
+    'id', 'avatar', 'display_name', 'chinese_name', 'title', 'phone', 'fax', 'email', 'address',
+    'personal_website', 'official_website', 'google', 'twitter', 'facebook', 'youtube', 'gender', 'language',
+    'last_known_institution', 'counts_by_year', 'works_count', 'cited_by_count', 'summary_stats',
+    'work_experience', 'personal_summary', 'education_background',
+]
+PROFILE_TIMEOUT = 60 * 30
+# 不存在的作者也缓存一小段时间, 避免反复查es
+MISSING_TIMEOUT = 60
+
+
+def get_profile_key(author_id: str) -> str:
+    return 'author_profile_' + author_id.split('/')[-1]
+
+
+def get_profile(author_id: str):
+    """
+    获取学者主页数据, 一次es查询供主页的多个接口共用
+    :param author_id: 作者id(带前缀)
+    :return: 作者_source的投影, 外加文档版本version; 不存在时返回None
+    """
+    key = get_profile_key(author_id)
+    profile = cache.get(key)
+    if profile is None:
+        profile, version = get_entity_with_version(AUTHOR, author_id, PROFILE_FIELDS)
+        if profile is None:
+            profile = {}
+        else:
+            profile['version'] = version
+        cache.set(key, profile, PROFILE_TIMEOUT if profile else MISSING_TIMEOUT)
+    return profile or None
+
+
+def invalidate_profile(author_id: str):
+    """
+    作者文档被修改后调用; 缓存里有version, 绕过update_profile修改作者文档的地方(增量同步、合并作者)也要调用
+    """
+    cache.delete(get_profile_key(author_id))
+
+
+def invalidate_all_profiles():
+    """
+    全量导入或重建author索引之后调用, 所有文档的version都变了
+    """
+    cache.delete_pattern(get_profile_key('*'))
+
+
+def update_profile(author_id: str, doc: dict, version=None) -> str:
+    """
+    局部更新学者信息并清除主页缓存
+    :param version: 客户端读取主页时拿到的version, 期间被别人修改过时抛出ConflictError
+    :return: 更新后的version
+    """
+    try:
+        return update_entity(AUTHOR, author_id, doc, version)
+    finally:
+        invalidate_profile(author_id)
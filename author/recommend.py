@@ -0,0 +1,175 @@
+import json
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from author.es import *
+from author.tasks import compute_global_rank, compute_recommend_for_user
+from user.models import User
+from utils.es_client import BATCH, get_client
+
+# 每个领域预先计算好的学者排行榜(有序集合, 分数为h-index), 以及学者的精简信息
+RANK_KEY = 'nobc:recommend_author:rank:{}'
+# 计算过但没有学者的领域, 与还没有计算的领域区分开
+EMPTY_RANK_KEY = 'nobc:recommend_author:empty:{}'
+GLOBAL_RANK = 'global'
+AUTHOR_INFO_KEY = 'nobc:recommend_author:info'
+# 收藏论文对应的主领域, 避免请求时再去es查论文
+WORK_CONCEPT_KEY = 'nobc:recommend_author:work_concept'
+RANK_SIZE = 50
+RANK_TIMEOUT = 60 * 60 * 24 * 2
+RECOMMEND_SIZE = 10
+# 同一个用户(全局排行榜用GLOBAL_RANK)同时只提交一个后台计算任务
+PENDING_KEY = 'recommend_author_pending_{}'
+PENDING_TIMEOUT = 60 * 10
+# 排行榜只在后台任务中计算, 使用长超时的连接
+batch_connection = get_client(BATCH)
+AUTHOR_SOURCE = ["id", "display_name", "avatar", "works_count", "cited_by_count",
+                 "summary_stats", "last_known_institution"]
+
+
+def simple_concept_id(concept_id: str) -> str:
+    return concept_id.split('/')[-1]
+
+
+def build_rank_query(concept_id: str) -> dict:
+    """
+    离线计算领域排行榜使用的查询, 只取前RANK_SIZE个
+    :param concept_id: 领域id(不带前缀)
+    """
+    if concept_id == GLOBAL_RANK:
+        query = {"match_all": {}}
+    else:
+        # author索引中的x_concepts.id带有前缀
+        query = {
+            "nested": {
+                "path": "x_concepts",
+                "query": {
+                    "term": {
+                        "x_concepts.id": prefix + concept_id
+                    }
+                }
+            }
+        }
+    return {
+        "query": query,
+        "sort": {
+            "summary_stats.h_index": {
+                "order": "desc"
+            }
+        },
+        "_source": AUTHOR_SOURCE,
+        "size": RANK_SIZE
+    }
+
+
+def compute_concept_rank(concept_id: str):
+    """
+    计算一个领域的学者排行榜并写入redis
+    :param concept_id: 领域id, 带不带前缀均可
+    """
+    concept_id = simple_concept_id(concept_id)
+    es_res = batch_connection.search(index=AUTHOR, body=build_rank_query(concept_id))
+    hits = es_res['hits']['hits']
+    redis_connection = get_redis_connection("default")
+    key = RANK_KEY.format(concept_id)
+    empty_key = EMPTY_RANK_KEY.format(concept_id)
+    pipeline = redis_connection.pipeline()
+    pipeline.delete(key, empty_key)
+    if hits:
+        pipeline.zadd(key, {hit['_source']['id']: hit['_source']['summary_stats']['h_index'] or 0 for hit in hits})
+        pipeline.hset(AUTHOR_INFO_KEY, mapping={hit['_source']['id']: json.dumps(hit['_source']) for hit in hits})
+        pipeline.expire(key, RANK_TIMEOUT)
+    else:
+        pipeline.set(empty_key, 1, ex=RANK_TIMEOUT)
+    pipeline.execute()
+
+
+def rank_computed(concept_id: str) -> bool:
+    redis_connection = get_redis_connection("default")
+    return bool(redis_connection.exists(RANK_KEY.format(concept_id), EMPTY_RANK_KEY.format(concept_id)))
+
+
+def get_global_rank() -> dict:
+    """
+    全局排行榜, 还没有计算过(首次部署或redis被清空)时提交后台计算, 这次返回空
+    :return: {学者id: 分数}
+    """
+    if not rank_computed(GLOBAL_RANK):
+        if cache.add(PENDING_KEY.format(GLOBAL_RANK), 1, PENDING_TIMEOUT):
+            compute_global_rank.delay()
+        return {}
+    redis_connection = get_redis_connection("default")
+    return dict(redis_connection.zrevrange(RANK_KEY.format(GLOBAL_RANK), 0, RANK_SIZE - 1, withscores=True))
+
+
+def compute_work_concepts(work_ids: list):
+    """
+    记录收藏论文的主领域, 一次mget取回
+    :param work_ids: 论文id列表
+    :return: 涉及到的领域id集合
+    """
+    if not work_ids:
+        return set()
+    es_res = batch_connection.mget(index=WORK, body={'ids': work_ids}, _source=['concepts.id'])
+    mapping = {}
+    for doc in es_res['docs']:
+        # 没有领域的论文记为空串, 避免反复计算
+        mapping[doc['_id']] = ''
+        if doc.get('found') and doc['_source'].get('concepts'):
+            mapping[doc['_id']] = simple_concept_id(doc['_source']['concepts'][0]['id'])
+    get_redis_connection("default").hset(WORK_CONCEPT_KEY, mapping=mapping)
+    return set(concept_id for concept_id in mapping.values() if concept_id)
+
+
+def get_user_concept_ids(user: User) -> tuple:
+    """
+    获取用户的推荐领域: 关注领域, 没有关注领域时使用收藏论文的领域
+    :param user: 用户对象
+    :return: (领域id列表(不带前缀), 是否有收藏论文还没有计算领域)
+    """
+    concept_ids = [simple_concept_id(concept.id) for concept in user.concept_focus.all()]
+    if concept_ids:
+        return concept_ids, False
+    work_ids = [favorite.work_id for favorite in user.favorite_set.all()]
+    if not work_ids:
+        return [], False
+    concept_ids = get_redis_connection("default").hmget(WORK_CONCEPT_KEY, work_ids)
+    missing = any(concept_id is None for concept_id in concept_ids)
+    return list({concept_id.decode('utf-8') for concept_id in concept_ids if concept_id}), missing
+
+
+def get_recommend_authors(user: User, size=RECOMMEND_SIZE) -> list:
+    """
+    合并用户相关领域的排行榜得到推荐学者, 请求路径上不访问es
+    :param user: 用户对象
+    :param size: 推荐数量
+    :return: 学者信息列表
+    """
+    redis_connection = get_redis_connection("default")
+    concept_ids, missing = get_user_concept_ids(user)
+    pipeline = redis_connection.pipeline()
+    for concept_id in concept_ids:
+        pipeline.zrevrange(RANK_KEY.format(concept_id), 0, RANK_SIZE - 1, withscores=True)
+        pipeline.exists(EMPTY_RANK_KEY.format(concept_id))
+    results = pipeline.execute() if concept_ids else []
+    ranks = results[0::2]
+    uncomputed = any(not rank and not empty for rank, empty in zip(results[0::2], results[1::2]))
+
+    # 新关注的领域/新收藏的论文还没有排行榜, 交给后台计算, 这次先用全局排行榜
+    if (missing or uncomputed) and cache.add(PENDING_KEY.format(user.email), 1, PENDING_TIMEOUT):
+        compute_recommend_for_user.delay(user.email)
+    merged = {}
+    for rank in ranks:
+        for author_id, score in rank:
+            merged[author_id] = max(score, merged.get(author_id, 0))
+    if not merged:
+        merged = get_global_rank()
+
+    followed = set(user.follows.values_list('id', flat=True))
+    author_ids = [author_id for author_id in sorted(merged, key=merged.get, reverse=True)
+                  if author_id.decode('utf-8') not in followed][:size]
+    if not author_ids:
+        return []
+    infos = redis_connection.hmget(AUTHOR_INFO_KEY, author_ids)
+    return [json.loads(info) for info in infos if info]
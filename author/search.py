@@ -0,0 +1,150 @@
+import hashlib
+import json
+import re
+
+from django.core.cache import cache
+
+from author.es import AUTHOR, elasticsearch_connection
+
+# 聚合只和过滤条件有关, 排序和翻页不影响, 所以单独缓存且时间更长
+AGGS_TIMEOUT = 60 * 30
+HITS_TIMEOUT = 60 * 5
+ORDER_FIELDS = {
+    'h-index': 'summary_stats.h_index',
+    'cite': 'cited_by_count',
+    'work': 'works_count',
+}
+
+
+def normalize_filters(author_name, institution=None, h_index_down=None, h_index_up=None) -> dict:
+    filters = {
+        'author_name': re.sub(r'\s+', ' ', author_name or '').strip().lower(),
+        'institution': institution or None,
+        'h_index': None,
+    }
+    # 和原来一样, 上下限都给了才过滤
+    if h_index_down and h_index_up:
+        filters['h_index'] = [int(h_index_down), int(h_index_up)]
+    return filters
+
+
+def build_query(filters: dict) -> dict:
+    must = [
+        {
+            "match": {
+                "display_name": filters['author_name']
+            },
+        },
+        {
+            "range": {
+                "summary_stats.i10_index": {
+                    "gte": 100
+                }
+            }
+        }
+    ]
+    # 添加聚合指标过滤
+    if filters['institution']:
+        must.append({
+            "term": {
+                "last_known_institution.display_name": filters['institution']
+            }
+        })
+    if filters['h_index']:
+        must.append({
+            "range": {
+                "summary_stats.h_index": {
+                    "gte": filters['h_index'][0],
+                    "lte": filters['h_index'][1]
+                }
+            }
+        })
+    return {"bool": {"must": must}}
+
+
+def build_aggs() -> dict:
+    # h-index 聚合用到的 range_list
+    range_list = [{"to": 10}]
+    for i in range(10, 50, 10):
+        range_list.append({"from": i, "to": i + 10})
+    range_list.append({"from": 50})
+    return {
+        "agg_term_institution": {
+            "terms": {
+                "field": "last_known_institution.display_name",
+            }
+        },
+        "agg_range_h_index": {
+            "range": {
+                "field": "summary_stats.h_index",
+                "ranges": range_list
+            }
+        }
+    }
+
+
+def parse_aggs(aggregations: dict) -> dict:
+    return {
+        'institutions': [{
+            'institution': bucket['key'],
+            'count': bucket['doc_count']
+        } for bucket in aggregations['agg_term_institution']['buckets']],
+        'h_index': [{
+            'h_index': bucket['key'],
+            'count': bucket['doc_count']
+        } for bucket in aggregations['agg_range_h_index']['buckets']],
+    }
+
+
+def get_filter_key(filters: dict) -> str:
+    return hashlib.md5(json.dumps(filters, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_aggs_key(filter_key: str) -> str:
+    return 'author_search_aggs_' + filter_key
+
+
+def get_hits_key(filter_key: str, order_by, page_num: int, page_size: int) -> str:
+    return 'author_search_hits_{}_{}_{}_{}'.format(filter_key, ORDER_FIELDS.get(order_by, ''), page_num, page_size)
+
+
+def search_authors(filters: dict, order_by=None, page_num=1, page_size=10, with_aggs=True) -> dict:
+    """
+    按作者名搜索, 命中和聚合分开缓存; 缺哪部分就在同一次请求里查哪部分
+    :param filters: normalize_filters的结果
+    :param order_by: default / h-index / cite / work
+    :param with_aggs: 是否需要聚合结果
+    :return: {'total', 'authors'(es原始_source), 以及with_aggs时的'institutions', 'h_index'}
+    """
+    filter_key = get_filter_key(filters)
+    aggs_key = get_aggs_key(filter_key)
+    hits_key = get_hits_key(filter_key, order_by, page_num, page_size)
+    cached = cache.get_many([hits_key, aggs_key] if with_aggs else [hits_key])
+    hits = cached.get(hits_key)
+    aggs = cached.get(aggs_key) if with_aggs else {}
+
+    if hits is None or aggs is None:
+        query_body = {"query": build_query(filters)}
+        if hits is None:
+            query_body['from'] = (page_num - 1) * page_size
+            query_body['size'] = page_size
+            if order_by in ORDER_FIELDS:
+                query_body['sort'] = {ORDER_FIELDS[order_by]: {"order": "desc"}}
+        else:
+            query_body['size'] = 0
+        if aggs is None:
+            query_body['aggs'] = build_aggs()
+        es_res = elasticsearch_connection.search(index=AUTHOR, body=query_body)
+        if hits is None:
+            hits = {
+                'total': es_res['hits']['total']['value'],
+                'authors': [hit['_source'] for hit in es_res['hits']['hits']],
+            }
+            cache.set(hits_key, hits, HITS_TIMEOUT)
+        if aggs is None:
+            aggs = parse_aggs(es_res['aggregations'])
+            cache.set(aggs_key, aggs, AGGS_TIMEOUT)
+
+    res = dict(aggs)
+    res.update(hits)
+    return res
@@ -38,3 +38,51 @@ def sort_remaining_results(remaining_results, base_cache_key):
 
 
 
+
+
+@shared_task(time_limit=60 * 5)
+def compute_recommend_for_user(user_email):
+    # 在任务内部导入, 避免应用加载时导入模型
+    from author.recommend import GLOBAL_RANK, PENDING_KEY, compute_concept_rank, compute_work_concepts, \
+        get_user_concept_ids, rank_computed
+    from user.models import User
+
+    try:
+        user = User.objects.get(email=user_email)
+        compute_work_concepts([favorite.work_id for favorite in user.favorite_set.all()])
+        concept_ids, _ = get_user_concept_ids(user)
+        for concept_id in concept_ids:
+            compute_concept_rank(concept_id)
+        # 全局排行榜是兜底, 缺失时一并补上
+        if not rank_computed(GLOBAL_RANK):
+            compute_concept_rank(GLOBAL_RANK)
+    finally:
+        cache.delete(PENDING_KEY.format(user_email))
+
+
+@shared_task(time_limit=60 * 5)
+def compute_global_rank():
+    from author.recommend import GLOBAL_RANK, PENDING_KEY, compute_concept_rank
+
+    try:
+        compute_concept_rank(GLOBAL_RANK)
+    finally:
+        cache.delete(PENDING_KEY.format(GLOBAL_RANK))
+
+
+# 全局CELERY_TASK_TIME_LIMIT只有20s, 离线计算需要单独放宽
+@shared_task(time_limit=60 * 30)
+def update_recommend_authors():
+    from author.recommend import GLOBAL_RANK, compute_concept_rank, compute_work_concepts, simple_concept_id
+    from concept.models import Concept
+    from user.models import Favorite
+
+    # 只计算被用户关注的领域和收藏论文涉及的领域
+    concept_ids = {simple_concept_id(concept_id) for concept_id in
+                   Concept.objects.filter(focus_user__isnull=False).values_list('id', flat=True).distinct()}
+    work_ids = list(Favorite.objects.values_list('work_id', flat=True).distinct())
+    for i in range(0, len(work_ids), 1000):
+        concept_ids |= compute_work_concepts(work_ids[i:i + 1000])
+    compute_concept_rank(GLOBAL_RANK)
+    for concept_id in concept_ids:
+        compute_concept_rank(concept_id)
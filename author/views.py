@@ -1,9 +1,9 @@
 import json
 import os
-import random
 from pprint import pprint
 
 from django.http import JsonResponse
+from elasticsearch.exceptions import ConflictError, NotFoundError
 from author.models import Author
 from user.models import User
 from user.views import save_file
@@ -12,146 +12,38 @@ from utils.qos import delete_file, upload_file, get_file
 from utils.view_decorator import allowed_methods, login_required
 from NoBC.status_code import *
 from author.es import *
+from author.recommend import get_recommend_authors
+from author.profile import get_profile, update_profile
+from author.search import normalize_filters, search_authors
+from utils.entity import get_entity_with_version
+from utils.es_client import get_client
 from work.views import get_citation
 
-elasticsearch_connection = connections.get_connection()
+elasticsearch_connection = get_client()
 
 
 # 1、根据作者名搜索，需要分页，只取前1w条以内的数据
 # 2、对结果进行聚合，只改变排序方式时不改变聚合结果
-# 3、使用聚合指标对结果（这个结果能不能暂存一下）进行过滤，过滤后再进行聚合
+# 3、聚合结果只和过滤条件有关，按过滤条件缓存；命中结果按过滤条件+排序+分页缓存
 @allowed_methods(['GET'])
 def get_author_by_name(request):
     author_name = request.GET.get('author_name')
     page_num = int(request.GET.get('page_num', 1))
     page_size = int(request.GET.get('page_size', 10))
     order_by = request.GET.get('order_by', None)
-    institution = request.GET.get('institution', None)
-    h_index_up = request.GET.get('h_index_up', None)
-    h_index_down = request.GET.get('h_index_down', None)
+    filters = normalize_filters(author_name, request.GET.get('institution', None),
+                                request.GET.get('h_index_down', None), request.GET.get('h_index_up', None))
 
-    query_body = {
-        "query": {
-            "bool": {
-                "must": [
-                    {
-                        "match": {
-                            "display_name": author_name
-                        },
-                    },
-                    {
-                        "range": {
-                            "summary_stats.i10_index": {
-                                "gte": 100
-                            }
-                        }
-                    }
-                ]
-            }
-        },
-        "from": (page_num - 1) * page_size,
-        "size": page_size,
-    }
-
-    # 添加聚合指标过滤
-    if institution is not None and institution != '':
-        query_body['query']['bool']['must'].append({
-            "term": {
-                "last_known_institution.display_name": institution
-            }
-        })
-    if h_index_up is not None and h_index_up != '' and h_index_down is not None and h_index_down != '':
-        query_body['query']['bool']['must'].append({
-            "range": {
-                "summary_stats.h_index": {
-                    "gte": h_index_down,
-                    "lte": h_index_up
-                }
-            }
-        })
-
-    res = {}
-    # 点击搜索按钮/按照聚合指标过滤时，order_by为空，这时候需要对结果进行按照 institution 和 h-index 范围进行聚合
-    if order_by is None or order_by == '':
-        # h-index 聚合用到的 range_list
-        range_list = [{
-            "to": 10
-        }]
-        for i in range(10, 50, 10):
-            range_list.append({
-                "from": i,
-                "to": i + 10
-            })
-        range_list.append({
-            "from": 50
-        })
-
-        agg_body = {
-            "query": query_body['query'],
-            "aggs": {
-                "agg_term_institution": {
-                    "terms": {
-                        "field": "last_known_institution.display_name",
-                    }
-                },
-                "agg_range_h_index": {
-                    "range": {
-                        "field": "summary_stats.h_index",
-                        "ranges": range_list
-                    }
-                }
-            }
-        }
-        # print(agg_body)
-        es_agg_res = elasticsearch_connection.search(index=AUTHOR, body=agg_body)
-        res['institutions'] = []
-        for bucket in es_agg_res['aggregations']['agg_term_institution']['buckets']:
-            tmp_institution = {
-                'institution': bucket['key'],
-                'count': bucket['doc_count']
-            }
-            res['institutions'].append(tmp_institution)
-
-        res['h_index'] = []
-        for bucket in es_agg_res['aggregations']['agg_range_h_index']['buckets']:
-            tmp_h_index = {
-                'h_index': bucket['key'],
-                'count': bucket['doc_count']
-            }
-            res['h_index'].append(tmp_h_index)
-    # 点击排序/分页按钮时，order_by不为空，增加排序字段，但不需要对结果进行聚合
-    # default / h - index / cite / work
-    else:
-        if order_by == 'h-index':
-            query_body['sort'] = {
-                "summary_stats.h_index": {
-                    "order": "desc"
-                }
-            }
-        elif order_by == 'cite':
-            query_body['sort'] = {
-                "cited_by_count": {
-                    "order": "desc"
-                }
-            }
-        elif order_by == 'work':
-            query_body['sort'] = {
-                "works_count": {
-                    "order": "desc"
-                }
-            }
-        else:
-            pass
-    # pprint(query_body)
-    es_query_res = elasticsearch_connection.search(index=AUTHOR, body=query_body)
-    res['total'] = es_query_res['hits']['total']['value']
+    # 点击搜索按钮/按照聚合指标过滤时，order_by为空，这时候需要返回按照 institution 和 h-index 范围的聚合结果
+    # 点击排序/分页按钮时，order_by不为空(default / h-index / cite / work)，不需要聚合
+    res = search_authors(filters, order_by, page_num, page_size, with_aggs=not order_by)
+    authors = res.pop('authors')
     res['authors'] = []
 
     # 临时链接
     default_author_avatar = get_file('default_author.png')
 
-    for hit in es_query_res['hits']['hits']:
-        tmp_author = hit['_source']
+    for tmp_author in authors:
         # 默认头像
         if tmp_author['avatar'] is None:
             tmp_author['avatar'] = default_author_avatar
@@ -176,10 +68,9 @@ def get_author_by_name(request):
 def get_author_by_id(request):
     author_id = request.GET.get('author_id')
 
-    es_res = es_get_author_by_id(author_id)
+    source = get_profile(author_id)
 
-    if es_res['hits']['total']['value'] != 0:
-        source = es_res['hits']['hits'][0]['_source']
+    if source is not None:
         res = {
             'avatar': source['avatar'],
             'name': source['display_name'],
@@ -198,7 +89,9 @@ def get_author_by_id(request):
             'facebook': source['facebook'],
             'youtube': source['youtube'],
             'gender': source['gender'],
-            'language': source['language']
+            'language': source['language'],
+            # 修改信息时带上, 用于检查是否有并发修改
+            'version': source['version']
         }
 
         if source['last_known_institution'] is not None:
@@ -227,14 +120,15 @@ def get_author_by_id(request):
 @allowed_methods(['GET'])
 def get_counts_by_year(request):
     author_id = request.GET.get('author_id')
-    es_res = es_get_author_by_id(author_id)
+    source = get_profile(author_id)
+    if source is None:
+        return response(PARAMS_ERROR, '作者不存在', error=True)
 
     res = [{
         'type': year,
         'papers': 0
     } for year in range(2017, 2024)]
 
-    source = es_res['hits']['hits'][0]['_source']
     for year in source['counts_by_year']:
         res[int(year['year']) - 2017]['papers'] = year['works_count']
 
@@ -380,10 +274,11 @@ def get_co_author_list(request):
                 else:
                     tmp_dic['organization'] = None
 
-                # 记得带上前缀
-                tmp_author = es_get_author_by_id(prefix + author_ship['author']['id'])
+                # 记得带上前缀, 和学者主页共用缓存
+                tmp_author_source = get_profile(prefix + author_ship['author']['id'])
                 # 这里应该是都能搜得到的，除非数据导入不完整
-                tmp_author_source = tmp_author['hits']['hits'][0]['_source']
+                if tmp_author_source is None:
+                    continue
                 if tmp_author_source['avatar'] is None:
                     tmp_dic['avatar'] = default_author_avatar
                 elif tmp_author_source['avatar'].startswith('https'):
@@ -409,17 +304,10 @@ def get_co_author_list(request):
 @allowed_methods(['GET'])
 def get_scholar_metrics(request):
     author_id = request.GET.get('author_id')
-    query_body = {
-        "query": {
-            "term": {
-                "id": author_id
-            }
-        },
-        "_source": ["works_count", "cited_by_count", "summary_stats"]
-    }
-    es_res = elasticsearch_connection.search(index=AUTHOR, body=query_body)
+    source = get_profile(author_id)
+    if source is None:
+        return response(PARAMS_ERROR, '作者不存在', error=True)
 
-    source = es_res['hits']['hits'][0]['_source']
     res = {
         'Papers': source['works_count'],
         'Citation': source['cited_by_count'],
@@ -442,16 +330,10 @@ def get_scholar_metrics(request):
 @allowed_methods(['GET'])
 def get_scholar_intro_information(request):
     author_id = request.GET.get('author_id')
-    query_body = {
-        "query": {
-            "term": {
-                "id": author_id
-            }
-        }
-    }
-    es_res = elasticsearch_connection.search(index=AUTHOR, body=query_body)
+    source = get_profile(author_id)
+    if source is None:
+        return response(PARAMS_ERROR, '作者不存在', error=True)
 
-    source = es_res['hits']['hits'][0]['_source']
     res = {
         'workExperience': source['work_experience'],
         'personalSummary': source['personal_summary'],
@@ -466,6 +348,21 @@ def get_scholar_intro_information(request):
     })
 
 
+def save_profile(author_id, doc, version=None, msg='success'):
+    """
+    保存学者信息的修改, 返回新的version供下次修改使用
+    """
+    try:
+        version = update_profile(author_id, doc, version)
+    except ConflictError:
+        return response(PARAMS_ERROR, '学者信息已被修改，请刷新后重试', error=True)
+    except NotFoundError:
+        return response(PARAMS_ERROR, '学者不存在', error=True)
+    except ValueError:
+        return response(PARAMS_ERROR, 'version格式错误', error=True)
+    return response(SUCCESS, msg, {'version': version})
+
+
 # 上传学者简介信息
 @allowed_methods(['POST'])
 @login_required
@@ -475,33 +372,12 @@ def post_scholar_intro_information(request):
     personal_summary = request.POST.get('personalSummary')
     education_background = request.POST.get('educationBackground')
 
-    # 写入es
-    update_body = {
-        "query": {
-            "term": {
-                "id": author_id,
-            }
-        },
-        "script": {
-            "source": "ctx._source.work_experience = params.work_experience; "
-                      "ctx._source.personal_summary = params.personal_summary; "
-                      "ctx._source.education_background = params.education_background",
-            "params": {
-                "work_experience": work_experience,
-                "personal_summary": personal_summary,
-                "education_background": education_background
-            }
-        }
-    }
-    # 局部更新
-    elasticsearch_connection.update_by_query(index=AUTHOR, body=update_body)
-
-    return JsonResponse({
-        'code': SUCCESS,
-        'error': False,
-        'msg': 'success',
-        'data': {}
-    })
+    # 按_id局部更新, 带上读取时的版本, 防止覆盖别人的修改
+    return save_profile(author_id, {
+        "work_experience": work_experience,
+        "personal_summary": personal_summary,
+        "education_background": education_background
+    }, request.POST.get('version'))
 
 
 # 上传学者基本信息
@@ -527,60 +403,28 @@ def post_scholar_basic_information(request):
     gender = request.POST.get('gender')
     language = request.POST.get('language')
 
-    # 写入es
-    update_body = {
-        "query": {
-            "term": {
-                "id": author_id,
-            }
+    # 按_id局部更新, 带上读取时的版本, 防止覆盖别人的修改
+    return save_profile(author_id, {
+        "display_name": display_name,
+        "chinese_name": chinese_name,
+        "title": title,
+        "phone": phone,
+        "fax": fax,
+        "email": email,
+        # 对象字段会和原文档合并, 只改display_name
+        "last_known_institution": {
+            "display_name": english_affiliation
         },
-        "script": {
-            "source": "ctx._source.display_name = params.display_name; "
-                      "ctx._source.chinese_name = params.chinese_name; "
-                      "ctx._source.title = params.title; "
-                      "ctx._source.phone = params.phone; "
-                      "ctx._source.fax = params.fax; "
-                      "ctx._source.email = params.email; "
-                      "ctx._source.last_known_institution.display_name = params.english_affiliation; "
-                      "ctx._source.address = params.address; "
-                      "ctx._source.personal_website = params.personal_website; "
-                      "ctx._source.official_website = params.official_website; "
-                      "ctx._source.google = params.google; "
-                      "ctx._source.twitter = params.twitter; "
-                      "ctx._source.facebook = params.facebook; "
-                      "ctx._source.youtube = params.youtube; "
-                      "ctx._source.gender = params.gender; "
-                      "ctx._source.language = params.language",
-            "params": {
-                "display_name": display_name,
-                "chinese_name": chinese_name,
-                "title": title,
-                "phone": phone,
-                "fax": fax,
-                "email": email,
-                "english_affiliation": english_affiliation,
-                "address": address,
-                "personal_website": personal_website,
-                "official_website": official_website,
-                "google": google,
-                "twitter": twitter,
-                "facebook": facebook,
-                "youtube": youtube,
-                "gender": gender,
-                "language": language
-            }
-        }
-    }
-
-    # 局部更新
-    elasticsearch_connection.update_by_query(index=AUTHOR, body=update_body)
-
-    return JsonResponse({
-        'code': SUCCESS,
-        'error': False,
-        'msg': 'success',
-        'data': {}
-    })
+        "address": address,
+        "personal_website": personal_website,
+        "official_website": official_website,
+        "google": google,
+        "twitter": twitter,
+        "facebook": facebook,
+        "youtube": youtube,
+        "gender": gender,
+        "language": language
+    }, request.POST.get('version'))
 
 
 # 上传学者头像
@@ -594,8 +438,10 @@ def post_scholar_avatar(request):
         # 暂存到本地
         file_path = save_file(avatar)
         # 获取学者信息
-        es_res = es_get_author_by_id(author_id)
-        source = es_res['hits']['hits'][0]['_source']
+        source, version = get_entity_with_version(AUTHOR, author_id, ['id', 'avatar'])
+        if source is None:
+            os.remove(file_path)
+            return response(PARAMS_ERROR, '学者不存在', error=True)
         # 删除原有头像
         if source['avatar'] is not None:
             delete_file(source['avatar'])
@@ -604,25 +450,10 @@ def post_scholar_avatar(request):
         key = simple_id + '_avatar.png'
         ret = upload_file(key, file_path)
         if ret:
-            # 写入es
-            update_body = {
-                "query": {
-                    "term": {
-                        "id": author_id,
-                    }
-                },
-                "script": {
-                    "source": "ctx._source.avatar = params.avatar",
-                    "params": {
-                        "avatar": key
-                    }
-                }
-            }
-            # 局部更新
-            elasticsearch_connection.update_by_query(index=AUTHOR, body=update_body)
             # 删除本地存储的文件
             os.remove(file_path)
-            return response(SUCCESS, '上传头像成功！')
+            # 按_id局部更新, 读取之后头像被别人改过时不覆盖
+            return save_profile(author_id, {"avatar": key}, version, '上传头像成功！')
         else:
             os.remove(file_path)
             return response(FILE_ERROR, '上传头像失败！', error=True)
@@ -631,94 +462,22 @@ def post_scholar_avatar(request):
 
 
 # 获取推荐学者
+# 各领域的学者排行榜由后台任务离线计算并存入redis, 这里只做合并
 @allowed_methods(['GET'])
 @login_required
 def get_recommend_author(request):
     user = request.user
     user: User
 
-    res = []
-    # 获取关注领域
-    concepts = user.concept_focus.all()
-    # 获取收藏论文
-    favorites = user.favorite_set.all()
-    # 有关注领域
-    if len(concepts) > 0:
-        # 随机选取一个关注领域去推送
-        index = random.randint(0, len(concepts) - 1)
-        target_concept_id = concepts[index].id
-        query_body = {
-            "query": {
-                "nested": {
-                    "path": "x_concepts",
-                    "query": {
-                        "term": {
-                            "x_concepts.id": target_concept_id
-                        }
-                    }
-                }
-            },
-            "sort": {
-                "summary_stats.h_index": {
-                    "order": "desc"
-                }
-            }
-        }
-    # 没有关注领域，看收藏论文的领域
-    elif len(favorites) > 0:
-        index = random.randint(0, len(favorites) - 1)
-        target_work_id = favorites[index].work.id
-        # 查找这篇论文的所属领域
-        query_body = {
-            "query": {
-                "term": {
-                    "id": target_work_id
-                }
-            }
-        }
-        es_res = elasticsearch_connection.search(index=WORK, body=query_body)
-        target_concept_id = es_res['hits']['hits'][0]['_source']['concepts'][0]['id']
-        query_body = {
-            "query": {
-                "nested": {
-                    "path": "x_concepts",
-                    "query": {
-                        "term": {
-                            "x_concepts.id": target_concept_id
-                        }
-                    }
-                }
-            },
-            "sort": {
-                "summary_stats.h_index": {
-                    "order": "desc"
-                }
-            }
-        }
-    # 不分区域，直接h_index排序
-    else:
-        query_body = {
-            "query": {
-                "match_all": {}
-            },
-            "sort": {
-                "summary_stats.h_index": {
-                    "order": "desc"
-                }
-            }
-        }
-
-    es_res = elasticsearch_connection.search(index=AUTHOR, body=query_body)
+    res = get_recommend_authors(user)
 
     default_author_avatar = get_file('default_author.png')
-    for hit in es_res['hits']['hits']:
-        tmp_author = hit['_source']
+    for tmp_author in res:
         if tmp_author['avatar'] is None:
             tmp_author['avatar'] = default_author_avatar
         elif tmp_author['avatar'].startswith('https'):
             pass
         else:
             tmp_author['avatar'] = get_file(tmp_author['avatar'])
-        res.append(tmp_author)
 
     return response(SUCCESS, 'success', data=res)
@@ -0,0 +1,171 @@
+import heapq
+import math
+import random
+from collections import defaultdict
+
+from django.core.cache import cache
+
+from user.models import User, History
+from utils.es_client import get_client
+
+client = get_client()
+
+WORK_INDEX = 'work'
+# 关注领域的权重, 浏览记录推断出的领域按出现次数和时间衰减计算权重
+FOCUS_CONCEPT_WEIGHT = 2.0
+HISTORY_DECAY = 0.8
+HISTORY_SIZE = 8
+# 候选池大小与缓存时间, 刷新时只在候选池中采样, 不再查询es
+POOL_SIZE = 200
+POOL_TIMEOUT = 60 * 10
+HOT_POOL_KEY = 'concept_feed_hot'
+FEED_SOURCE = ["abstract", "title", "visit_count", "cited_by_count",
+               "publication_date", "language", "authorships",
+               "locations", "id", "type", "citation"]
+
+
+def get_pool_key(user: User) -> str:
+    return 'concept_feed_' + user.email
+
+
+def invalidate_feed(user: User):
+    """
+    用户关注领域变化时清除候选池
+    :param user: 用户对象
+    """
+    cache.delete(get_pool_key(user))
+
+
+def get_history_concept_weights(user: User) -> dict:
+    """
+    根据最近浏览的论文推断领域权重, 一次mget取回所有论文的concepts
+    :param user: 用户对象
+    :return: {concept_id: weight}
+    """
+    recent_histories = History.objects.filter(user=user).order_by('-date_time')[:HISTORY_SIZE]
+    work_ids = [history.work_id for history in recent_histories]
+    weights = defaultdict(float)
+    if not work_ids:
+        return weights
+    response = client.mget(index=WORK_INDEX, body={'ids': work_ids}, _source=['concepts.id'])
+    for rank, doc in enumerate(response['docs']):
+        if not doc.get('found'):
+            continue
+        # 越新的浏览记录权重越高
+        decay = HISTORY_DECAY ** rank
+        for concept in doc['_source'].get('concepts', []):
+            if concept.get('id'):
+                weights[concept['id']] += decay
+    return weights
+
+
+def get_concept_weights(user: User) -> dict:
+    """
+    获取用户的领域权重, 优先使用关注领域, 没有关注领域时使用浏览记录
+    :param user: 用户对象
+    :return: {concept_id: weight}
+    """
+    concept_focus = user.concept_focus.all()
+    if len(concept_focus) > 0:
+        # work索引中的concepts.id去掉了前缀
+        return {concept.id.split('/')[-1]: FOCUS_CONCEPT_WEIGHT for concept in concept_focus}
+    return get_history_concept_weights(user)
+
+
+def build_feed_query(weights: dict) -> dict:
+    """
+    构造一次性覆盖所有领域的查询, 每个领域按权重加分, 再结合引用数排序
+    :param weights: {concept_id: weight}
+    :return: 查询体
+    """
+    should = [{
+        "nested": {
+            "path": "concepts",
+            "query": {"term": {"concepts.id": concept_id}},
+            "boost": weight
+        }
+    } for concept_id, weight in weights.items()]
+    return {
+        "query": {
+            "function_score": {
+                "query": {
+                    "bool": {
+                        "should": should,
+                        "minimum_should_match": 1
+                    }
+                },
+                "field_value_factor": {
+                    "field": "cited_by_count",
+                    "modifier": "log1p",
+                    "missing": 0
+                },
+                "boost_mode": "multiply"
+            }
+        },
+        "_source": FEED_SOURCE,
+        "size": POOL_SIZE
+    }
+
+
+def build_hot_query() -> dict:
+    return {
+        "query": {
+            "match_all": {}
+        },
+        "_source": FEED_SOURCE,
+        "sort": [{"cited_by_count": {"order": "desc"}}],
+        "size": 100
+    }
+
+
+def fetch_pool(query: dict) -> list:
+    response = client.search(index=WORK_INDEX, body=query)
+    pool = []
+    for hit in response['hits']['hits']:
+        source = hit["_source"]
+        pool.append({
+            "highlight": {
+                "abstract": [source.get("abstract", "")],
+                "title": [source.get("title", "")]
+            },
+            "other": source
+        })
+    return pool
+
+
+def get_feed_pool(user: User) -> list:
+    """
+    获取用户的候选池, 命中缓存时不访问es
+    :param user: 用户对象
+    :return: 候选论文列表
+    """
+    key = get_pool_key(user)
+    pool = cache.get(key)
+    if pool is not None:
+        return pool
+    weights = get_concept_weights(user)
+    if weights:
+        pool = fetch_pool(build_feed_query(weights))
+        cache.set(key, pool, timeout=POOL_TIMEOUT)
+        return pool
+    # 没有任何领域信息的用户共享同一个热门候选池
+    pool = cache.get(HOT_POOL_KEY)
+    if pool is None:
+        pool = fetch_pool(build_hot_query())
+        cache.set(HOT_POOL_KEY, pool, timeout=POOL_TIMEOUT)
+    return pool
+
+
+def sample_feed(user: User, size=10) -> list:
+    """
+    从候选池中按分数排名加权采样
+    :param user: 用户对象
+    :param size: 采样数量
+    :return: 论文列表
+    """
+    pool = get_feed_pool(user)
+    if len(pool) <= size:
+        return list(pool)
+    # 不放回加权采样, 权重为1/log(rank+2), 排名越靠前被抽中的概率越大, 但保留一定的多样性
+    chosen = heapq.nlargest(size, range(len(pool)), key=lambda rank: random.random() ** math.log(rank + 2))
+    return [pool[rank] for rank in chosen]
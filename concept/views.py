@@ -1,24 +1,27 @@
 import heapq
-import random
 
 from celery import shared_task
-from django.core.cache import cache
 from django.http import JsonResponse
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search, Q
-from elasticsearch_dsl.connections import connections
 
-from concept.models import Concept
-from user.models import User, History
+from concept.feed import sample_feed
+from user.models import User
 from NoBC.status_code import *
+from utils.cache import get_or_compute
+from utils.entity import doc_id, get_entity
 from utils.generate_image import generate_image
 from utils.view_decorator import allowed_methods, login_required
 from utils.translate import translate
 from utils.qos import upload_file, get_file
+from utils.es_client import get_client
 
 # Create your views here.
 
-client = connections.get_connection()
+client = get_client()
+CONCEPT_TIMEOUT = 60 * 60 * 30
+# 领域详情很小且访问集中, 在进程内也缓存一会
+CONCEPT_LOCAL_TIMEOUT = 60
 
 
 @allowed_methods(['GET'])
@@ -185,29 +188,17 @@ def search_concept_by_keyword(request):
     return JsonResponse({'code': SUCCESS, 'msg': 'no error', 'data': results})
 
 
-@allowed_methods(['GET'])
-def get_concept_by_id(request):
-    id = request.GET.get('id')
-    if cache.get(id):
-        print('cache hit')
-        return JsonResponse({'code': SUCCESS, 'msg': 'no error', 'data': cache.get(id)})
-    query = {
-        "query": {
-            "term": {
-                "id": id
-            }
-        },
-        "_source": ["id", "display_name", "chinese_display_name", "level", "description", "chinese_description",
-                    "summary_stats", "works_count", "cited_by_count",
-                    "related_concepts", "ancestors", "image_url", "counts_by_year"],
-        "size": 1
-    }
-
-    response = client.search(index="concept", body=query)
+def fetch_concept(id):
+    """
+    领域详情, 缺少的中文名称和描述翻译后写回es
+    :return: [领域], 不存在时为[]
+    """
+    source_data = get_entity('concept', id, ["id", "display_name", "chinese_display_name", "level", "description",
+                                             "chinese_description", "summary_stats", "works_count", "cited_by_count",
+                                             "related_concepts", "ancestors", "image_url", "counts_by_year"])
     results = []
-    for hit in response['hits']['hits']:
-        source_data = hit['_source']
-        document_id = hit['_id']
+    if source_data is not None:
+        document_id = doc_id('concept', id)
 
         # 收集需要翻译的 display_name
         to_translate = []
@@ -249,28 +240,24 @@ def get_concept_by_id(request):
             client.update(index="concept", id=document_id, body=update_body)
 
         results.append(source_data)
-    cache.set(id, results, timeout=60 * 60 * 30)
+    return results
+
+
+@allowed_methods(['GET'])
+def get_concept_by_id(request):
+    id = request.GET.get('id', '')
+    results, _ = get_or_compute('concept_detail', fetch_concept, [id], soft_timeout=CONCEPT_TIMEOUT,
+                                 local_timeout=CONCEPT_LOCAL_TIMEOUT)
     return JsonResponse({'code': SUCCESS, 'msg': 'no error', 'data': results})
 
 
 @allowed_methods(['GET'])
 def get_ancestor_concepts(request):
     id = request.GET.get('id')
-    query = {
-        "query": {
-            "term": {
-                "id": id
-            }
-        },
-        "_source": ["id", "ancestors"],
-        "size": 1
-    }
-
-    response = client.search(index="concept", body=query)
+    source_data = get_entity('concept', id, ["id", "ancestors"])
     results = []
-    for hit in response['hits']['hits']:
-        source_data = hit['_source']
-        document_id = hit['_id']
+    if source_data is not None:
+        document_id = doc_id('concept', id)
 
         # 收集需要翻译的 display_name
         to_translate = []
@@ -383,112 +370,6 @@ def search_works_by_concept(request):
 def get_works_with_followed_concepts(request):
     user = request.user
     user: User
-    concept_focus = user.concept_focus.all()
-    results = []
-    query = {}
-
-    if len(concept_focus) > 0:
-        # 收集每个概念的论文
-        for concept in concept_focus:
-            concept: Concept
-            id = concept.id.split('/')[-1]
-
-            # 构建查询
-            query = {
-                "query": {
-                    "nested": {
-                        "path": "concepts",
-                        "query": {
-                            "bool": {
-                                "must": [
-                                    {"match": {"concepts.id": id}}
-                                ]
-                            }
-                        }
-                    }
-                },
-                "_source": ["abstract", "title", "visit_count", "cited_by_count",
-                         "publication_date", "language", "authorships",
-                         "locations", "id", "type", "citation"],
-                "sort": [
-                    {
-                        "cited_by_count": {
-                            "order": "desc"
-                        }
-                    }
-                ],
-                "size": 50  # 每个概念获取 100 篇论文
-            }
-    else:
-        recent_histories = History.objects.filter(user=user).order_by('-date_time')[:8]
-        if len(recent_histories) > 0:
-            # 获取论文 ID
-            work_ids = [history.work.id for history in recent_histories]
-
-            # 获取相关论文的 concepts ID
-            concept_ids = set()
-            for work_id in work_ids:
-                query = {
-                    "query": {
-                        "match": {
-                            "id": work_id
-                        }
-                    },
-                    "_source": ["concepts.id"]
-                }
-                response = client.search(index="work", body=query)
-                for hit in response['hits']['hits']:
-                    concepts = hit["_source"].get("concepts", [])
-                    for concept in concepts:
-                        concept_ids.add(concept["id"])
-
-            # 对每个 concept ID 进行搜索
-            for concept_id in concept_ids:
-                query = {
-                    "query": {
-                        "nested": {
-                            "path": "concepts",
-                            "query": {
-                                "bool": {
-                                    "must": [
-                                        {"match": {"concepts.id": concept_id}}
-                                    ]
-                                }
-                            }
-                        }
-                    },
-                    "_source": ["abstract", "title", "visit_count", "cited_by_count",
-                                "publication_date", "language", "authorships",
-                                "locations", "id", "type", "citation"],
-                    "sort": [{"cited_by_count": {"order": "desc"}}],
-                    "size": 50  # 获取 100 篇论文
-                }
-        else:
-            # 获取最热门的 100 篇论文
-            query = {
-                "query": {
-                    "match_all": {}
-                },
-                "_source": ["abstract", "title", "visit_count", "cited_by_count",
-                            "publication_date", "language", "authorships",
-                            "locations", "id", "type", "citation"],
-                "sort": [{"cited_by_count": {"order": "desc"}}],
-                "size": 100  # 获取 100 篇论文
-            }
-
-    # 执行搜索
-    response = client.search(index="work", body=query)
-    # 将结果添加到 results 列表
-    for hit in response['hits']['hits']:
-        source = hit["_source"]
-        # 构造 highlight 和 other 数据结构
-        result_item = {
-            "highlight": {
-                    "abstract": [source.get("abstract", "")],
-                    "title": [source.get("title", "")]
-                },
-                "other": source
-            }
-        results.append(result_item)
-    results = random.sample(results, 10)
-    return JsonResponse({'code': SUCCESS, 'error':False,'message': 'no error', 'data': results})
+    # 候选池按用户缓存, 刷新时只在候选池中重新采样
+    results = sample_feed(user, 10)
+    return JsonResponse({'code': SUCCESS, 'error': False, 'message': 'no error', 'data': results})
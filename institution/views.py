@@ -1,14 +1,15 @@
-from elasticsearch_dsl import Search, connections, Q
+from elasticsearch_dsl import Search, Q
 
 from NoBC.status_code import *
 from utils.Response import response
-from config import ELAS_USER, ELAS_PASSWORD, ELAS_HOST
+from utils.entity import get_entity
+from utils.es_client import get_client
 
 # Create your views here.
 
-# 创建es连接,有密码
+# es连接统一从utils.es_client获取
 ES_NAME = 'institution'
-ES_CONN = connections.create_connection(hosts=[ELAS_HOST], http_auth=(ELAS_USER, ELAS_PASSWORD), timeout=20)
+ES_CONN = get_client()
 
 
 def pagination(search, request) -> Search:
@@ -36,6 +37,45 @@ def pagination(search, request) -> Search:
     return ret
 
 
+def extract_data(origin_data: dict, key_list: [], deeper_name_list=None) -> dict:
+    """
+    从单个文档中提取需要返回的字段
+    :param origin_data: 文档的_source
+    :param key_list 需要返回的字段
+    :param deeper_name_list: 深层嵌套提取
+    :return: 提取后的数据
+    """
+    dic = dict()
+    if len(key_list) == 0:
+        dic = origin_data
+    else:
+        for key in key_list:
+            dic[key] = origin_data[key]
+            if origin_data[key] is None and key == 'image_url':
+                dic[key] = 'http://nobc.buaa-q9k.xyz/default_institution.png?e=1734783247&token=yMU1x7iZW8SmH14FmEP0sjoG1yflO_NJKtsoOGwk:J5FtwKmo6-5TeSMdTmUVBCec87s='
+        if deeper_name_list:
+            # 遍历需要深一层获取的名字
+            for key in deeper_name_list.keys():
+                # 获取名字对应的数据,可能是数组,也可能是字典
+                deeper_origin_data = origin_data[key]
+                # 遍历需要获取的字段
+                # 是数组
+                if type(deeper_origin_data) is list:
+                    tmp_list = []
+                    for list_ele in deeper_origin_data:
+                        tmp = dict()
+                        for name in deeper_name_list[key]:
+                            tmp[name] = list_ele[name]
+                        tmp_list.append(tmp)
+                    dic[key] = tmp_list
+                # 是字典
+                else:
+                    dic[key] = dict()
+                    for name in deeper_name_list[key]:
+                        dic[key][name] = deeper_origin_data[name]
+    return dic
+
+
 def get_return_data(search: Search, data_name: str, key_list: [], deeper_name_list=None) -> dict:
     """
     获取返回数据
@@ -46,38 +86,7 @@ def get_return_data(search: Search, data_name: str, key_list: [], deeper_name_li
     :return: 返回数据 data: {total: int, name: [{}, {}]}
     """
     ret = search.execute().to_dict()['hits']['hits']
-    data = []
-    for ele in ret:
-        origin_data = ele['_source']
-        dic = dict()
-        if len(key_list) == 0:
-            dic = origin_data
-        else:
-            for key in key_list:
-                dic[key] = origin_data[key]
-                if origin_data[key] is None and key == 'image_url':
-                    dic[key] = 'http://nobc.buaa-q9k.xyz/default_institution.png?e=1734783247&token=yMU1x7iZW8SmH14FmEP0sjoG1yflO_NJKtsoOGwk:J5FtwKmo6-5TeSMdTmUVBCec87s='
-            if deeper_name_list:
-                # 遍历需要深一层获取的名字
-                for key in deeper_name_list.keys():
-                    # 获取名字对应的数据,可能是数组,也可能是字典
-                    deeper_origin_data = origin_data[key]
-                    # 遍历需要获取的字段
-                    # 是数组
-                    if type(deeper_origin_data) is list:
-                        tmp_list = []
-                        for list_ele in deeper_origin_data:
-                            tmp = dict()
-                            for name in deeper_name_list[key]:
-                                tmp[name] = list_ele[name]
-                            tmp_list.append(tmp)
-                        dic[key] = tmp_list
-                    # 是字典
-                    else:
-                        dic[key] = dict()
-                        for name in deeper_name_list[key]:
-                            dic[key][name] = deeper_origin_data[name]
-        data.append(dic)
+    data = [extract_data(ele['_source'], key_list, deeper_name_list) for ele in ret]
     return_data = dict()
     return_data['total'] = search.count()
     return_data[data_name] = data
@@ -116,16 +125,16 @@ def getInstitutionDetail(request):
         institution_id = request.GET.get('id', "")
         if institution_id == "":
             return response(PARAMS_ERROR, '参数错误')
-        # 查询
-        search = Search(using=ES_CONN, index='institution').query('term', id=institution_id)
+        # 按_id直接获取
         key_list = ['display_name', 'type', 'chinese_display_name', 'image_url', 'homepage_url',
                     'lineage', 'counts_by_year', 'repositories']
         deeper_name_map = {'associated_institutions': ['id', 'display_name'],
                            'geo': ['country_code', 'city']}
-        ret = get_return_data(search, 'institution', key_list, deeper_name_map)
-        if len(ret) == 0:
+        source = get_entity(ES_NAME, institution_id, key_list + list(deeper_name_map.keys()))
+        if source is None:
             return response(ELASTIC_ERROR, '未找到该机构', error=True)
         else:
+            ret = {'total': 1, 'institution': [extract_data(source, key_list, deeper_name_map)]}
             return response(SUCCESS, '查询成功', ret)
     else:
         return response(METHOD_ERROR, '请求方式错误', error=True)
@@ -15,5 +15,9 @@ urlpatterns = [
     path('get_user_info_by_email/',get_user_info_by_email),
     path('get_user_avatar_by_email/', get_user_avatar_by_email),
     path('test_message/', test_message),
+    path('get_latency_stats/', get_latency_stats),
+    path('reset_latency_stats/', reset_latency_stats),
+    path('get_cache_stats/', get_cache_stats),
+    path('reset_cache_stats/', reset_cache_stats),
 
 ]
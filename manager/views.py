@@ -2,8 +2,6 @@ from datetime import datetime
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from elasticsearch_dsl import Search
-from elasticsearch_dsl.connections import connections
 
 from NoBC.status_code import *
 from config import ELAS_USER, ELAS_PASSWORD, ELAS_HOST
@@ -12,13 +10,14 @@ from message.models import Certification, Complaint, Message
 from user.models import User
 from utils.Response import response
 from utils.Token import generate_token
+from utils.entity import get_entity
+from utils import cache, timing
 from utils.qos import get_file
 from utils.view_decorator import allowed_methods, manager_login_required
 
 # Create your views here.
 
 ES_NAME = 'author'
-ES_CONN = connections.get_connection()
 
 
 def login(request):
@@ -47,14 +46,13 @@ def login(request):
 def get_message_data(dic: dict, user_avatar_key, author_id: str, default_author_avatar: str):
     # 加上用户和学者头像
     dic['user_avatar'] = get_file(user_avatar_key)
-    search = Search(using=ES_CONN, index=ES_NAME).query('term', id=author_id)
-    ret = search.execute().to_dict()['hits']['hits']
-    if len(ret) == 0:
+    source = get_entity(ES_NAME, author_id, ['display_name', 'avatar'])
+    if source is None:
         dic['author_avatar'] = ''
         dic['author_name'] = ''
     else:
-        dic['author_name'] = ret[0]['_source']['display_name']
-        author_avatar_key = ret[0]['_source']['avatar']
+        dic['author_name'] = source['display_name']
+        author_avatar_key = source['avatar']
         if author_avatar_key:
             dic['author_avatar'] = get_file(author_avatar_key)
         else:
@@ -337,13 +335,12 @@ def get_author_name(author_id):
     :param author_id: 学者id
     :return: 学者姓名
     """
-    # es搜索
-    search = Search(using=ES_CONN, index=ES_NAME).query('term', id=author_id)
-    ret = search.execute().to_dict()['hits']['hits']
-    if len(ret) == 0:
+    # 按_id直接获取
+    source = get_entity(ES_NAME, author_id, ['display_name'])
+    if source is None:
         return '未知'
     else:
-        return ret[0]['_source']['display_name']
+        return source['display_name']
 
 
 def get_user_by_email(email):
@@ -399,6 +396,50 @@ def get_user_avatar_by_email(request):
         return response(PARAMS_ERROR, '字段不能为空', error=True)
 
 
+@allowed_methods(['GET'])
+@manager_login_required
+def get_latency_stats(request):
+    """
+    获取各接口的耗时统计
+    :param request: token
+    :return: [code, msg, data, error], 其中data为各接口的请求数、平均耗时、分位数和各后端的调用次数与耗时
+    """
+    return response(SUCCESS, '获取耗时统计成功', data=timing.get_latency_stats())
+
+
+@allowed_methods(['POST'])
+@manager_login_required
+def reset_latency_stats(request):
+    """
+    清空耗时统计
+    :param request: token
+    """
+    timing.reset_latency_stats()
+    return response(SUCCESS, '清空耗时统计成功')
+
+
+@allowed_methods(['GET'])
+@manager_login_required
+def get_cache_stats(request):
+    """
+    获取各缓存命名空间的命中统计
+    :param request: token
+    :return: [code, msg, data, error], 其中data为各命名空间的请求数、进程内命中、命中、旧值、缺失次数和命中率
+    """
+    return response(SUCCESS, '获取缓存统计成功', data=cache.get_cache_stats())
+
+
+@allowed_methods(['POST'])
+@manager_login_required
+def reset_cache_stats(request):
+    """
+    清空缓存统计
+    :param request: token
+    """
+    cache.reset_cache_stats()
+    return response(SUCCESS, '清空缓存统计成功')
+
+
 def send_message(user_email: str, message: str):
     """
     websocket 示例
@@ -2,12 +2,14 @@ from django.shortcuts import render
 
 # Create your views here.
 from django.http import JsonResponse
-from elasticsearch_dsl import connections, Search, Q
+from elasticsearch_dsl import Search, Q
 from NoBC.status_code import *
+from utils.entity import get_entity
 import json
 import threading
+from utils.es_client import get_client
 
-elasticsearch_connection = connections.get_connection()
+elasticsearch_connection = get_client()
 SOURCE_INDEX = 'source'
 # WORK_INDEX = 'work_optimized'
 WORK_INDEX = 'work'
@@ -16,16 +18,14 @@ WORK_INDEX = 'work'
 def get_source_by_id(request):
     if request.method == 'GET':
         source_id = request.GET.get('source_id')
-        query_body = {
-            "query": {
-                "match": {
-                    "id": source_id,
-                }
-            },
-            "_source": ["display_name", "cited_by_count", "counts_by_year", "works_count", "summary_stats", "x_concepts", "created_date"]
-        }
-        es_res = elasticsearch_connection.search(index=SOURCE_INDEX, body=query_body)
-        res = es_res['hits']['hits'][0]['_source']
+        res = get_entity(SOURCE_INDEX, source_id, ["display_name", "cited_by_count", "counts_by_year", "works_count",
+                                                   "summary_stats", "x_concepts", "created_date"])
+        if res is None:
+            return JsonResponse({
+                'code': PARAMS_ERROR,
+                'error': True,
+                'message': '期刊不存在',
+            })
 
         return JsonResponse({
             'code': SUCCESS,
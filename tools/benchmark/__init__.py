@@ -0,0 +1,9 @@
+"""
+离线接口基准测试, 不需要mysql/redis/es/七牛:
+- settings.py: 把外部服务换成sqlite、fakeredis、内存channel layer和回放es响应的ReplayTransport
+- replay.py: 按请求回放录制的es响应, 可配置延迟; --record模式连接真实es录制
+- fakes.py: 七牛和翻译接口的替身
+- run.py: 入口, 逐个调用接口并输出耗时、各后端调用次数和内存分配
+
+依赖fakeredis(只在基准测试中使用): pip install fakeredis
+"""
@@ -0,0 +1,84 @@
+"""
+七牛对象存储和百度翻译的替身, 只模拟延迟和返回格式
+"""
+import os
+import time
+
+# 每次调用的模拟延迟(毫秒)
+QOS_LATENCY = float(os.environ.get('BENCH_QOS_LATENCY', 0))
+TRANSLATE_LATENCY = float(os.environ.get('BENCH_TRANSLATE_LATENCY', 0))
+
+
+def sleep(ms: float):
+    if ms:
+        time.sleep(ms / 1000)
+
+
+class FakeAuth:
+    def __init__(self, access_key, secret_key):
+        pass
+
+    def upload_token(self, bucket, key=None, expires=3600):
+        return 'bench-token'
+
+    def private_download_url(self, url, expires=3600):
+        return url + '?e=bench'
+
+
+class FakeBucketManager:
+    # 所有实例共享, 模拟同一个bucket
+    files = set()
+
+    def __init__(self, auth):
+        pass
+
+    def stat(self, bucket, key):
+        sleep(QOS_LATENCY)
+        if key in self.files:
+            return {'key': key}, None
+        return None, None
+
+    def delete(self, bucket, key):
+        sleep(QOS_LATENCY)
+        if key in self.files:
+            self.files.discard(key)
+            return {}, None
+        return None, None
+
+
+def fake_put_file(token, key, local_file):
+    sleep(QOS_LATENCY)
+    FakeBucketManager.files.add(key)
+    return {'key': key, 'hash': fake_etag(local_file)}, None
+
+
+def fake_etag(local_file):
+    return 'bench-etag'
+
+
+class FakeTranslateResponse:
+    def __init__(self, query):
+        self.query = query
+
+    def json(self):
+        return {'trans_result': [{'src': line, 'dst': line} for line in self.query.split('\n')]}
+
+
+class FakeRequests:
+    @staticmethod
+    def post(url, params=None, headers=None, **kwargs):
+        sleep(TRANSLATE_LATENCY)
+        return FakeTranslateResponse(params['q'])
+
+
+def install():
+    """
+    替换模块里引用的客户端, 视图调用utils.qos和utils.translate时不会发出网络请求
+    """
+    from utils import qos, translate
+
+    qos.Auth = FakeAuth
+    qos.BucketManager = FakeBucketManager
+    qos.put_file = fake_put_file
+    qos.etag = fake_etag
+    translate.requests = FakeRequests
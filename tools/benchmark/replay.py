@@ -0,0 +1,126 @@
+import json
+import os
+import time
+
+from elasticsearch.exceptions import NotFoundError
+
+from utils.es_client import TimedTransport
+from utils.timing import timed
+
+# 录制的es响应, {请求key: 响应}
+FIXTURES_PATH = os.environ.get('BENCH_FIXTURES', os.path.join(os.path.dirname(__file__), 'fixtures.json'))
+# 回放时每次请求的模拟延迟(毫秒)
+LATENCY = float(os.environ.get('BENCH_ES_LATENCY', 0))
+# 为1时连接真实es并把响应录制下来
+RECORD = os.environ.get('BENCH_RECORD') == '1'
+
+# 单桶聚合, 结果里直接嵌套子聚合
+SINGLE_BUCKET_AGGS = {'sampler', 'diversified_sampler', 'filter', 'global', 'missing', 'nested', 'reverse_nested',
+                      'children', 'parent'}
+METRIC_AGGS = {'avg', 'sum', 'min', 'max', 'value_count', 'cardinality', 'median_absolute_deviation'}
+
+
+def empty_hits() -> dict:
+    return {'total': {'value': 0, 'relation': 'eq'}, 'max_score': None, 'hits': []}
+
+
+def empty_aggregations(aggs: dict) -> dict:
+    """
+    按请求中的aggs构造空的聚合结果, 没录到的请求也能走完读取聚合的代码
+    """
+    result = {}
+    for name, agg in aggs.items():
+        sub_aggs = agg.get('aggs') or agg.get('aggregations') or {}
+        kind = next((key for key in agg if key not in ('aggs', 'aggregations', 'meta')), None)
+        if kind in SINGLE_BUCKET_AGGS:
+            result[name] = {'doc_count': 0, **empty_aggregations(sub_aggs)}
+        elif kind in METRIC_AGGS:
+            result[name] = {'value': None}
+        elif kind == 'top_hits':
+            result[name] = {'hits': empty_hits()}
+        elif kind in ('stats', 'extended_stats'):
+            result[name] = {'count': 0, 'min': None, 'max': None, 'avg': None, 'sum': 0}
+        else:
+            # terms/date_histogram/histogram/range等多桶聚合
+            result[name] = {'buckets': []}
+    return result
+
+
+def empty_search(body) -> dict:
+    response = {'took': 0, 'timed_out': False, 'hits': empty_hits()}
+    aggs = (body or {}).get('aggs') or (body or {}).get('aggregations')
+    if aggs:
+        response['aggregations'] = empty_aggregations(aggs)
+    return response
+
+
+def canonical_body(body) -> str:
+    if body is None:
+        return ''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    if isinstance(body, str):
+        # msearch/bulk的ndjson逐行规范化
+        try:
+            return '\n'.join(json.dumps(json.loads(line), sort_keys=True) for line in body.splitlines() if line)
+        except ValueError:
+            return body
+    return json.dumps(body, sort_keys=True)
+
+
+def request_key(method: str, url: str, params, body) -> str:
+    return '{} {} {} {}'.format(method, url, json.dumps(params or {}, sort_keys=True), canonical_body(body))
+
+
+def load_fixtures(path=FIXTURES_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_fixtures(fixtures: dict, path=FIXTURES_PATH):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(fixtures, file, ensure_ascii=False, indent=1, sort_keys=True)
+
+
+class ReplayTransport(TimedTransport):
+    """
+    回放录制的es响应, 不发出任何网络请求; 没录到的请求返回空结果并计入misses
+    """
+    fixtures = load_fixtures()
+    misses = []
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        key = request_key(method, url, params, body)
+        if RECORD:
+            response = super().perform_request(method, url, headers=headers, params=params, body=body)
+            self.fixtures[key] = response
+            return response
+        return self.replay(key, method, url, body)
+
+    def replay(self, key, method, url, body):
+        # 和TimedTransport一样计入es耗时, Server-Timing里的es调用次数与线上一致
+        with timed('es'):
+            if LATENCY:
+                time.sleep(LATENCY / 1000)
+            if key in self.fixtures:
+                return self.fixtures[key]
+            self.misses.append(key)
+            return self.default_response(method, url, body)
+
+    @staticmethod
+    def default_response(method, url, body):
+        path = url.split('?')[0]
+        if '/_doc/' in path and method == 'GET':
+            raise NotFoundError(404, 'not recorded', {'found': False})
+        if path.endswith('/_msearch'):
+            return {'responses': [empty_search(json.loads(line)) for line in canonical_body(body).splitlines()[1::2]]}
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        body = json.loads(body) if isinstance(body, str) and body else body
+        if path.endswith('/_mget'):
+            return {'docs': [{'_id': doc_id, 'found': False} for doc_id in body.get('ids', [])]}
+        if path.endswith('/_count'):
+            return {'count': 0}
+        return empty_search(body)
@@ -0,0 +1,202 @@
+"""
+离线接口基准测试: 用django测试客户端调用真实视图, 外部服务全部换成本地替身
+
+    python -m tools.benchmark.run                      # 回放tools/benchmark/fixtures.json
+    python -m tools.benchmark.run --latency 5 --repeat 20
+    python -m tools.benchmark.run --record             # 连接config中的es, 录制响应
+    python -m tools.benchmark.run --only work author   # 只跑部分场景
+
+每个接口输出: 墙钟耗时(首次/平均), 各后端调用次数与耗时(来自Server-Timing), 峰值内存分配, 回放未命中数
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+# 参数影响replay/fakes模块级配置, 要在django.setup之前放进环境变量
+parser = argparse.ArgumentParser(description='NoBC offline endpoint benchmark')
+parser.add_argument('--fixtures', help='录制文件路径, 默认tools/benchmark/fixtures.json')
+parser.add_argument('--latency', type=float, default=0, help='回放es响应的模拟延迟(毫秒)')
+parser.add_argument('--qos-latency', type=float, default=0, help='七牛替身的模拟延迟(毫秒)')
+parser.add_argument('--repeat', type=int, default=5, help='每个接口的调用次数')
+parser.add_argument('--cold', action='store_true', help='每次调用前清空缓存')
+parser.add_argument('--record', action='store_true', help='连接真实es并录制响应')
+parser.add_argument('--only', nargs='*', help='只跑这些场景')
+
+# 测试数据: 录制和回放要用同一组id
+WORK_ID = os.environ.get('BENCH_WORK_ID', 'W2741809807')
+AUTHOR_ID = os.environ.get('BENCH_AUTHOR_ID', 'https://openalex.org/A5023888391')
+AUTHOR_NAME = os.environ.get('BENCH_AUTHOR_NAME', 'Heather Piwowar')
+SOURCE_ID = os.environ.get('BENCH_SOURCE_ID', 'https://openalex.org/S137773608')
+CONCEPT_ID = os.environ.get('BENCH_CONCEPT_ID', 'https://openalex.org/C41008148')
+INSTITUTION_ID = os.environ.get('BENCH_INSTITUTION_ID', 'https://openalex.org/I136199984')
+USER_EMAIL = 'bench@nobc.local'
+HISTORY_SIZE = 20
+
+def search_facets_params(content: str) -> dict:
+    # 分面接口凭搜索返回的token取数据, 每次请求前登记一次, --cold清空缓存后也能取到
+    from work.es import normalize_params, register_query
+    return {'token': register_query('search', normalize_params({'content': content}))}
+
+
+# {场景: [(url, 参数或生成参数的函数, 是否需要登录)]}
+SCENARIOS = {
+    'work': [
+        ('/work/search/', {'content': 'deep learning'}, False),
+        ('/work/search/', {'content': 'deep learning', 'page_number': 2}, False),
+        ('/work/get_search_facets/', lambda: search_facets_params('deep learning'), False),
+        ('/work/get_work/', {'id': WORK_ID, 'user_id': USER_EMAIL}, False),
+    ],
+    'author': [
+        ('/author/get_author_by_name/', {'author_name': AUTHOR_NAME}, False),
+        ('/author/get_author_by_id/', {'author_id': AUTHOR_ID}, False),
+        ('/author/get_co_author_list/', {'author_id': AUTHOR_ID}, False),
+        ('/author/get_works/', {'author_id': AUTHOR_ID}, False),
+        ('/author/get_counts_by_year/', {'author_id': AUTHOR_ID}, False),
+    ],
+    'user': [
+        ('/user/get_histories/', {}, True),
+        ('/user/get_favorites/', {}, True),
+    ],
+    'source': [
+        ('/source/get_source_by_id/', {'source_id': SOURCE_ID}, False),
+        ('/source/get_works_by_cited/', {'source_id': SOURCE_ID}, False),
+        ('/source/get_authors_by_cited/', {'source_id': SOURCE_ID}, False),
+        ('/source/get_institutions_by_cited/', {'source_id': SOURCE_ID}, False),
+        ('/source/get_authors_distribution/', {'source_id': SOURCE_ID}, False),
+    ],
+    'concept': [
+        ('/concept/get_concept_by_id/', {'id': CONCEPT_ID}, False),
+        ('/concept/get_ancestors_by_id/', {'id': CONCEPT_ID}, False),
+    ],
+    'institution': [
+        ('/institution/getInstitutionDetail/', {'id': INSTITUTION_ID}, False),
+    ],
+}
+
+
+def setup(args):
+    if args.fixtures:
+        os.environ['BENCH_FIXTURES'] = args.fixtures
+    os.environ['BENCH_ES_LATENCY'] = str(args.latency)
+    os.environ['BENCH_QOS_LATENCY'] = str(args.qos_latency)
+    if args.record:
+        os.environ['BENCH_RECORD'] = '1'
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'tools.benchmark.settings'
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+    from tools.benchmark import fakes
+    fakes.install()
+
+
+def seed():
+    """
+    sqlite里造一个已激活用户和若干浏览记录、收藏
+    :return: 用户的token
+    """
+    from user.models import Favorite, History, User
+    from utils.Token import generate_token
+    from work.models import Work
+
+    user = User.objects.create(name='bench', email=USER_EMAIL, password='', is_active=True)
+    for i in range(HISTORY_SIZE):
+        work, _ = Work.objects.get_or_create(id=WORK_ID if i == 0 else '{}{}'.format(WORK_ID, i))
+        History.objects.create(user=user, work=work)
+        Favorite.objects.create(user=user, work=work)
+    return generate_token({'email': USER_EMAIL, 'name': user.name}, 60 * 60 * 24)
+
+
+def parse_server_timing(header: str) -> dict:
+    """
+    :return: {后端: (调用次数, 毫秒)}, total只有毫秒
+    """
+    timings = {}
+    for metric in filter(None, (item.strip() for item in header.split(','))):
+        parts = metric.split(';')
+        name, fields = parts[0], dict(part.split('=', 1) for part in parts[1:])
+        calls = int(fields['desc'].strip('"').split()[0]) if 'desc' in fields else None
+        timings[name] = (calls, float(fields.get('dur', 0)))
+    return timings
+
+
+def run_endpoint(client, url, params, headers, args):
+    from django.core.cache import cache
+    from tools.benchmark.replay import ReplayTransport
+
+    misses_before = len(ReplayTransport.misses)
+    walls, peaks, timings, error = [], [], {}, None
+    for _ in range(args.repeat):
+        if args.cold:
+            cache.clear()
+        request_params = params() if callable(params) else params
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            response = client.get(url, request_params, **headers)
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+            tracemalloc.stop()
+            break
+        walls.append((time.perf_counter() - start) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+        # 只记第一次的后端调用, 之后的调用可能命中缓存
+        if not timings:
+            timings = parse_server_timing(response.get('Server-Timing', ''))
+            if response.status_code != 200:
+                error = 'HTTP {}'.format(response.status_code)
+    return {
+        'walls': walls,
+        'peak_kb': max(peaks) if peaks else 0,
+        'timings': timings,
+        'misses': len(ReplayTransport.misses) - misses_before,
+        'error': error,
+    }
+
+
+def format_backends(timings: dict) -> str:
+    return ' '.join('{}={}/{:.1f}ms'.format(name, calls, ms)
+                    for name, (calls, ms) in timings.items() if name != 'total')
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    setup(args)
+
+    from django.test import Client
+    from tools.benchmark.replay import ReplayTransport, save_fixtures
+
+    token = seed()
+    client = Client()
+    names = args.only or list(SCENARIOS)
+    print('{:<42} {:>9} {:>9} {:>9}  {:<5} {}'.format('endpoint', 'first ms', 'avg ms', 'peak KB', 'miss',
+                                                      'backends(calls/ms, first call)'))
+    for name in names:
+        for url, params, need_login in SCENARIOS[name]:
+            headers = {'HTTP_TOKEN': token} if need_login else {}
+            result = run_endpoint(client, url, params, headers, args)
+            if result['error'] and not result['walls']:
+                print('{:<42} {}'.format(url, result['error']))
+                continue
+            walls = result['walls']
+            print('{:<42} {:>9.1f} {:>9.1f} {:>9.0f}  {:<5} {}{}'.format(
+                url, walls[0], statistics.mean(walls), result['peak_kb'], result['misses'],
+                format_backends(result['timings']), '  ' + result['error'] if result['error'] else ''))
+
+    if args.record:
+        save_fixtures(ReplayTransport.fixtures)
+        print('recorded {} responses'.format(len(ReplayTransport.fixtures)))
+    elif ReplayTransport.misses:
+        print('{} es requests were not recorded, run with --record to refresh fixtures'.format(
+            len(set(ReplayTransport.misses))))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+基准测试用的settings: 在NoBC.settings的基础上把所有外部服务换成本地替身
+- mysql -> sqlite内存库
+- redis -> fakeredis (django-redis的缓存和get_redis_connection都走这里)
+- elasticsearch -> ReplayTransport, 回放录制的响应
+- channels -> 内存channel layer, celery -> 同步执行
+"""
+import sys
+import types
+
+try:
+    import config
+except ModuleNotFoundError:
+    # 没有部署配置时用假的, 基准测试不会连接这些地址
+    config = types.ModuleType('config')
+    config.__dict__.update({
+        'ELAS_HOST': 'localhost', 'ELAS_USER': 'elastic', 'ELAS_PASSWORD': '',
+        'REDIS_HOST': 'localhost',
+        'MYSQL_HOST': 'localhost', 'MYSQL_USER': 'root', 'MYSQL_PASSWORD': '',
+        'RABBITMQ_HOST': 'localhost', 'RABBITMQ_USER': 'guest', 'RABBITMQ_PASSWORD': 'guest',
+        'BUAA_HOST': 'localhost', 'BUAA_MAIL_USER': 'bench@localhost', 'BUAA_MAIL_TOKEN': '',
+        'ACCESS_KEY': 'bench', 'SECRET_KEY': 'bench', 'BUCKET_NAME': 'bench', 'BASE_URL': 'http://qos.bench/',
+        'OPENAI_API_KEY': '',
+    })
+    sys.modules['config'] = config
+
+import fakeredis
+from elasticsearch_dsl import connections
+
+from NoBC.settings import *
+from tools.benchmark.replay import ReplayTransport
+from utils import es_client
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    }
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://localhost:6379/0",
+        "KEY_PREFIX": "nobc",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "COMPRESSOR": CACHES["default"]["OPTIONS"]["COMPRESSOR"],
+            # 所有连接共享同一个fakeredis实例
+            "CONNECTION_POOL_KWARGS": {
+                "connection_class": fakeredis.FakeConnection,
+                "server": fakeredis.FakeServer(),
+            },
+        }
+    }
+}
+
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    },
+}
+
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+CELERY_TASK_ALWAYS_EAGER = True
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+PAPER_QA_EMBEDDINGS = 'hash'
+
+connections.configure(**{
+    alias: dict(es_client.connection_options(timeout), transport_class=ReplayTransport)
+    for alias, timeout in es_client.TIMEOUTS.items()
+})
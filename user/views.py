@@ -4,10 +4,11 @@ import re
 from datetime import datetime
 
 from django.core.mail import send_mail
-from elasticsearch_dsl import connections, Search
+from elasticsearch_dsl import Search
 
 from NoBC.status_code import *
 from author.models import Author
+from concept.feed import invalidate_feed
 from concept.models import Concept
 from config import BUAA_MAIL_USER, ELAS_HOST, ELAS_USER, ELAS_PASSWORD
 from message.models import Certification, Complaint, Message
@@ -20,8 +21,9 @@ from utils.view_decorator import login_required, allowed_methods
 from work.models import Work
 from work.views import get_citation
 from .models import User, History, Favorite
+from utils.es_client import get_client
 
-ES_CONN = connections.get_connection()
+ES_CONN = get_client()
 
 
 def init_user_avatar(user: User) -> str:
@@ -439,6 +441,7 @@ def add_focus_concept(request):
     if user.concept_focus.filter(id=concept_id).exists():
         return response(PARAMS_ERROR, '已关注该领域！', error=True)
     user.concept_focus.add(concept)
+    invalidate_feed(user)
     return response(SUCCESS, '关注领域成功！')
 
 
@@ -458,6 +461,7 @@ def remove_focus_concept(request):
     try:
         concept = user.concept_focus.get(id=concept_id)
         user.concept_focus.remove(concept)
+        invalidate_feed(user)
         return response(SUCCESS, '取消关注领域成功！')
     except Concept.DoesNotExist:
         return response(MYSQL_ERROR, '未关注该领域！', error=True)
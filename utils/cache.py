@@ -0,0 +1,282 @@
+"""
+两级缓存(进程内LRU + redis), 防击穿: 同一个键只有一个请求在计算(single-flight), 软过期后先返回旧值再由后台刷新(stale-while-revalidate)
+
+    value, cached = get_or_compute('work_detail', fetch_work, [work_id], soft_timeout=60 * 60)
+
+- 键由命名空间和参数的哈希组成: <namespace>:<sha1(args)>, 不再把id或整个查询直接当作键
+- 缓存项为{'value', 'fresh_until'}, 在fresh_until(软过期)之前直接返回, redis过期时间为硬过期
+- 软过期后返回旧值, 同时提交celery任务refresh_cached在后台重算, 一个租期内同一个键只提交一次
+- 完全没有缓存时抢redis锁, 抢到的计算并写入, 其他请求等它写入后直接读取, 等待超时才自己计算
+- local_timeout > 0 时缓存项在进程内再保留local_timeout秒(不超过软过期), 只用于小而热的命名空间;
+  进程内命中时所有请求拿到的是同一个对象, 这些命名空间的值只读, 需要修改时调用方先复制(copy.deepcopy)
+- 后台刷新在worker中按路径导入计算函数, 所以func必须是模块级函数, args必须能被json序列化
+- redis中的值由django-redis压缩(见settings.CACHES的COMPRESSOR)
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from importlib import import_module
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+# 锁的租期, 计算进程异常退出时锁自动释放
+LOCK_LEASE = getattr(settings, 'CACHE_LOCK_LEASE', 30)
+# 没抢到锁的请求最多等待别人算完的时间
+LOCK_WAIT = getattr(settings, 'CACHE_LOCK_WAIT', 10)
+POLL_INTERVAL = 0.05
+# 软过期之后还可以返回旧值的时间, 即默认的硬过期 = 软过期 + STALE_TIMEOUT
+STALE_TIMEOUT = getattr(settings, 'CACHE_STALE_TIMEOUT', 60 * 60)
+# 进程内LRU最多保留的缓存项数
+LOCAL_SIZE = getattr(settings, 'CACHE_LOCAL_SIZE', 512)
+# 各命名空间的命中统计, 先在进程内累计, 每隔一段时间写入redis, 所有worker共享
+STATS_KEY = 'nobc:cache_stats'
+STATS_FLUSH_INTERVAL = 10
+EVENTS = ['local_hit', 'hit', 'stale', 'miss']
+
+
+class LocalCache:
+    """
+    进程内LRU, 每项有自己的过期时间
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expire_at, entry = item
+            if expire_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, timeout):
+        with self.lock:
+            self.entries[key] = (time.time() + timeout, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+local_cache = LocalCache(LOCAL_SIZE)
+_stats = Counter()
+_stats_lock = threading.Lock()
+_stats_flushed_at = time.time()
+
+
+def record(namespace: str, event: str):
+    global _stats_flushed_at
+    with _stats_lock:
+        _stats[namespace + ':' + event] += 1
+        if time.time() - _stats_flushed_at < STATS_FLUSH_INTERVAL:
+            return
+        counts = dict(_stats)
+        _stats.clear()
+        _stats_flushed_at = time.time()
+    try:
+        pipeline = get_redis_connection("default").pipeline(transaction=False)
+        for field, count in counts.items():
+            pipeline.hincrby(STATS_KEY, field, count)
+        pipeline.execute()
+    except Exception as e:
+        print('flush cache stats failed: {}'.format(e))
+
+
+def get_cache_stats() -> list:
+    """
+    :return: [{namespace, requests, local_hit, hit, stale, miss, hit_rate}], 按请求数降序, 最近STATS_FLUSH_INTERVAL秒的还没有写入
+    """
+    counts = {}
+    for field, value in get_redis_connection("default").hgetall(STATS_KEY).items():
+        namespace, event = field.decode('utf-8').rsplit(':', 1)
+        counts.setdefault(namespace, {})[event] = int(value)
+    stats = []
+    for namespace, events in counts.items():
+        item = {event: events.get(event, 0) for event in EVENTS}
+        requests = sum(item.values())
+        stats.append({
+            'namespace': namespace,
+            'requests': requests,
+            **item,
+            # 返回旧值也算命中
+            'hit_rate': round((requests - item['miss']) / requests, 4) if requests else 0,
+        })
+    stats.sort(key=lambda item: item['requests'], reverse=True)
+    return stats
+
+
+def reset_cache_stats():
+    get_redis_connection("default").delete(STATS_KEY)
+
+
+def make_key(namespace: str, args) -> str:
+    """
+    <namespace>:<参数的sha1>, 参数相同(dict不论顺序)时键相同
+    """
+    data = json.dumps(list(args), sort_keys=True, separators=(',', ':'))
+    return '{}:{}'.format(namespace, hashlib.sha1(data.encode('utf-8')).hexdigest())
+
+
+def func_path(func) -> str:
+    return '{}.{}'.format(func.__module__, func.__qualname__)
+
+
+def load_func(path: str):
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+
+def get_lock(key: str):
+    # django-redis不会给原生连接上的键加前缀, 这里手动加上, 避免与其他项目冲突
+    return get_redis_connection("default").lock('lock:' + cache.make_key(key), timeout=LOCK_LEASE)
+
+
+def release(lock):
+    try:
+        lock.release()
+    except LockError:
+        # 计算超过租期, 锁已经过期或被别人拿走
+        pass
+
+
+def store(key: str, value, soft_timeout, hard_timeout=None):
+    """
+    :param soft_timeout: 秒数, 或根据value返回秒数的函数(例如超时的不完整结果只短暂缓存)
+    :param hard_timeout: 为空时为soft_timeout + STALE_TIMEOUT
+    :return: 缓存项
+    """
+    if callable(soft_timeout):
+        soft_timeout = soft_timeout(value)
+    if hard_timeout is None or hard_timeout < soft_timeout:
+        hard_timeout = soft_timeout + STALE_TIMEOUT
+    entry = {'value': value, 'fresh_until': time.time() + soft_timeout}
+    cache.set(key, entry, hard_timeout)
+    # 本进程的旧值作废, 其他进程的最多再用local_timeout秒
+    local_cache.delete(key)
+    return entry
+
+
+def refresh(namespace: str, func, args=(), soft_timeout=60 * 60, hard_timeout=None):
+    """
+    立即重算并写入缓存, 供定时任务预热; 别人正在计算时跳过
+    :return: 是否重算
+    """
+    key = make_key(namespace, args)
+    lock = get_lock(key)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        store(key, func(*args), soft_timeout, hard_timeout)
+    finally:
+        release(lock)
+    return True
+
+
+def compute(key: str, func, args, soft_timeout, hard_timeout):
+    """
+    缓存缺失时的single-flight计算
+    :return: 缓存项
+    """
+    lock = get_lock(key)
+    if lock.acquire(blocking=False):
+        try:
+            return store(key, func(*args), soft_timeout, hard_timeout)
+        finally:
+            release(lock)
+    deadline = time.time() + LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    # 等不到就自己算, 不再写入, 持锁的请求会写
+    return {'value': func(*args), 'fresh_until': 0}
+
+
+def schedule_refresh(namespace: str, key: str, func, args, soft_timeout, hard_timeout):
+    # 一个租期内同一个键只提交一次后台刷新
+    if not cache.add('refreshing_' + key, 1, LOCK_LEASE):
+        return
+    if callable(soft_timeout):
+        soft_timeout = func_path(soft_timeout)
+    try:
+        refresh_cached.delay(namespace, func_path(func), list(args), soft_timeout, hard_timeout)
+    except Exception as e:
+        # 提交失败时继续返回旧值, 硬过期后由请求同步计算
+        print('schedule refresh {} failed: {}'.format(key, e))
+
+
+def get_or_compute(namespace: str, func, args=(), soft_timeout=60 * 60, hard_timeout=None, local_timeout=0):
+    """
+    :param namespace: 命名空间, 同时是统计的维度
+    :param func: 模块级计算函数
+    :param args: func的参数, 需要能被json序列化, 和命名空间一起决定缓存键
+    :param soft_timeout: 秒数或根据结果返回秒数的模块级函数, 之后返回旧值并后台刷新
+    :param hard_timeout: 旧值最多保留的时间, 为空时为soft_timeout + STALE_TIMEOUT
+    :param local_timeout: 进程内缓存的秒数, 0为不使用; 大于0时返回的value被本进程的请求共用, 不能修改
+    :return: (value, 是否命中缓存)
+    """
+    key = make_key(namespace, args)
+    if local_timeout:
+        entry = local_cache.get(key)
+        if entry is not None:
+            record(namespace, 'local_hit')
+            return entry['value'], True
+    entry = cache.get(key)
+    if entry is None:
+        record(namespace, 'miss')
+        entry = compute(key, func, args, soft_timeout, hard_timeout)
+        cached = False
+    else:
+        cached = True
+        if entry['fresh_until'] <= time.time():
+            record(namespace, 'stale')
+            schedule_refresh(namespace, key, func, args, soft_timeout, hard_timeout)
+        else:
+            record(namespace, 'hit')
+    # 旧值不放进进程内缓存, 下次还会去redis看有没有刷新好
+    remaining = entry['fresh_until'] - time.time()
+    if local_timeout and remaining > 0:
+        local_cache.set(key, entry, min(local_timeout, remaining))
+    return entry['value'], cached
+
+
+def exists(namespace: str, args) -> bool:
+    key = make_key(namespace, args)
+    return local_cache.get(key) is not None or cache.has_key(key)
+
+
+def soft_ttl(namespace: str, args) -> float:
+    """
+    :return: 距离软过期的秒数, 不存在或已经软过期时为0
+    """
+    entry = cache.get(make_key(namespace, args))
+    if entry is None:
+        return 0
+    return max(entry['fresh_until'] - time.time(), 0)
+
+
+@shared_task(time_limit=60 * 2)
+def refresh_cached(namespace, path, args, soft_timeout, hard_timeout):
+    if isinstance(soft_timeout, str):
+        soft_timeout = load_func(soft_timeout)
+    try:
+        refresh(namespace, load_func(path), args, soft_timeout, hard_timeout)
+    finally:
+        cache.delete('refreshing_' + make_key(namespace, args))
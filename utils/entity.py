@@ -0,0 +1,120 @@
+from django.core.cache import cache
+from elasticsearch.exceptions import NotFoundError
+from utils.es_client import get_client
+
+OPENALEX_PREFIX = 'https://openalex.org/'
+
+# 各索引的_id格式: work导入时去掉了前缀, 其余索引保留完整url
+# author索引需要先用 Import/AuthorReindex.py 把_id对齐到id字段
+FULL_URL_ID_INDEXES = {'author', 'concept', 'institution', 'source'}
+BARE_ID_INDEXES = {'work'}
+# 实体名称基本不变, 缓存一天
+NAME_TIMEOUT = 60 * 60 * 24
+
+
+def bare_id(entity_id: str) -> str:
+    """
+    https://openalex.org/W123 -> W123
+    """
+    return entity_id.rstrip('/').split('/')[-1] if entity_id else entity_id
+
+
+def full_id(entity_id: str) -> str:
+    """
+    W123 -> https://openalex.org/W123
+    """
+    return OPENALEX_PREFIX + bare_id(entity_id) if entity_id else entity_id
+
+
+def doc_id(index: str, entity_id: str) -> str:
+    """
+    把任意格式的id转成该索引的_id
+    """
+    if index in BARE_ID_INDEXES:
+        return bare_id(entity_id)
+    return full_id(entity_id)
+
+
+def get_entity_with_version(index: str, entity_id: str, source=None):
+    """
+    按_id实时获取单个文档, 不经过查询阶段
+    :param index: 索引名
+    :param entity_id: 带前缀或不带前缀的id
+    :param source: 需要的字段列表, 为空时返回全部
+    :return: (_source, version), version用于update_entity的乐观并发控制; 不存在时返回(None, None)
+    """
+    if not entity_id:
+        return None, None
+    try:
+        res = get_client().get(index=index, id=doc_id(index, entity_id), _source_includes=source)
+    except NotFoundError:
+        return None, None
+    return res['_source'], '{}:{}'.format(res['_seq_no'], res['_primary_term'])
+
+
+def get_entity(index: str, entity_id: str, source=None):
+    """
+    按_id实时获取单个文档
+    :return: _source, 不存在时返回None
+    """
+    return get_entity_with_version(index, entity_id, source)[0]
+
+
+def update_entity(index: str, entity_id: str, doc: dict, version=None):
+    """
+    按_id局部更新单个文档
+    :param doc: 需要修改的字段, 对象字段会和原文档合并
+    :param version: get_entity_with_version返回的版本, 文档在此之后被修改过时抛出ConflictError; 为空时不检查
+    :return: 更新后的版本
+    """
+    params = {}
+    if version:
+        seq_no, primary_term = version.split(':')
+        params = {'if_seq_no': int(seq_no), 'if_primary_term': int(primary_term)}
+    res = get_client().update(index=index, id=doc_id(index, entity_id), body={'doc': doc}, **params)
+    return '{}:{}'.format(res['_seq_no'], res['_primary_term'])
+
+
+def mget_entities(index: str, entity_ids: list, source=None) -> list:
+    """
+    按_id批量获取文档
+    :return: 与entity_ids一一对应的_source列表, 不存在的为None
+    """
+    ids = [doc_id(index, entity_id) for entity_id in entity_ids if entity_id]
+    if not ids:
+        return [None] * len(entity_ids)
+    res = get_client().mget(index=index, body={'ids': ids}, _source_includes=source)
+    docs = iter([doc['_source'] if doc.get('found') else None for doc in res['docs']])
+    return [next(docs) if entity_id else None for entity_id in entity_ids]
+
+
+def get_name_key(index: str, entity_id: str) -> str:
+    return 'entity_name_{}_{}'.format(index, bare_id(entity_id))
+
+
+def get_display_names(ids_by_index: dict) -> dict:
+    """
+    批量获取实体名称: 一次缓存查询, 未命中的每个索引一次mget
+    :param ids_by_index: {索引名: [id]}, id带不带前缀都可以
+    :return: {索引名: {id: display_name}}, 不存在的实体名称为None
+    """
+    keys = {(index, entity_id): get_name_key(index, entity_id)
+            for index, entity_ids in ids_by_index.items() for entity_id in entity_ids if entity_id}
+    cached = cache.get_many(list(keys.values()))
+    names = {index: {} for index in ids_by_index}
+    missing = {}
+    for (index, entity_id), key in keys.items():
+        if key in cached:
+            names[index][entity_id] = cached[key] or None
+        else:
+            missing.setdefault(index, []).append(entity_id)
+    to_cache = {}
+    for index, entity_ids in missing.items():
+        for entity_id, source in zip(entity_ids, mget_entities(index, entity_ids, ['display_name'])):
+            name = source.get('display_name') if source else None
+            names[index][entity_id] = name
+            # 不存在的实体缓存为空串(缓存不区分None和未命中), 避免反复查询
+            to_cache[keys[(index, entity_id)]] = name or ''
+    if to_cache:
+        cache.set_many(to_cache, NAME_TIMEOUT)
+    return names
@@ -0,0 +1,61 @@
+from elasticsearch import Transport
+from elasticsearch_dsl import connections
+
+from config import ELAS_HOST, ELAS_USER, ELAS_PASSWORD
+from utils.timing import timed
+
+# 命名连接: 接口请求用default, 超时短, 出问题尽快失败; 定时任务和脚本用batch, 超时长
+INTERACTIVE = 'default'
+BATCH = 'batch'
+TIMEOUTS = {
+    INTERACTIVE: 20,
+    BATCH: 120,
+}
+# 每个节点的连接池大小, 要不小于单进程内的并发请求数(线程数)
+POOL_MAXSIZE = 25
+MAX_RETRIES = 2
+
+
+class TimedTransport(Transport):
+    """
+    每次请求(包括重试)计入当前请求的es耗时
+    """
+
+    def perform_request(self, *args, **kwargs):
+        with timed('es'):
+            return super().perform_request(*args, **kwargs)
+
+
+def connection_options(timeout: int) -> dict:
+    return {
+        'host': ELAS_HOST,
+        'http_auth': (ELAS_USER, ELAS_PASSWORD),
+        'scheme': 'http',
+        'verify_certs': False,
+        'timeout': timeout,
+        # 连接池复用长连接
+        'maxsize': POOL_MAXSIZE,
+        'http_compress': True,
+        'retry_on_timeout': True,
+        'max_retries': MAX_RETRIES,
+        # 单节点部署, 不需要嗅探集群节点
+        'sniff_on_start': False,
+        'sniff_on_connection_fail': False,
+        'sniffer_timeout': None,
+        'transport_class': TimedTransport,
+    }
+
+
+def configure():
+    """
+    配置所有命名连接, 在settings中调用; 独立运行的脚本需要先调用一次
+    """
+    connections.configure(**{alias: connection_options(timeout) for alias, timeout in TIMEOUTS.items()})
+
+
+def get_client(alias=INTERACTIVE):
+    """
+    获取es客户端, 各模块都从这里取, 不要自己创建连接
+    :param alias: INTERACTIVE / BATCH
+    """
+    return connections.get_connection(alias)
@@ -1,14 +1,10 @@
 # -*- coding:utf-8 -*-
 
-from elasticsearch import Elasticsearch
+from utils import es_client
 
-from elasticsearch_dsl.connections import connections
 
-from config import ELAS_HOST
-
-
-connections.create_connection(hosts=[ELAS_HOST], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
-client = Elasticsearch(hosts=[ELAS_HOST], timeout=60, http_auth=('elastic', 'buaaNOBC2121'))
+es_client.configure()
+client = es_client.get_client(es_client.BATCH)
 
 def update():
     #先查找concept索引中指定的id，然后更新chinese_display_name为我要的值
@@ -1,7 +1,7 @@
-from elasticsearch_dsl.connections import connections
-from config import *
+from utils import es_client
 
-es = connections.create_connection(hosts=[ELAS_HOST], timeout=60, http_auth=(ELAS_USER, ELAS_PASSWORD))
+es_client.configure()
+es = es_client.get_client(es_client.BATCH)
 
 # 从es中获取h-index>20的学者列表
 query_body = {
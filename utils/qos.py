@@ -1,7 +1,9 @@
 from qiniu import Auth, put_file, etag, BucketManager
 from config import ACCESS_KEY, SECRET_KEY, BUCKET_NAME, BASE_URL
+from utils.timing import timed_function
 
 
+@timed_function('qos')
 def upload_file(key: str, file_path) -> bool:
     """
     上传文件
@@ -33,6 +35,7 @@ def upload_file(key: str, file_path) -> bool:
     return False
 
 
+@timed_function('qos')
 def get_file(key: str) -> str:
     """
     获取文件
@@ -50,6 +53,7 @@ def get_file(key: str) -> str:
     return q.private_download_url(url, expires=3600)
 
 
+@timed_function('qos')
 def delete_file(key: str) -> bool:
     """
     删除文件
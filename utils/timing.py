@@ -0,0 +1,208 @@
+import contextvars
+import functools
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django_redis import get_redis_connection
+
+# 当前请求的各后端耗时 {后端: [调用次数, 秒]}, 不在请求中时为None
+_timings = contextvars.ContextVar('timings', default=None)
+
+# 按接口聚合的耗时直方图, 存在redis里, 所有worker共享; 最近STATS_FLUSH_INTERVAL秒的还没有写入
+LATENCY_KEY = 'nobc:latency:{}'
+ENDPOINTS_KEY = 'nobc:latency:endpoints'
+# 直方图的桶上界(毫秒), 最后一个桶收所有更慢的请求
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+BACKENDS = ['es', 'redis', 'db', 'qos', 'translate']
+# 先在进程内累计, 每隔一段时间写入redis, 不在每个请求里访问redis
+STATS_FLUSH_INTERVAL = 10
+
+_pending = {}
+_pending_lock = threading.Lock()
+_pending_flushed_at = time.time()
+
+
+def record(backend: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timing = timings.setdefault(backend, [0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+
+
+@contextmanager
+def timed(backend: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(backend, time.perf_counter() - start)
+
+
+def timed_function(backend: str):
+    """
+    装饰器, 把函数调用计入指定后端
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(backend):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+_redis_installed = False
+
+
+def install_redis_hooks():
+    """
+    redis没有请求级别的扩展点, 直接包装命令执行; cache和get_redis_connection都会经过这里
+    """
+    global _redis_installed
+    if _redis_installed:
+        return
+    from redis.client import Pipeline, Redis
+
+    Redis.execute_command = timed_function('redis')(Redis.execute_command)
+    Pipeline.execute = timed_function('redis')(Pipeline.execute)
+    _redis_installed = True
+
+
+def bucket_of(ms: float) -> str:
+    for bound in BUCKETS:
+        if ms <= bound:
+            return str(bound)
+    return 'inf'
+
+
+def save_request(endpoint: str, total: float, timings: dict):
+    """
+    先在进程内累加到接口的直方图, 每隔STATS_FLUSH_INTERVAL秒用一个pipeline写入redis
+    """
+    global _pending_flushed_at
+    ms = total * 1000
+    with _pending_lock:
+        pending = _pending.setdefault(endpoint, Counter())
+        pending['count'] += 1
+        pending['total_ms'] += ms
+        pending['bucket:' + bucket_of(ms)] += 1
+        for backend, (calls, seconds) in timings.items():
+            pending[backend + ':calls'] += calls
+            pending[backend + ':ms'] += seconds * 1000
+        if time.time() - _pending_flushed_at < STATS_FLUSH_INTERVAL:
+            return
+        counts = dict(_pending)
+        _pending.clear()
+        _pending_flushed_at = time.time()
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    pipeline.sadd(ENDPOINTS_KEY, *counts)
+    for endpoint, fields in counts.items():
+        key = LATENCY_KEY.format(endpoint)
+        for field, value in fields.items():
+            if isinstance(value, float):
+                pipeline.hincrbyfloat(key, field, value)
+            else:
+                pipeline.hincrby(key, field, value)
+    pipeline.execute()
+
+
+def percentile(buckets: dict, count: int, q: float):
+    """
+    按桶估算分位数, 返回所在桶的上界
+    """
+    seen = 0
+    for bound in [str(bound) for bound in BUCKETS] + ['inf']:
+        seen += buckets.get(bound, 0)
+        if seen >= count * q:
+            return bound
+    return 'inf'
+
+
+def get_latency_stats() -> list:
+    """
+    :return: [{endpoint, count, avg_ms, p50, p95, p99, buckets, backends: {后端: {calls, ms}}}], 按平均耗时降序
+    """
+    redis_connection = get_redis_connection("default")
+    stats = []
+    for endpoint in sorted(member.decode('utf-8') for member in redis_connection.smembers(ENDPOINTS_KEY)):
+        data = {key.decode('utf-8'): float(value)
+                for key, value in redis_connection.hgetall(LATENCY_KEY.format(endpoint)).items()}
+        count = int(data.get('count', 0))
+        if count == 0:
+            continue
+        buckets = {key[len('bucket:'):]: int(value) for key, value in data.items() if key.startswith('bucket:')}
+        backends = {}
+        for backend in BACKENDS:
+            if backend + ':calls' in data:
+                backends[backend] = {
+                    'calls_per_request': round(data[backend + ':calls'] / count, 2),
+                    'ms_per_request': round(data[backend + ':ms'] / count, 2),
+                }
+        stats.append({
+            'endpoint': endpoint,
+            'count': count,
+            'avg_ms': round(data['total_ms'] / count, 2),
+            'p50': percentile(buckets, count, 0.5),
+            'p95': percentile(buckets, count, 0.95),
+            'p99': percentile(buckets, count, 0.99),
+            'buckets': buckets,
+            'backends': backends,
+        })
+    stats.sort(key=lambda item: item['avg_ms'], reverse=True)
+    return stats
+
+
+def reset_latency_stats():
+    redis_connection = get_redis_connection("default")
+    endpoints = redis_connection.smembers(ENDPOINTS_KEY)
+    keys = [LATENCY_KEY.format(endpoint.decode('utf-8')) for endpoint in endpoints]
+    redis_connection.delete(ENDPOINTS_KEY, *keys)
+
+
+class TimingMiddleware:
+    """
+    记录每个请求的总耗时和各后端(es/redis/db/qos/translate)的调用次数与耗时,
+    通过Server-Timing响应头返回, 并按接口累计直方图
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_redis_hooks()
+
+    def __call__(self, request):
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_db_wrapper))
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - start
+
+        metrics = ['{};dur={:.1f};desc="{} calls"'.format(backend, seconds * 1000, calls)
+                   for backend, (calls, seconds) in timings.items()]
+        metrics.append('total;dur={:.1f}'.format(total * 1000))
+        response['Server-Timing'] = ', '.join(metrics)
+
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.route if match is not None else 'unmatched'
+        try:
+            save_request(endpoint, total, timings)
+        except Exception as e:
+            print('save latency failed: {}'.format(e))
+        return response
@@ -10,6 +10,10 @@ import random
 import json
 from hashlib import md5
 
+from utils.timing import timed_function
+
+
+@timed_function('translate')
 def translate(query):
     print(query)
     # Set your own appid/appkey.
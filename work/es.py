@@ -0,0 +1,302 @@
+import hashlib
+import json
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.query import Q, MultiMatch
+
+from utils.cache import exists, get_or_compute, refresh, soft_ttl
+from utils.es_client import get_client
+from work.tasks import compute_search_facets
+
+elasticsearch_connection = get_client()
+INDEX_NAME = 'work'
+page_size = 10
+min_score_threshold = 10.0
+SEARCH_TIMEOUT = 60 * 60
+
+# 延迟预算: 宽泛的查询命中上百万文档时, 分面只统计每个分片得分最高的SAMPLER_SHARD_SIZE篇,
+# 总数最多精确统计到TRACK_TOTAL_HITS, es超过BUDGET_TIMEOUT返回已有结果; 命中少的查询仍然是精确的
+SEARCH_BUDGET = getattr(settings, 'SEARCH_BUDGET', True)
+SAMPLER_SHARD_SIZE = getattr(settings, 'SEARCH_SAMPLER_SHARD_SIZE', 1000)
+TRACK_TOTAL_HITS = getattr(settings, 'SEARCH_TRACK_TOTAL_HITS', 10000)
+BUDGET_TIMEOUT = getattr(settings, 'SEARCH_BUDGET_TIMEOUT', '3s')
+# 超时的不完整结果只短暂缓存
+PARTIAL_TIMEOUT = 60
+SEARCH_NAMESPACE = 'search_hits'
+FACETS_NAMESPACE = 'search_facets'
+# 热门查询翻页时反复取同一份分面, 在进程内也缓存一会
+FACETS_LOCAL_TIMEOUT = 30
+
+# 各搜索接口接受的参数, 查询日志和预计算都按这里的顺序序列化
+SEARCH_PARAMS = ['content', 'order_by', 'order_term', 'page_number']
+ADVANCED_SEARCH_PARAMS = SEARCH_PARAMS + ['start_time', 'end_time', 'source', 'concept', 'institution']
+
+
+def normalize_content(content: str) -> str:
+    # ik分词器本身会转小写, 统一大小写和空白不影响结果, 但能让缓存命中率更高
+    return re.sub(r'\s+', ' ', content or '').strip().lower()
+
+
+def normalize_params(query_dict, param_names=None) -> dict:
+    """
+    规范化搜索参数, 同一个查询无论怎么输入都得到同一组参数
+    :param query_dict: request.GET 或 dict
+    :param param_names: 需要的参数名
+    :return: {参数名: 值或None}
+    """
+    param_names = param_names or SEARCH_PARAMS
+    params = {}
+    for name in param_names:
+        value = query_dict.get(name)
+        if value is not None:
+            value = value.strip()
+        params[name] = value or None
+    params['content'] = normalize_content(params.get('content')) or None
+    return params
+
+
+def apply_order_and_page(search: Search, params: dict) -> Search:
+    order_by = params.get('order_by')
+    if order_by:
+        sort_by = None
+        if order_by == 'default':
+            sort_by = '_score'
+        if order_by == 'cited_by_count':
+            sort_by = 'cited_by_count'
+        elif order_by == 'time':
+            sort_by = 'publication_date'
+        if params.get('order_term') == 'asc':
+            sort_by = '-' + sort_by
+        search = search.sort(sort_by)
+    page_number = params.get('page_number')
+    if page_number:
+        page_number = int(page_number)
+        search = search[(page_number - 1) * page_size:(page_number - 1) * page_size + page_size - 1]
+    return search
+
+
+# 分面: {聚合名: (扁平id字段, 实体索引)}, 在keyword数组上做terms聚合, 名称由get_display_names补全
+FACETS = {
+    'top_authors': ('author_ids', 'author'),
+    'top_concepts': ('concept_ids', 'concept'),
+    'top_institutions': ('institution_ids', 'institution'),
+    'top_sources': ('source_ids', 'source'),
+}
+FACET_SIZE = 10
+
+
+def apply_budget(search: Search) -> Search:
+    if SEARCH_BUDGET:
+        return search.extra(timeout=BUDGET_TIMEOUT, track_total_hits=TRACK_TOTAL_HITS)
+    # 总数直接从命中结果取, 不再单独count
+    return search.extra(track_total_hits=True)
+
+
+def add_aggregations(search: Search) -> Search:
+    search.aggs.bucket('publication_dates', 'date_histogram', field='publication_date', calendar_interval='1y')
+    facets = search.aggs
+    if SEARCH_BUDGET:
+        facets = search.aggs.bucket('sample', 'sampler', shard_size=SAMPLER_SHARD_SIZE)
+    for name, (field, _) in FACETS.items():
+        facets.bucket(name, 'terms', field=field, size=FACET_SIZE)
+    return search
+
+
+def get_facet_aggregations(response: dict) -> dict:
+    aggregations = response['aggregations']
+    return aggregations.get('sample', aggregations)
+
+
+def build_query(params: dict) -> Search:
+    search = Search(using=elasticsearch_connection, index=INDEX_NAME)
+    match = MultiMatch(query=params['content'], fields=['abstract', 'title'])
+    return search.query(match)
+
+
+def build_advanced_query(params: dict) -> Search:
+    search = build_query(params)
+
+    if params.get('start_time'):
+        search = search.query(Q('range', publication_date={'gte': params['start_time']}))
+    if params.get('end_time'):
+        search = search.query(Q('range', publication_date={'lte': params['end_time']}))
+
+    if params.get('source'):
+        query = Q("nested", path="locations",
+                  query=Q("term", locations__source__id=params['source']))
+        search = search.query(query)
+
+    if params.get('concept'):
+        query = Q("nested", path="concepts",
+                  query=Q("match", concepts__display_name=params['concept']))
+        search = search.query(query)
+
+    if params.get('institution'):
+        query = Q("nested", path="authorships",
+                  query=Q("nested", path="authorships.institutions",
+                          query=Q('term', authorships__institutions__id=params['institution'])))
+        search = search.query(query)
+    return search
+
+
+# {接口名: (查询构造函数, 参数名)}, 命中和分面共用同一个查询
+SEARCH_BUILDERS = {
+    'search': (build_query, SEARCH_PARAMS),
+    'advanced_search': (build_advanced_query, ADVANCED_SEARCH_PARAMS),
+}
+# 只影响命中列表的参数, 分面与它们无关
+PAGE_PARAMS = ['order_by', 'order_term', 'page_number']
+
+
+def build_search(kind: str, params: dict) -> Search:
+    """
+    命中列表: 不带聚合, 查询阶段结束就能返回
+    """
+    builder, _ = SEARCH_BUILDERS[kind]
+    search = builder(params)
+    search = search.highlight('title', 'abstract')
+    search = search.source(['publication_date', 'type', 'language',
+                            'visit_count', 'cited_by_count', 'id',
+                            'authorships', 'abstract', 'title', 'locations'])
+    search = apply_order_and_page(search, params)
+    search = search.params(min_score=min_score_threshold)
+    return apply_budget(search)
+
+
+def build_facet_search(kind: str, params: dict) -> Search:
+    """
+    分面和年份分布: 不取文档, 只做聚合
+    """
+    builder, _ = SEARCH_BUILDERS[kind]
+    search = builder(params).extra(size=0)
+    search = search.params(min_score=min_score_threshold)
+    return add_aggregations(apply_budget(search))
+
+
+def get_query_params(params: dict) -> dict:
+    return {name: value for name, value in params.items() if name not in PAGE_PARAMS}
+
+
+def get_query_token(kind: str, params: dict) -> str:
+    """
+    同一个查询(不管排序和页码)得到同一个token, 分面缓存按token存放
+    :param params: normalize_params规范化后的参数
+    """
+    query = json.dumps([kind, get_query_params(params)], sort_keys=True)
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+
+def get_query_key(token: str) -> str:
+    return 'search_query:' + token
+
+
+def register_query(kind: str, params: dict) -> str:
+    """
+    记下token对应的查询, 分面接口凭token重建查询
+    :return: token
+    """
+    token = get_query_token(kind, params)
+    cache.set(get_query_key(token), {'kind': kind, 'params': get_query_params(params)}, SEARCH_TIMEOUT)
+    return token
+
+
+def get_registered_query(token: str):
+    """
+    :return: {'kind', 'params'}, token不存在或已过期时为None
+    """
+    return cache.get(get_query_key(token))
+
+
+def get_search_timeout(response: dict) -> int:
+    # 超时的不完整结果很快软过期, 下次访问时后台重算
+    return PARTIAL_TIMEOUT if response['timed_out'] else SEARCH_TIMEOUT
+
+
+def execute_search(kind: str, params: dict) -> dict:
+    """
+    执行命中查询, 只保留接口用到的部分再缓存
+    approximate为True时总数是下限或结果因超时不完整
+    """
+    response = build_search(kind, params).execute().to_dict()
+    hits, total = response['hits'], response['hits']['total']
+    return {
+        'timed_out': response['timed_out'],
+        'count': total['value'],
+        'approximate': response['timed_out'] or total['relation'] != 'eq',
+        'hits': {
+            'max_score': hits['max_score'],
+            'hits': [{'_source': hit['_source'], 'highlight': hit.get('highlight', {})} for hit in hits['hits']],
+        },
+    }
+
+
+def get_search_response(kind: str, params: dict):
+    """
+    命中列表与排序和页码有关, 按完整的规范化参数缓存
+    :return: (response, 是否命中缓存)
+    """
+    return get_or_compute(SEARCH_NAMESPACE, execute_search, [kind, params], soft_timeout=get_search_timeout)
+
+
+def refresh_search(kind: str, params: dict) -> bool:
+    return refresh(SEARCH_NAMESPACE, execute_search, [kind, params], soft_timeout=get_search_timeout)
+
+
+def execute_facets(kind: str, params: dict) -> dict:
+    """
+    执行分面查询, 桶只保留键和文档数
+    approximate为True时分面是抽样统计的或结果因超时不完整
+    :return: {publication_dates: [{key_as_string, doc_count}], facets: {分面名: [{key, doc_count}]}, approximate, timed_out}
+    """
+    response = build_facet_search(kind, params).execute().to_dict()
+    aggregations = response['aggregations']
+    total = response['hits']['total']
+    approximate = response['timed_out'] or total['relation'] != 'eq'
+    if 'sample' in aggregations:
+        approximate = approximate or aggregations['sample']['doc_count'] < total['value']
+    facet_aggregations = get_facet_aggregations(response)
+    return {
+        'publication_dates': [{'key_as_string': bucket['key_as_string'], 'doc_count': bucket['doc_count']}
+                              for bucket in aggregations['publication_dates']['buckets']],
+        'facets': {name: [{'key': bucket['key'], 'doc_count': bucket['doc_count']}
+                          for bucket in facet_aggregations[name]['buckets']] for name in FACETS},
+        'approximate': approximate,
+        'timed_out': response['timed_out'],
+    }
+
+
+def get_facets_response(kind: str, params: dict):
+    """
+    分面与排序和页码无关, 同一个查询的所有页共用
+    :return: (facets, 是否命中缓存)
+    """
+    return get_or_compute(FACETS_NAMESPACE, execute_facets, [kind, get_query_params(params)],
+                          soft_timeout=get_search_timeout, local_timeout=FACETS_LOCAL_TIMEOUT)
+
+
+def refresh_facets(kind: str, params: dict) -> bool:
+    return refresh(FACETS_NAMESPACE, execute_facets, [kind, get_query_params(params)], soft_timeout=get_search_timeout)
+
+
+def facets_expiring(kind: str, params: dict, before: int) -> bool:
+    return soft_ttl(FACETS_NAMESPACE, [kind, get_query_params(params)]) <= before
+
+
+def search_expiring(kind: str, params: dict, before: int) -> bool:
+    return soft_ttl(SEARCH_NAMESPACE, [kind, params]) <= before
+
+
+def prefetch_facets(kind: str, params: dict):
+    """
+    分面没有缓存时交给后台计算, 与命中查询同时进行, 客户端随后凭token取分面
+    """
+    if exists(FACETS_NAMESPACE, [kind, get_query_params(params)]):
+        return
+    try:
+        compute_search_facets.delay(kind, get_query_params(params))
+    except Exception as e:
+        # 后台任务提交失败时, 分面接口会当场计算
+        print('prefetch facets failed: {}'.format(e))
@@ -0,0 +1,409 @@
+import hashlib
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from config import OPENAI_API_KEY
+
+OPENAI_API_BASE = "https://api.132999.xyz/v1"
+# 每篇论文的向量库持久化在磁盘上, 超过数量后按最近使用时间淘汰
+STORE_DIR = str(getattr(settings, 'PAPER_QA_STORE_DIR', os.path.join(settings.BASE_DIR, 'paper_qa')))
+MAX_STORES = getattr(settings, 'PAPER_QA_MAX_STORES', 200)
+# 可选 'openai' / 'hash' 或者一个返回 Embeddings 对象的点分路径
+EMBEDDINGS_BACKEND = getattr(settings, 'PAPER_QA_EMBEDDINGS', 'openai')
+# 进程内缓存已经打开的向量库
+OPEN_STORES_SIZE = 8
+LAST_USED_FILE = '.last_used'
+READY_FILE = '.ready'
+# 等待其他请求构建同一篇论文的最长时间
+BUILD_WAIT = 120
+CHUNK_SIZE = 1000
+EMBED_BATCH_SIZE = 64
+# 下载限制: 最大文件大小, (连接, 读取)超时, 整体下载时间
+MAX_PDF_SIZE = getattr(settings, 'PAPER_QA_MAX_PDF_SIZE', 50 * 1024 * 1024)
+DOWNLOAD_TIMEOUT = (5, 30)
+DOWNLOAD_DEADLINE = 120
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_POOL_SIZE = 16
+# 问答会话保存在redis中, 空闲超时后淘汰, 只保留最近几轮对话
+SESSION_TIMEOUT = 60 * 30
+HISTORY_SIZE = 5
+# 后台问答任务: 结果保留时间, 流式回答每次推送的最少字符数
+JOB_TIMEOUT = 60 * 30
+TOKEN_FLUSH_SIZE = 16
+
+
+class PaperDownloadError(Exception):
+    pass
+
+
+class PaperSessionError(Exception):
+    pass
+
+
+class HashEmbeddings:
+    """
+    本地哈希词袋向量, 不依赖外部服务, 用于离线测试
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+
+    def embed_query(self, text):
+        vector = [0.0] * self.size
+        for word in re.findall(r'\w+', text.lower()):
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.size] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def openai_embeddings():
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    setup_openai()
+    return OpenAIEmbeddings()
+
+
+EMBEDDINGS_BACKENDS = {
+    'openai': openai_embeddings,
+    'hash': HashEmbeddings,
+}
+
+
+def get_embeddings():
+    backend = EMBEDDINGS_BACKENDS.get(EMBEDDINGS_BACKEND) or import_string(EMBEDDINGS_BACKEND)
+    return backend()
+
+
+def setup_openai():
+    os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
+    os.environ["OPENAI_API_BASE"] = OPENAI_API_BASE
+
+
+def pdf_key(pdf_url: str) -> str:
+    # 嵌入模型不同向量也不同, 一起计入key
+    return hashlib.sha256('{}|{}'.format(EMBEDDINGS_BACKEND, pdf_url).encode('utf-8')).hexdigest()
+
+
+def collection_name(key: str, persist: bool = True) -> str:
+    # chroma的内存模式在进程内共享同一个客户端, 每次内存构建都用新的collection, 避免和别的请求写进同一个
+    if persist:
+        return key[:63]
+    return '{}-{}'.format(key[:30], uuid.uuid4().hex)
+
+
+def create_http_session() -> requests.Session:
+    http = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+    http.mount('http://', adapter)
+    http.mount('https://', adapter)
+    http.headers.update({
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36",
+        "Connection": "keep-alive",
+        "Accept": "application/pdf,text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "zh-CN,zh;q=0.8"})
+    return http
+
+
+# 进程内复用连接池, 同一站点的pdf不用每次重新握手
+_http = create_http_session()
+
+
+def download_pdf(url: str, destination_file: str, progress=None):
+    """
+    流式下载pdf到文件, 内存中只保留一个分块; 超过大小或总时间限制时抛出PaperDownloadError
+    """
+    deadline = time.time() + DOWNLOAD_DEADLINE
+    size = 0
+    try:
+        with _http.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length') or 0) > MAX_PDF_SIZE:
+                raise PaperDownloadError('文件过大')
+            with open(destination_file, 'wb') as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    # Content-Length可能缺失或不准, 以实际读到的为准
+                    if size > MAX_PDF_SIZE:
+                        raise PaperDownloadError('文件过大')
+                    if time.time() > deadline:
+                        raise PaperDownloadError('下载超时')
+                    file.write(chunk)
+    except requests.exceptions.RequestException as e:
+        raise PaperDownloadError(str(e))
+    report(progress, 'downloaded', {'size': size})
+
+
+def iter_chunks(pdf_url: str, progress=None):
+    """
+    下载pdf后逐页提取文本并切分, 生成器, 上游可以边提取边嵌入
+    pdf的交叉引用表在文件末尾, 必须下载完才能开始解析
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    fd, destination_file = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    try:
+        download_pdf(pdf_url, destination_file, progress)
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=0)
+        try:
+            reader = PdfReader(destination_file)
+            pages = len(reader.pages)
+            for number, page in enumerate(reader.pages):
+                text = page.extract_text()
+                if text.strip():
+                    yield from splitter.create_documents([text], [{'source': pdf_url, 'page': number}])
+                report(progress, 'chunked', {'page': number + 1, 'pages': pages})
+        except PyPdfError as e:
+            raise PaperDownloadError('无法解析pdf: {}'.format(e))
+    finally:
+        os.remove(destination_file)
+
+
+def embed_chunks(key: str, pdf_url: str, embeddings, path=None, progress=None):
+    """
+    按批嵌入并写入向量库, 不需要先把整篇论文的分块都放进内存
+    """
+    from langchain.vectorstores import Chroma
+
+    db = Chroma(collection_name(key, path is not None), embeddings, persist_directory=path)
+    batch = []
+    count = 0
+    for document in iter_chunks(pdf_url, progress):
+        batch.append(document)
+        if len(batch) >= EMBED_BATCH_SIZE:
+            db.add_documents(batch)
+            count += len(batch)
+            batch = []
+            report(progress, 'embedded', {'chunks': count})
+    if batch:
+        db.add_documents(batch)
+        count += len(batch)
+        report(progress, 'embedded', {'chunks': count})
+    if count == 0:
+        raise PaperDownloadError('未能从pdf中提取文本')
+    return db
+
+
+def report(progress, stage: str, data: dict):
+    if progress is not None:
+        progress(stage, data)
+
+
+def token_progress_handler(progress, flush_size=TOKEN_FLUSH_SIZE):
+    """
+    把llm流式输出的token攒成小段再报告, 避免每个token都发一次消息
+    """
+    from langchain.callbacks.base import BaseCallbackHandler
+
+    class TokenProgressHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.buffer = ''
+
+        def on_llm_new_token(self, token: str, **kwargs):
+            self.buffer += token
+            if len(self.buffer) >= flush_size:
+                self.flush()
+
+        def on_llm_end(self, response, **kwargs):
+            self.flush()
+
+        def flush(self):
+            if self.buffer:
+                report(progress, 'token', {'text': self.buffer})
+                self.buffer = ''
+
+    return TokenProgressHandler()
+
+
+def touch(path: str):
+    with open(os.path.join(path, LAST_USED_FILE), 'w') as file:
+        file.write(str(time.time()))
+
+
+def is_ready(path: str) -> bool:
+    return os.path.exists(os.path.join(path, READY_FILE))
+
+
+def evict_stores():
+    """
+    按最近使用时间淘汰多余的向量库, 正在构建的不处理
+    """
+    stores = []
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        if not os.path.isdir(path) or not is_ready(path):
+            continue
+        last_used = os.path.join(path, LAST_USED_FILE)
+        stores.append((os.path.getmtime(last_used) if os.path.exists(last_used) else 0, name, path))
+    if len(stores) <= MAX_STORES:
+        return
+    stores.sort()
+    for _, name, path in stores[:len(stores) - MAX_STORES]:
+        with _open_stores_lock:
+            _open_stores.pop(name, None)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def acquire_build_lock(path: str) -> bool:
+    lock_file = path + '.lock'
+    try:
+        os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        # 构建进程异常退出留下的锁
+        if time.time() - os.path.getmtime(lock_file) > BUILD_WAIT * 2:
+            os.remove(lock_file)
+            return acquire_build_lock(path)
+        return False
+
+
+def build_store(key: str, pdf_url: str, embeddings, progress=None):
+    """
+    切分并嵌入整篇论文并持久化; 同一篇论文同时只有一个请求在构建, 其他请求等待构建完成
+    """
+    from langchain.vectorstores import Chroma
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    path = os.path.join(STORE_DIR, key)
+    if not acquire_build_lock(path):
+        deadline = time.time() + BUILD_WAIT
+        while time.time() < deadline and not is_ready(path):
+            time.sleep(0.5)
+        if is_ready(path):
+            return Chroma(collection_name(key), embeddings, persist_directory=path)
+        # 等不到就只在内存里构建这一次
+        return embed_chunks(key, pdf_url, embeddings, progress=progress)
+    try:
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            db = embed_chunks(key, pdf_url, embeddings, path, progress)
+        except BaseException:
+            # 没有.ready的目录不会被读取, 也不会被evict_stores清理
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        open(os.path.join(path, READY_FILE), 'w').close()
+        touch(path)
+    finally:
+        os.remove(path + '.lock')
+    evict_stores()
+    return db
+
+
+_open_stores = OrderedDict()
+_open_stores_lock = threading.Lock()
+
+
+def get_store(pdf_url: str, progress=None):
+    """
+    获取论文的向量库: 进程内缓存 -> 磁盘 -> 重新下载构建
+    """
+    from langchain.vectorstores import Chroma
+
+    key = pdf_key(pdf_url)
+    path = os.path.join(STORE_DIR, key)
+    with _open_stores_lock:
+        db = _open_stores.get(key)
+        if db is not None:
+            _open_stores.move_to_end(key)
+    if db is None or not is_ready(path):
+        embeddings = get_embeddings()
+        if is_ready(path):
+            db = Chroma(collection_name(key), embeddings, persist_directory=path)
+        else:
+            db = build_store(key, pdf_url, embeddings, progress)
+        with _open_stores_lock:
+            _open_stores[key] = db
+            while len(_open_stores) > OPEN_STORES_SIZE:
+                _open_stores.popitem(last=False)
+    if is_ready(path):
+        touch(path)
+    return db
+
+
+def get_chain(pdf_url: str, progress=None):
+    from langchain.chat_models import ChatOpenAI
+    from langchain.chains import ConversationalRetrievalChain
+
+    db = get_store(pdf_url, progress)
+    setup_openai()
+    if progress is None:
+        llm = ChatOpenAI(temperature=0)
+    else:
+        llm = ChatOpenAI(temperature=0, streaming=True, callbacks=[token_progress_handler(progress)])
+    # 改写追问用单独的llm, 不把改写过程的token推给用户
+    return ConversationalRetrievalChain.from_llm(llm, retriever=db.as_retriever(),
+                                                 condense_question_llm=ChatOpenAI(temperature=0))
+
+
+def session_key(owner: str, pdf_url: str) -> str:
+    return 'paper_qa_session_' + hashlib.sha1('{}|{}'.format(owner, pdf_url).encode('utf-8')).hexdigest()
+
+
+def current_paper_key(owner: str) -> str:
+    return 'paper_qa_current_' + hashlib.sha1(owner.encode('utf-8')).hexdigest()
+
+
+def ask(owner: str, msg: str, pdf_url=None, progress=None) -> dict:
+    """
+    在用户和论文对应的会话中提问, 会话只保存pdf_url和有限的对话历史, 存在redis中, 任意worker都能接着回答
+    :param owner: 会话所属用户的邮箱
+    :param msg: 问题
+    :param pdf_url: 论文链接, 为空时使用该用户最近提问的论文
+    :param progress: 进度回调 progress(stage, data), 为空时不报告进度
+    :return: {'query': 问题, 'result': 回答}
+    """
+    if not pdf_url:
+        pdf_url = cache.get(current_paper_key(owner))
+        if not pdf_url:
+            raise PaperSessionError('请先选择要提问的论文')
+    key = session_key(owner, pdf_url)
+    session = cache.get(key) or {'pdf_url': pdf_url, 'history': []}
+    chain = get_chain(pdf_url, progress)
+    result = chain({'question': msg, 'chat_history': [tuple(turn) for turn in session['history']]})
+    session['history'] = (session['history'] + [[msg, result['answer']]])[-HISTORY_SIZE:]
+    # 每次提问都会刷新过期时间, 空闲超过SESSION_TIMEOUT的会话自动淘汰
+    cache.set(key, session, SESSION_TIMEOUT)
+    cache.set(current_paper_key(owner), pdf_url, SESSION_TIMEOUT)
+    return {'query': msg, 'result': result['answer']}
+
+
+def job_key(job_id: str) -> str:
+    return 'paper_qa_job_' + job_id
+
+
+def send_progress(user_email: str, job_id: str, stage: str, data: dict):
+    """
+    推送到用户的websocket分组, 和manager.views.send_message使用同一个分组
+    """
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    async_to_sync(get_channel_layer().group_send)(
+        'user_{}'.format(user_email.split('@')[0]),
+        {
+            'type': 'send_message',
+            'message': {
+                'type': 'paper_qa',
+                'job_id': job_id,
+                'stage': stage,
+                'data': data,
+            }
+        }
+    )
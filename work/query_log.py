@@ -0,0 +1,98 @@
+import json
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from work.es import SEARCH_BUILDERS, SEARCH_TIMEOUT, facets_expiring, refresh_facets, refresh_search, search_expiring
+
+# 搜索日志写入redis stream, 只保留最近的一部分
+QUERY_LOG_KEY = 'nobc:search_query_log'
+QUERY_LOG_MAXLEN = 100000
+# 统计最近一段时间的热门查询并提前执行
+POPULAR_WINDOW = 60 * 60 * 24
+POPULAR_SIZE = 100
+# 缓存剩余时间小于这个值时就提前刷新, 要大于定时任务的间隔
+REFRESH_BEFORE = 60 * 20
+QUERY_STATS_KEY = 'search_query_stats'
+
+
+def log_query(kind: str, params: dict, latency: float, cached: bool, response: dict):
+    """
+    记录一次搜索, 写日志失败不影响搜索本身
+    :param kind: 接口名, search / advanced_search
+    :param params: 规范化后的参数
+    :param latency: 耗时(秒)
+    :param cached: 是否命中缓存
+    :param response: es返回结果
+    """
+    try:
+        get_redis_connection("default").xadd(QUERY_LOG_KEY, {
+            'kind': kind,
+            'params': json.dumps(params, sort_keys=True),
+            'latency': round(latency * 1000, 2),
+            'cached': int(cached),
+            'count': response.get('count', 0),
+            'max_score': response['hits'].get('max_score') or 0,
+        }, maxlen=QUERY_LOG_MAXLEN, approximate=True)
+    except Exception as e:
+        print('log query failed: {}'.format(e))
+
+
+def read_query_log(window=POPULAR_WINDOW) -> list:
+    redis_connection = get_redis_connection("default")
+    min_id = '{}-0'.format(int((time.time() - window) * 1000))
+    entries = redis_connection.xrange(QUERY_LOG_KEY, min=min_id, max='+')
+    return [{key.decode('utf-8'): value.decode('utf-8') for key, value in fields.items()}
+            for _, fields in entries]
+
+
+def summarize(entries: list, size=POPULAR_SIZE) -> list:
+    """
+    统计热门查询, 同时给出延迟和得分, 用于调整min_score_threshold
+    :return: [{kind, params, hits, avg_latency, cache_rate, avg_count, avg_max_score}]
+    """
+    counter = Counter()
+    totals = {}
+    for entry in entries:
+        query = (entry['kind'], entry['params'])
+        counter[query] += 1
+        total = totals.setdefault(query, [0.0, 0, 0, 0.0])
+        total[0] += float(entry['latency'])
+        total[1] += int(entry['cached'])
+        total[2] += int(entry['count'])
+        total[3] += float(entry['max_score'])
+    summary = []
+    for (kind, params), hits in counter.most_common(size):
+        latency, cached, count, max_score = totals[(kind, params)]
+        summary.append({
+            'kind': kind,
+            'params': json.loads(params),
+            'hits': hits,
+            'avg_latency': round(latency / hits, 2),
+            'cache_rate': round(cached / hits, 2),
+            'avg_count': count // hits,
+            'avg_max_score': round(max_score / hits, 2),
+        })
+    return summary
+
+
+def precompute_popular_queries():
+    """
+    提前执行热门查询的命中和分面, 让热门查询总能命中缓存
+    :return: 刷新的查询数量
+    """
+    summary = summarize(read_query_log())
+    cache.set(QUERY_STATS_KEY, summary, SEARCH_TIMEOUT)
+    refreshed = 0
+    for item in summary:
+        kind, params = item['kind'], item['params']
+        if kind not in SEARCH_BUILDERS:
+            continue
+        # 快要软过期或已经软过期的才刷新
+        refreshed_hits = search_expiring(kind, params, REFRESH_BEFORE) and refresh_search(kind, params)
+        refreshed_facets = facets_expiring(kind, params, REFRESH_BEFORE) and refresh_facets(kind, params)
+        if refreshed_hits or refreshed_facets:
+            refreshed += 1
+    return refreshed
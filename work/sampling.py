@@ -0,0 +1,146 @@
+import random
+from array import array
+
+from django_redis import get_redis_connection
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.query import Q
+
+from utils.cache import get_or_compute, refresh
+from utils.es_client import get_client
+
+elasticsearch_connection = get_client()
+INDEX_NAME = 'work'
+POOL_SIZE = 200
+# 候选池由定时任务刷新, 过期时间只是兜底, 要大于刷新周期
+POOL_TIMEOUT = 60 * 60 * 12
+# 定时任务漏跑时, 超过这个时间的候选池在下次访问时后台刷新
+POOL_REFRESH = 60 * 60 * 6
+POOL_NAMESPACE = 'popular_works_pool'
+# 每次请求都要读取整个候选池, 在进程内也缓存一会
+POOL_LOCAL_TIMEOUT = 60
+# 记录被请求过的候选池, 定时任务只刷新这些
+POOL_REGISTRY_KEY = 'nobc:popular_works_pools'
+# 不放回采样时, 每个名额最多重抽的次数
+MAX_REDRAW = 8
+
+
+def get_pool_key(institution_id=None, concept_id=None) -> str:
+    # 候选池登记表中的字段名
+    key = 'popular_works_pool'
+    if institution_id:
+        key = key + '_' + institution_id
+    elif concept_id:
+        key = key + '_' + concept_id
+    return key
+
+
+def build_alias_table(weights: list):
+    """
+    Vose别名法构造别名表, 之后每次采样都是O(1)
+    :param weights: 权重列表
+    :return: (prob, alias), 分别为紧凑的double数组和int数组
+    """
+    n = len(weights)
+    total = float(sum(weights))
+    prob = array('d', [1.0] * n)
+    alias = array('i', range(n))
+    if total <= 0:
+        # 全部为0时退化为均匀采样
+        return prob, alias
+    scaled = [weight * n / total for weight in weights]
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    # 剩下的都是浮点误差导致的, 概率直接取1
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+
+def build_pool(works: list) -> dict:
+    prob, alias = build_alias_table([max(work.get('cited_by_count') or 0, 0) for work in works])
+    return {
+        'works': works,
+        'prob': prob,
+        'alias': alias,
+    }
+
+
+def sample_pool(pool: dict, k=10) -> list:
+    """
+    按引用数加权不放回采样, 期望复杂度O(k)
+    :param pool: build_pool构造的候选池
+    :param k: 采样数量
+    :return: 论文列表, 元素是进程内缓存的候选池中的对象, 不能修改
+    """
+    works, prob, alias = pool['works'], pool['prob'], pool['alias']
+    n = len(works)
+    k = min(k, n)
+    chosen = []
+    seen = set()
+    attempts = 0
+    while len(chosen) < k and attempts < k * MAX_REDRAW:
+        attempts += 1
+        i = random.randrange(n)
+        if random.random() >= prob[i]:
+            i = alias[i]
+        if i not in seen:
+            seen.add(i)
+            chosen.append(i)
+    # 权重过于集中时重抽可能不够, 剩下的名额从未选中的里均匀补齐
+    if len(chosen) < k:
+        rest = [i for i in range(n) if i not in seen]
+        chosen.extend(random.sample(rest, k - len(chosen)))
+    return [works[i] for i in chosen]
+
+
+def fetch_pool(institution_id=None, concept_id=None) -> dict:
+    search = Search(using=elasticsearch_connection, index=INDEX_NAME)
+    if institution_id:
+        search = search.query(Q('term', corresponding_institution_ids=institution_id))
+    elif concept_id:
+        search = search.query(Q('nested', path='concepts', query=Q('term', concepts__id=concept_id)))
+    search = search.sort('-cited_by_count')
+    search = search.source(['publication_date', 'visit_count', 'cited_by_count', 'id', 'title', 'authorships'])
+    search = search.extra(size=POOL_SIZE)
+    response = search.execute()
+    return build_pool([hit.to_dict() for hit in response])
+
+
+def get_pool_args(institution_id=None, concept_id=None) -> list:
+    # 同时给出时只按机构筛选, 见fetch_pool
+    return [institution_id, None] if institution_id else [None, concept_id]
+
+
+def refresh_pool(institution_id=None, concept_id=None) -> bool:
+    return refresh(POOL_NAMESPACE, fetch_pool, get_pool_args(institution_id, concept_id),
+                   soft_timeout=POOL_REFRESH, hard_timeout=POOL_TIMEOUT)
+
+
+def get_pool(institution_id=None, concept_id=None) -> dict:
+    pool, cached = get_or_compute(POOL_NAMESPACE, fetch_pool, get_pool_args(institution_id, concept_id),
+                                  soft_timeout=POOL_REFRESH, hard_timeout=POOL_TIMEOUT,
+                                  local_timeout=POOL_LOCAL_TIMEOUT)
+    if not cached:
+        get_redis_connection("default").hset(POOL_REGISTRY_KEY, get_pool_key(institution_id, concept_id),
+                                             '{}|{}'.format(institution_id or '', concept_id or ''))
+    return pool
+
+
+def refresh_registered_pools():
+    """
+    定时刷新所有被请求过的候选池
+    """
+    redis_connection = get_redis_connection("default")
+    for value in redis_connection.hgetall(POOL_REGISTRY_KEY).values():
+        institution_id, concept_id = value.decode('utf-8').split('|')
+        refresh_pool(institution_id or None, concept_id or None)
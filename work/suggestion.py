@@ -0,0 +1,125 @@
+import hashlib
+import re
+import threading
+import time
+
+from django.core.cache import cache
+from elasticsearch_dsl import Search
+
+from utils.es_client import get_client
+
+elasticsearch_connection = get_client()
+INDEX_NAME = 'work'
+SUGGESTION_SIZE = 10
+# redis中按前缀缓存的时间
+SUGGESTION_TIMEOUT = 60 * 10
+# 进程内前缀树: 收录被引最多的标题, 只索引前MAX_PREFIX_LEN个字符
+HOT_TITLES_KEY = 'suggestion_hot_titles'
+HOT_TITLES_SIZE = 2000
+HOT_TITLES_TIMEOUT = 60 * 60 * 24
+TRIE_REBUILD_INTERVAL = 60 * 60
+MAX_PREFIX_LEN = 16
+
+
+def normalize_prefix(content: str) -> str:
+    return re.sub(r'\s+', ' ', content or '').strip().lower()
+
+
+class TitleTrie:
+    """
+    前缀树, 每个节点保存该前缀下得分最高的若干标题, 查询只需沿前缀走一遍
+    """
+
+    def __init__(self, titles, size=SUGGESTION_SIZE, max_depth=MAX_PREFIX_LEN):
+        # 节点为 [子节点dict, 标题列表], titles需已按得分降序排列
+        self.root = [{}, []]
+        self.size = size
+        self.max_depth = max_depth
+        for title in titles:
+            self.insert(title)
+
+    def insert(self, title: str):
+        node = self.root
+        for char in normalize_prefix(title)[:self.max_depth]:
+            node = node[0].setdefault(char, [{}, []])
+            if len(node[1]) < self.size and title not in node[1]:
+                node[1].append(title)
+
+    def lookup(self, prefix: str):
+        """
+        :return: 标题列表; 前缀超出索引深度或不存在时返回None
+        """
+        if not prefix or len(prefix) > self.max_depth:
+            return None
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return None
+        return node[1]
+
+
+_trie = None
+_trie_built_at = 0
+_trie_lock = threading.Lock()
+
+
+def get_hot_titles() -> list:
+    titles = cache.get(HOT_TITLES_KEY)
+    if titles is None:
+        search = Search(using=elasticsearch_connection, index=INDEX_NAME)
+        search = search.sort('-cited_by_count').source(['title']).extra(size=HOT_TITLES_SIZE)
+        titles = [hit.title for hit in search.execute() if hit.title]
+        cache.set(HOT_TITLES_KEY, titles, timeout=HOT_TITLES_TIMEOUT)
+    return titles
+
+
+def get_trie():
+    """
+    获取进程内前缀树, 过期后由拿到锁的请求重建, 其他请求继续使用旧树
+    """
+    global _trie, _trie_built_at
+    if _trie is not None and time.time() - _trie_built_at < TRIE_REBUILD_INTERVAL:
+        return _trie
+    if not _trie_lock.acquire(blocking=_trie is None):
+        return _trie
+    try:
+        if _trie is None or time.time() - _trie_built_at >= TRIE_REBUILD_INTERVAL:
+            _trie = TitleTrie(get_hot_titles())
+            _trie_built_at = time.time()
+    finally:
+        _trie_lock.release()
+    return _trie
+
+
+def query_suggestions(content: str) -> list:
+    search = Search(using=elasticsearch_connection, index=INDEX_NAME)
+    search = search.suggest('suggestion-work', content, completion={
+        'field': 'title.suggestion',
+        'size': SUGGESTION_SIZE,
+        'skip_duplicates': True,
+    })
+    search = search.source(False)
+    response = search.execute()
+    return [option['text'] for option in response.suggest['suggestion-work'][0]['options']]
+
+
+def get_suggestions(content: str) -> list:
+    """
+    获取搜索建议: 进程内前缀树 -> redis前缀缓存 -> es completion suggester
+    :param content: 用户输入
+    :return: 建议标题列表
+    """
+    prefix = normalize_prefix(content)
+    if not prefix:
+        return []
+    suggestions = get_trie().lookup(prefix)
+    # 前缀树中的结果不满一页时, 可能还有不在热门标题中的匹配, 继续查
+    if suggestions is not None and len(suggestions) >= SUGGESTION_SIZE:
+        return suggestions
+    key = 'suggestion_' + hashlib.md5(prefix.encode('utf-8')).hexdigest()
+    suggestions = cache.get(key)
+    if suggestions is None:
+        suggestions = query_suggestions(prefix)
+        cache.set(key, suggestions, timeout=SUGGESTION_TIMEOUT)
+    return suggestions
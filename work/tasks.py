@@ -1,10 +1,11 @@
 
 from celery import shared_task
 from django_redis import get_redis_connection
-from elasticsearch_dsl import connections, UpdateByQuery
+from elasticsearch_dsl import UpdateByQuery
 from django.core.cache import cache
+from utils.es_client import BATCH, get_client
 
-elasticsearch_connection = connections.get_connection()
+elasticsearch_connection = get_client(BATCH)
 INDEX_NAME = 'work_optimized'
 
 
@@ -24,3 +25,46 @@ def update_es():
                                                  lang='painless')
         update_by_query.execute()
         cache.delete('visit_' + key)
+
+
+@shared_task(time_limit=60 * 10)
+def refresh_popular_works():
+    from work.sampling import refresh_registered_pools
+    refresh_registered_pools()
+
+
+@shared_task(time_limit=60 * 10)
+def precompute_popular_queries():
+    from work.query_log import precompute_popular_queries as precompute
+    return precompute()
+
+
+@shared_task(time_limit=60)
+def compute_search_facets(kind, params):
+    from work.es import refresh_facets
+    refresh_facets(kind, params)
+
+
+@shared_task(time_limit=60 * 10)
+def paper_qa_job(job_id, user_email, msg, pdf_url=None):
+    """
+    后台执行论文问答, 进度和回答通过websocket推送给用户, 最终结果同时写入缓存供轮询
+    """
+    from work.paper_qa import JOB_TIMEOUT, PaperDownloadError, PaperSessionError, ask, job_key, send_progress
+
+    def progress(stage, data):
+        send_progress(user_email, job_id, stage, data)
+
+    cache.set(job_key(job_id), {'user': user_email, 'status': 'running'}, JOB_TIMEOUT)
+    try:
+        reply = ask(user_email, msg, pdf_url, progress)
+    except (PaperDownloadError, PaperSessionError) as e:
+        cache.set(job_key(job_id), {'user': user_email, 'status': 'failed', 'error': str(e)}, JOB_TIMEOUT)
+        progress('failed', {'error': str(e)})
+        return
+    except Exception:
+        cache.set(job_key(job_id), {'user': user_email, 'status': 'failed', 'error': '问答失败'}, JOB_TIMEOUT)
+        progress('failed', {'error': '问答失败'})
+        raise
+    cache.set(job_key(job_id), {'user': user_email, 'status': 'done', 'reply': reply}, JOB_TIMEOUT)
+    progress('done', {'reply': reply})
@@ -1,353 +1,167 @@
 # Create your views here.
-import json
+import time
+import uuid
 
-import numpy as np
-import requests
 from django.core.cache import cache
-from elasticsearch_dsl import connections, Search
-from elasticsearch_dsl.response import Response
-from elasticsearch_dsl.query import Q, MultiMatch
 
-from config import OPENAI_API_KEY
+from utils.cache import get_or_compute
 from utils.view_decorator import *
+from utils.entity import get_display_names, get_entity, mget_entities
+from work.es import FACETS, SEARCH_BUILDERS, get_facets_response, get_registered_query, get_search_response, \
+    normalize_params, prefetch_facets, register_query
+from work.paper_qa import JOB_TIMEOUT, PaperDownloadError, PaperSessionError, ask, job_key
+from work.query_log import log_query
+from work.sampling import get_pool, sample_pool
+from work.suggestion import get_suggestions
+from work.tasks import paper_qa_job
 
-elasticsearch_connection = connections.get_connection()
 INDEX_NAME = 'work'
-page_size = 10
-min_score_threshold = 10.0
+WORK_TIMEOUT = 60 * 60
 
 
-@allowed_methods(['GET'])
-def search(request):
-    content = request.GET.get('content')
-    order_by = request.GET.get('order_by')
-    order_term = request.GET.get('order_term')
-    page_number = request.GET.get('page_number')
-
-    if not content:
+def run_search(kind: str, request):
+    """
+    只返回命中列表和facets_token, 分面同时在后台计算, 客户端凭token从get_search_facets获取
+    """
+    _, param_names = SEARCH_BUILDERS[kind]
+    params = normalize_params(request.GET, param_names)
+    if not params['content']:
         return JsonResponse({
             'code': PARAMS_ERROR,
             'error': True,
             'message': 'please input search text.',
             'data': {}
         })
-    search = Search(using=elasticsearch_connection, index=INDEX_NAME)
-    match = MultiMatch(query=content, fields=['abstract', 'title'])
-    search = search.query(match)
-    if order_by:
-        sort_by = None
-        if order_by == 'default':
-            sort_by = '_score'
-        if order_by == 'cited_by_count':
-            sort_by = 'cited_by_count'
-        elif order_by == 'time':
-            sort_by = 'publication_date'
-        if order_term == 'asc':
-            sort_by = '-' + sort_by
-        search = search.sort(sort_by)
-    search = search.highlight('title', 'abstract')
-    search = search.source(['publication_date', 'type', 'language',
-                            'visit_count', 'cited_by_count', 'id',
-                            'authorships', 'abstract', 'title', 'locations'])
-    if page_number:
-        page_number = int(page_number)
-        search = search[(page_number - 1) * page_size:(page_number - 1) * page_size + page_size - 1]
-    # pprint(search.to_dict())
-    search = search.params(min_score=min_score_threshold)
-    search.aggs.bucket('publication_dates', 'date_histogram', field='publication_date', calendar_interval='1y')
-    search.aggs.bucket('authors', 'nested', path='authorships').bucket(
-        'top_authors', 'terms', field='authorships.author.id', size=10, order={'_count': 'desc'}  # 指定降序排序
-    ).bucket('author_info', 'top_hits', size=1)
-    search.aggs.bucket('concepts', 'nested', path='concepts').bucket(
-        'top_concepts', 'terms', field='concepts.id', size=10, order={'_count': 'desc'}
-    ).bucket('concept_info', 'top_hits', size=1)
-    search.aggs.bucket('authorships', 'nested', path='authorships').bucket(
-        'institutions', 'nested', path='authorships.institutions'
-    ).bucket('top_institutions', 'terms', field='authorships.institutions.id', size=10,
-             order={'_count': 'desc'}).bucket(
-        'institution_info', 'top_hits', size=1
-    )
-    search.aggs.bucket('locations', 'nested', path='locations').bucket('top_sources', 'terms',
-                                                                       field='locations.source.id', size=10,
-                                                                       order={'_count': 'desc'}).bucket('source_info',
-                                                                                                        'top_hits',
-                                                                                                        size=1)
-
-    key = json.dumps(search.to_dict())
-    if cache.get(key) is None:
-        response = search.execute()
-        response = response.to_dict()
-        cache.set(key, response, 60 * 60)
-    else:
-        response = cache.get(key)
-    publication_dates = response['aggregations']['publication_dates']['buckets'][-10:]
-    top_authors = response['aggregations']['authors']['top_authors']['buckets']
-    top_concepts = response['aggregations']['concepts']['top_concepts']['buckets']
-    top_institutions = response['aggregations']['authorships']['institutions']['top_institutions']['buckets']
-    top_sources = response['aggregations']['locations']['top_sources']['buckets']
+    token = register_query(kind, params)
+    prefetch_facets(kind, params)
+    start_time = time.perf_counter()
+    response, cached = get_search_response(kind, params)
+    # 记录查询日志, 用于预计算热门查询
+    log_query(kind, params, time.perf_counter() - start_time, cached, response)
     return JsonResponse({
         'code': SUCCESS,
         'error': False,
         'message': 'OK',
         'data': {
-            'count': search.count(),
-            'data': [{
-                'highlight': hit['highlight'],
-                'other': {
-                    **hit['_source'],
-                    'citation': get_citation(hit['_source']),
-                }
-            } for hit in response['hits']['hits']],
-            'statistics': {
-                'docs_by_year': [{
-                    'doc_count': bucket['doc_count'],
-                    'year': bucket['key_as_string'][0:4],
-                } for bucket in publication_dates],
-                'top_authors': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['author_info']['hits']['hits'][0]['_source']['author'][
-                            'display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_authors
-                ],
-                'top_concepts': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['concept_info']['hits']['hits'][0]['_source']['display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_concepts
-                ],
-                'top_institutions': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['institution_info']['hits']['hits'][0]['_source']['display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_institutions
-                ],
-                'top_sources': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['source_info']['hits']['hits'][0]['_source']['source']['display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_sources
-                ],
-            }
+            **format_search_data(response),
+            'facets_token': token,
         },
     })
 
 
+def format_facets(buckets: dict) -> dict:
+    """
+    分面桶只有id, 一次批量查询补全名称
+    :param buckets: {分面名: [{key, doc_count}]}
+    """
+    names = get_display_names({index: [bucket['key'] for bucket in buckets[name]]
+                               for name, (_, index) in FACETS.items()})
+    return {
+        name: [
+            {
+                'id': bucket['key'],
+                'display_name': names[index].get(bucket['key']),
+                'doc_count': bucket['doc_count'],
+            }
+            for bucket in buckets[name]
+        ]
+        for name, (_, index) in FACETS.items()
+    }
+
+
+def format_search_data(response: dict) -> dict:
+    return {
+        'count': response['count'],
+        # 总数为下限/结果因超时不完整
+        'approximate': response.get('approximate', False),
+        'data': [{
+            'highlight': hit['highlight'],
+            'other': {
+                **hit['_source'],
+                'citation': get_citation(hit['_source']),
+            }
+        } for hit in response['hits']['hits']],
+    }
+
+
+def format_statistics(facets: dict) -> dict:
+    return {
+        # 分面为抽样统计/结果因超时不完整
+        'approximate': facets['approximate'],
+        'statistics': {
+            'docs_by_year': [{
+                'doc_count': bucket['doc_count'],
+                'year': bucket['key_as_string'][0:4],
+            } for bucket in facets['publication_dates'][-10:]],
+            **format_facets(facets['facets']),
+        }
+    }
+
+
+@allowed_methods(['GET'])
+def search(request):
+    return run_search('search', request)
+
+
 @allowed_methods(['GET'])
 def advanced_search(request):
-    content = request.GET.get('content')
-    start_time = request.GET.get('start_time')
-    end_time = request.GET.get('end_time')
-    source = request.GET.get('source')
-    concept = request.GET.get('concept')
-    institution = request.GET.get('institution')
-    order_by = request.GET.get('order_by')
-    order_term = request.GET.get('order_term')
-    page_number = request.GET.get('page_number')
-
-    if not content:
+    return run_search('advanced_search', request)
+
+
+@allowed_methods(['GET'])
+def get_search_facets(request):
+    """
+    搜索结果的年份分布和分面, token来自search/advanced_search的facets_token
+    """
+    query = get_registered_query(request.GET.get('token', ''))
+    if query is None:
         return JsonResponse({
             'code': PARAMS_ERROR,
             'error': True,
-            'message': 'please input search text.',
+            'message': 'search expired, please search again.',
             'data': {}
         })
-    search = Search(using=elasticsearch_connection, index=INDEX_NAME)
-
-    match = MultiMatch(query=content, fields=['abstract', 'title'])
-    search = search.query(match)
-
-    if start_time or end_time:
-        if start_time:
-            time_range_1 = Q('range', publication_date={'gte': start_time})
-            search = search.query(time_range_1)
-        if end_time:
-            time_range_2 = Q('range', publication_date={'lte': end_time})
-            search = search.query(time_range_2)
-
-    if source:
-        # query = Q("nested", path="locations",
-        #           query=Q("nested", path="locations.source",
-        #                   query=Q("term", locations__source__id=source)))
-        query = Q("nested", path="locations",
-                  query=Q("term", locations__source__id=source))
-        # print(query.to_dict())
-        search = search.query(query)
-
-    if concept:
-        query = Q("nested", path="concepts",
-                  query=Q("match", concepts__display_name=concept))
-        search = search.query(query)
-
-    if institution:
-        query = Q("nested", path="authorships",
-                  query=Q("nested", path="authorships.institutions",
-                          query=Q('term', authorships__institutions__id=institution)))
-        search = search.query(query)
-
-    if order_by:
-        sort_by = None
-        if order_by == 'default':
-            sort_by = '_score'
-        if order_by == 'cited_by_count':
-            sort_by = 'cited_by_count'
-        elif order_by == 'time':
-            sort_by = 'publication_date'
-
-        if order_term == 'asc':
-            sort_by = '-' + sort_by
-        search = search.sort(sort_by)
-    search = search.source(['publication_date', 'type', 'language',
-                            'visit_count', 'cited_by_count', 'id',
-                            'authorships', 'abstract', 'title', 'locations'])
-    search = search.highlight('title', 'abstract')
-    if page_number:
-        page_number = int(page_number)
-        search = search[(page_number - 1) * page_size:(page_number - 1) * page_size + page_size - 1]
-    # pprint(search.to_dict())
-    search = search.params(min_score=min_score_threshold)
-    search.aggs.bucket('publication_dates', 'date_histogram', field='publication_date', calendar_interval='1y')
-    search.aggs.bucket('authors', 'nested', path='authorships').bucket(
-        'top_authors', 'terms', field='authorships.author.id', size=10, order={'_count': 'desc'}  # 指定降序排序
-    ).bucket('author_info', 'top_hits', size=1)
-    search.aggs.bucket('concepts', 'nested', path='concepts').bucket(
-        'top_concepts', 'terms', field='concepts.id', size=10, order={'_count': 'desc'}
-    ).bucket('concept_info', 'top_hits', size=1)
-    search.aggs.bucket('authorships', 'nested', path='authorships').bucket(
-        'institutions', 'nested', path='authorships.institutions'
-    ).bucket('top_institutions', 'terms', field='authorships.institutions.id', size=10,
-             order={'_count': 'desc'}).bucket(
-        'institution_info', 'top_hits', size=1
-    )
-    search.aggs.bucket('locations', 'nested', path='locations').bucket('top_sources', 'terms',
-                                                                       field='locations.source.id', size=10,
-                                                                       order={'_count': 'desc'}).bucket('source_info',
-                                                                                                        'top_hits',
-                                                                                                        size=1)
-    key = json.dumps(search.to_dict())
-    if cache.get(key) is None:
-        response = search.execute()
-        response = response.to_dict()
-        cache.set(key, response, 60*60)
-    else:
-        response = cache.get(key)
-    publication_dates = response['aggregations']['publication_dates']['buckets'][-10:]
-    top_authors = response['aggregations']['authors']['top_authors']['buckets']
-    top_concepts = response['aggregations']['concepts']['top_concepts']['buckets']
-    top_institutions = response['aggregations']['authorships']['institutions']['top_institutions']['buckets']
-    top_sources = response['aggregations']['locations']['top_sources']['buckets']
+    facets, _ = get_facets_response(query['kind'], query['params'])
     return JsonResponse({
         'code': SUCCESS,
         'error': False,
         'message': 'OK',
-        'data': {
-            'count': search.count(),
-            'data': [{
-                'highlight': hit['highlight'],
-                'other': {
-                    **hit['_source'],
-                    'citation': get_citation(hit['_source']),
-                }
-            } for hit in response['hits']['hits']],
-            'statistics': {
-                'docs_by_year': [{
-                    'doc_count': bucket['doc_count'],
-                    'year': bucket['key_as_string'][0:4],
-                } for bucket in publication_dates],
-                'top_authors': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['author_info']['hits']['hits'][0]['_source']['author'][
-                            'display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_authors
-                ],
-                'top_concepts': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['concept_info']['hits']['hits'][0]['_source']['display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_concepts
-                ],
-                'top_institutions': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['institution_info']['hits']['hits'][0]['_source']['display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_institutions
-                ],
-                'top_sources': [
-                    {
-                        'id': bucket['key'],
-                        'display_name': bucket['source_info']['hits']['hits'][0]['_source']['source']['display_name'],
-                        'doc_count': bucket['doc_count'],
-                    }
-                    for bucket in top_sources
-                ],
-            }
-        },
+        'data': format_statistics(facets)
     })
 
 
+def fetch_work(id: str) -> dict:
+    """
+    论文详情及引用、相关论文的标题, 不存在时为{}
+    """
+    data = get_entity(INDEX_NAME, id)
+    if data is None:
+        return {}
+    data['citation'] = get_citation(data)
+    # 引用和相关论文一次mget取回
+    linked_ids = data['referenced_works'] + data['related_works']
+    linked_works = mget_entities(INDEX_NAME, linked_ids, ['title', 'cited_by_count', 'pdf_url'])
+    info = [{
+        'id': work_id,
+        'title': work['title'],
+        'cited_by_count': work['cited_by_count'],
+        'pdf_url': work['pdf_url'],
+    } if work is not None else None for work_id, work in zip(linked_ids, linked_works)]
+    split = len(data['referenced_works'])
+    data['referenced_works_info'] = [work for work in info[:split] if work is not None]
+    data['related_works_info'] = [work for work in info[split:] if work is not None]
+    data.pop('referenced_works', None)
+    data.pop('related_works', None)
+    return data
+
+
 # @login_required
 @allowed_methods(['GET'])
 def get_work(request):
     user_id = request.GET.get('user_id')
     if user_id:
-        id = request.GET.get('id')
-        if cache.get(id) is None:
-            search = Search(using=elasticsearch_connection, index=INDEX_NAME)
-            search = search.filter('term', id=id)
-            response = search.execute()
-            if len(response.hits) > 0:
-                data = [hit.to_dict() for hit in response][0]
-                data['citation'] = get_citation(data)
-                info = []
-                for referenced_work in data['referenced_works']:
-                    s = Search(using=elasticsearch_connection, index=INDEX_NAME)
-                    s = s.filter('term', id=referenced_work)
-                    res = s.execute()
-                    if len(res.hits) > 0:
-                        res = [hit.to_dict() for hit in res][0]
-                        info.append({
-                            'id': referenced_work,
-                            'title': res['title'],
-                            'cited_by_count': res['cited_by_count'],
-                            'pdf_url': res['pdf_url'],
-                        })
-                data['referenced_works_info'] = info
-                info = []
-                for related_work in data['related_works']:
-                    s = Search(using=elasticsearch_connection, index=INDEX_NAME)
-                    s = s.filter('term', id=related_work)
-                    res = s.execute()
-                    if len(res.hits) > 0:
-                        res = [hit.to_dict() for hit in res][0]
-                        info.append({
-                            'id': related_work,
-                            'title': res['title'],
-                            'cited_by_count': res['cited_by_count'],
-                            'pdf_url': res['pdf_url']
-                        })
-                data['related_works_info'] = info
-                data.pop('referenced_works', None)
-                data.pop('related_works', None)
-            else:
-                data = {}
-            cache.set(id, data, timeout=60 * 60)
-        else:
-            data = cache.get(id)
+        id = request.GET.get('id', '')
+        data, _ = get_or_compute('work_detail', fetch_work, [id], soft_timeout=WORK_TIMEOUT)
         key = 'visit_' + id
         if cache.get(key) is None:
             cache.set(key, set(user_id), timeout=60 * 60)
@@ -379,27 +193,9 @@ def get_popular_works(request):
     institution_id = request.GET.get('institution_id')
     concept_id = request.GET.get('concept_id')
 
-    search = Search(using=elasticsearch_connection, index=INDEX_NAME)
-    key = 'popular_works'
-    if institution_id:
-        key = key + '_' + institution_id
-        nested_query = Q('term', corresponding_institution_ids=institution_id)
-        search = search.query(nested_query)
-    elif concept_id:
-        key = key + '_' + concept_id
-        nested_query = Q('nested', path='concepts', query=Q('term', concepts__id=concept_id))
-        search = search.query(nested_query)
-    if cache.get(key):
-        data = cache.get(key)
-    else:
-        search = search.sort('-cited_by_count')
-        search = search.source(['publication_date', 'visit_count', 'cited_by_count', 'id', 'title', 'authorships'])
-        search = search.extra(size=200)
-        response = search.execute()
-        data = [hit.to_dict() for hit in response]
-        cache.set(key, data, timeout=None)
-    if data:
-        data = weighted_random_choice(data)
+    # 候选池和别名表一起缓存, 由定时任务刷新
+    pool = get_pool(institution_id, concept_id)
+    data = sample_pool(pool, 10)
 
     return JsonResponse({
         'code': SUCCESS,
@@ -415,75 +211,43 @@ def get_popular_works(request):
 @allowed_methods(['GET'])
 def get_suggestion(request):
     content = request.GET.get('content')
-    search = Search(using=elasticsearch_connection, index=INDEX_NAME)
-    search = search.suggest('suggestion-work', content, completion={'field': 'title.suggestion'})
-    search = search.source('title')
-    response = search.execute()
-    results = response.suggest['suggestion-work'][0]['options']
+    # 输入框每次按键都会请求, 先查进程内前缀树和redis缓存
+    suggestions = get_suggestions(content)
     return JsonResponse({
         'code': SUCCESS,
         'error': False,
         'message': 'OK',
         'data': {
-            'suggestions': [result['text'] for result in results]
+            'suggestions': suggestions
         }
     })
 
 
-def get_client_ip(request):
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
-
-
-gpt = None
-
-
 @allowed_methods(['GET'])
+@login_required
 def get_reply(request):
-    global gpt
-    from langchain.chat_models import ChatOpenAI
-    from langchain.embeddings.openai import OpenAIEmbeddings
-    from langchain.vectorstores import Chroma
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain.document_loaders.pdf import PyPDFLoader
-    from langchain.chains.retrieval_qa.base import RetrievalQA
-    import os
-    # 提示用户输入文件名，支持pdf文件和普通文本文件
-    # file_path = input("input pdf path: ")
     msg = request.GET.get('msg', '')
     url = request.GET.get('pdf_url', '')
-    os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
-    os.environ["OPENAI_API_BASE"] = "https://api.132999.xyz/v1"
-    # 根据文件类型来定义一个loader
-    destination_file = "./currentPDF.pdf"
-    download_ret = download_webpage(url, destination_file)
-    if download_ret != '':
-        # 将错误信息转换为字符串
-        download_ret = str(download_ret)
+    # 会话按登录用户区分, 与后台问答任务(submit_reply)共用
+    owner = request.user.email
+    # 切分和嵌入结果按pdf_url持久化在磁盘上, 同一篇论文的追问只需要检索和调用一次LLM
+    try:
+        reply = ask(owner, msg, url)
+    except PaperDownloadError as e:
         return JsonResponse({
             'code': PARAMS_ERROR,
             'error': True,
             'message': '下载失败',
-            'data': download_ret
+            'data': str(e)
+        })
+    except PaperSessionError as e:
+        # 没有pdf_url, 也没有之前的会话
+        return JsonResponse({
+            'code': PARAMS_ERROR,
+            'error': True,
+            'message': str(e),
+            'data': {}
         })
-    loader = PyPDFLoader(destination_file)
-    # 定义文本分块的规则
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-    chunks = loader.load_and_split(splitter)
-    # 定义文本的embedding，也就是如何把文本转换为向量
-    embeddings = OpenAIEmbeddings()
-    # 实现一个本地的文档语义搜索，在存入一堆chunk之后，能够随时检索和问题最相关的一些chunk
-    db = Chroma.from_documents(chunks, embeddings)
-    # 本地搜索到的chunk会作为context，
-    llm = ChatOpenAI(temperature=0)
-    # chain是LangChain里的概念，其实就相当于定义了一个流程，这里我们提供的参数就是文档语义搜索工具以及LLM
-    chain = RetrievalQA.from_chain_type(llm, retriever=db.as_retriever())
-    gpt = chain
-    reply = chain(msg)
     # 返回结果
     return JsonResponse({
         'code': SUCCESS,
@@ -495,37 +259,21 @@ def get_reply(request):
     })
 
 
-def download_webpage(url, destination_file):
-    import io
-    try:
-        # 发送GET请求获取网页内容
-        send_headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36",
-            "Connection": "keep-alive",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
-            "Accept-Language": "zh-CN,zh;q=0.8"}
-        response = requests.get(url, headers=send_headers)
-        response.raise_for_status()  # 如果请求不成功，抛出异常
-        bytes_io = io.BytesIO(response.content)
-        # 将网页内容写入本地文件
-        with open(destination_file, 'wb') as file:
-            # file.truncate()
-            file.write(bytes_io.getvalue())
-        return ''
-    except requests.exceptions.RequestException as e:
-        return e
-
-
 @allowed_methods(['GET'])
+@login_required
 def get_quick_reply(request):
-    global gpt
-    import os
-    # 提示用户输入文件名，支持pdf文件和普通文本文件
-    # file_path = input("input pdf path: ")
     msg = request.GET.get('msg', '')
-    os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
-    os.environ["OPENAI_API_BASE"] = "https://api.132999.xyz/v1"
-    reply = gpt(msg)
+    owner = request.user.email
+    # 不传pdf_url时接着该用户最近的会话提问
+    try:
+        reply = ask(owner, msg, request.GET.get('pdf_url'))
+    except (PaperSessionError, PaperDownloadError) as e:
+        return JsonResponse({
+            'code': PARAMS_ERROR,
+            'error': True,
+            'message': str(e),
+            'data': {}
+        })
     return JsonResponse({
         'code': SUCCESS,
         'error': False,
@@ -536,20 +284,34 @@ def get_quick_reply(request):
     })
 
 
-def weighted_random_choice(weighted_works):
-    # 提取权重和元素
-    weights = np.array([work['cited_by_count'] for work in weighted_works])
-    elements = np.array(weighted_works)
-
-    # 计算累积权重
-    cum_weights = np.cumsum(weights)
+@allowed_methods(['GET'])
+@login_required
+def submit_reply(request):
+    """
+    提交后台问答任务, 立即返回job_id; 下载/切分/嵌入进度和回答通过websocket推送
+    """
+    msg = request.GET.get('msg', '')
+    if not msg:
+        return response(PARAMS_ERROR, '问题不能为空', error=True)
+    user_email = request.user.email
+    job_id = uuid.uuid4().hex
+    cache.set(job_key(job_id), {'user': user_email, 'status': 'pending'}, JOB_TIMEOUT)
+    paper_qa_job.delay(job_id, user_email, msg, request.GET.get('pdf_url') or None)
+    return response(SUCCESS, '提交成功', {'job_id': job_id})
 
-    # 从累积权重中进行随机选择
-    chosen_indices = np.searchsorted(cum_weights, np.random.rand(10) * cum_weights[-1])
 
-    # 返回选择的结果
-    chosen_work = elements[chosen_indices]
-    return chosen_work.tolist()
+@allowed_methods(['GET'])
+@login_required
+def get_reply_job(request):
+    """
+    查询后台问答任务状态, 供无法使用websocket的客户端轮询
+    """
+    job = cache.get(job_key(request.GET.get('job_id', '')))
+    if job is None or job['user'] != request.user.email:
+        return response(PARAMS_ERROR, '任务不存在', error=True)
+    job = dict(job)
+    job.pop('user')
+    return response(SUCCESS, 'OK', job)
 
 
 def get_citation(data):